@@ -0,0 +1,407 @@
+"""
+Vectorized geometry kernels shared by the CLI and the web backend.
+
+Every function works on numpy arrays (or anything broadcastable to them) of
+latitudes/longitudes in decimal degrees, so a whole set of points, segments or
+edges is processed in a single call instead of one haversine per pair.
+"""
+import heapq
+
+import numpy as np
+from scipy.spatial import Delaunay
+
+# Same mean radius as the `haversine` package, so results match exactly
+EARTH_RADIUS_KM = 6371.0088
+
+# Coordinate keys (pack_coords): microdegrees, offset so both parts are non-negative
+MICRODEGREES = 1_000_000
+COORD_OFFSET = np.array([90, 180], dtype=np.int64) * MICRODEGREES
+
+
+def haversine(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Great-circle distance in km between (lat1, lon1) and (lat2, lon2), element-wise."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=np.float64)) for a in (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) * 0.5) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) * 0.5) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def haversine_points(points1, points2) -> np.ndarray:
+    """Distance in km between two arrays of (lat, lon) rows (shapes broadcast)."""
+    p1 = np.asarray(points1, dtype=np.float64)
+    p2 = np.asarray(points2, dtype=np.float64)
+    return haversine(p1[..., 0], p1[..., 1], p2[..., 0], p2[..., 1])
+
+
+def pack_coords(coords) -> np.ndarray:
+    """
+    Exact int64 key of every (lat, lon) row, quantized to microdegrees (~0.1 m).
+
+    Latitude and longitude become offset int32 microdegrees packed in the high
+    and low 32 bits, so keys sort like (lat, lon) tuples and points closer than
+    the quantum share a key.
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    micro = np.round(coords * MICRODEGREES).astype(np.int64) + COORD_OFFSET
+    return (micro[:, 0] << 32) | micro[:, 1]
+
+
+def unpack_coords(keys) -> np.ndarray:
+    """(lat, lon) rows of keys made by pack_coords."""
+    keys = np.asarray(keys, dtype=np.int64).reshape(-1)
+    micro = np.column_stack([keys >> 32, keys & 0xFFFFFFFF]) - COORD_OFFSET
+    return micro / MICRODEGREES
+
+
+def path_lengths(coords) -> np.ndarray:
+    """Length in km of every consecutive step of a (n, 2) polyline."""
+    coords = np.asarray(coords, dtype=np.float64)
+    return haversine_points(coords[:-1], coords[1:])
+
+
+def bearing(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Initial bearing in degrees [0, 360) from (lat1, lon1) towards (lat2, lon2)."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=np.float64)) for a in (lat1, lon1, lat2, lon2))
+    dlon = lon2 - lon1
+    x = np.sin(dlon) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+    return np.degrees(np.arctan2(x, y)) % 360.0
+
+
+def turn_angle(p1, p2, p3) -> np.ndarray:
+    """
+    Angle in degrees at p2 formed by p1-p2-p3 (180 means a straight line).
+
+    Points are (..., 2) arrays of (lat, lon). Degenerate triples, where p2
+    coincides with one of its neighbours, are reported as straight (180).
+    """
+    p1, p2, p3 = (np.asarray(p, dtype=np.float64) for p in (p1, p2, p3))
+    b21 = bearing(p2[..., 0], p2[..., 1], p1[..., 0], p1[..., 1])
+    b23 = bearing(p2[..., 0], p2[..., 1], p3[..., 0], p3[..., 1])
+    diff = np.abs(b21 - b23) % 360.0
+    angle = np.where(diff > 180.0, 360.0 - diff, diff)
+    degenerate = np.all(p1 == p2, axis=-1) | np.all(p3 == p2, axis=-1)
+    return np.where(degenerate, 180.0, angle)
+
+
+def project_to_segments(points, seg_start, seg_end):
+    """
+    Project points onto segments and measure the distance to the projection.
+
+    Uses a local equirectangular projection around each point, which is exact
+    to well under a metre at trail-segment scale. All arguments are (..., 2)
+    arrays of (lat, lon) and broadcast against each other.
+
+    Returns:
+        (distance_km, t) where t in [0, 1] is the position of the closest
+        point along the segment (0 = seg_start, 1 = seg_end).
+    """
+    p = np.asarray(points, dtype=np.float64)
+    a = np.asarray(seg_start, dtype=np.float64)
+    b = np.asarray(seg_end, dtype=np.float64)
+
+    # Degrees -> km in a plane tangent at the query point
+    kx = np.radians(EARTH_RADIUS_KM) * np.cos(np.radians(p[..., 0]))
+    ky = np.radians(EARTH_RADIUS_KM)
+    ax, ay = (a[..., 1] - p[..., 1]) * kx, (a[..., 0] - p[..., 0]) * ky
+    bx, by = (b[..., 1] - p[..., 1]) * kx, (b[..., 0] - p[..., 0]) * ky
+
+    dx, dy = bx - ax, by - ay
+    length_sq = dx * dx + dy * dy
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = np.where(length_sq > 0, -(ax * dx + ay * dy) / length_sq, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+
+    cx, cy = ax + t * dx, ay + t * dy
+    return np.hypot(cx, cy), t
+
+
+def point_segment_distance(points, seg_start, seg_end) -> np.ndarray:
+    """Distance in km from points to the closest point of the given segments."""
+    return project_to_segments(points, seg_start, seg_end)[0]
+
+
+def _to_local_km(coords) -> np.ndarray:
+    """Project a (n, 2) (lat, lon) polyline to planar (x, y) km around its mean latitude."""
+    coords = np.asarray(coords, dtype=np.float64)
+    k = np.radians(EARTH_RADIUS_KM)
+    x = coords[:, 1] * k * np.cos(np.radians(coords[:, 0].mean()))
+    y = coords[:, 0] * k
+    return np.column_stack([x, y])
+
+
+def _planar_segment_distance(p: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Planar distance from (m, 2) points p to the segment a-b."""
+    d = b - a
+    length_sq = float(d @ d)
+    if length_sq == 0.0:
+        return np.hypot(*(p - a).T)
+    t = np.clip((p - a) @ d / length_sq, 0.0, 1.0)
+    return np.hypot(*(p - (a + t[:, None] * d)).T)
+
+
+def douglas_peucker(coords, tolerance_km: float) -> np.ndarray:
+    """
+    Douglas–Peucker simplification of a (lat, lon) polyline.
+
+    Returns a boolean mask of the vertices to keep: every dropped vertex lies
+    within `tolerance_km` of the simplified line. Endpoints are always kept.
+    """
+    n = len(coords)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[[0, n - 1]] = True
+    if n < 3:
+        return keep
+
+    xy = _to_local_km(coords)
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        dists = _planar_segment_distance(xy[i + 1:j], xy[i], xy[j])
+        k = int(dists.argmax())
+        if dists[k] > tolerance_km:
+            k += i + 1
+            keep[k] = True
+            stack.append((i, k))
+            stack.append((k, j))
+    return keep
+
+
+def visvalingam_whyatt(coords, tolerance_km: float) -> np.ndarray:
+    """
+    Visvalingam–Whyatt simplification of a (lat, lon) polyline.
+
+    Repeatedly drops the vertex whose triangle with its neighbours has the
+    smallest area, until every remaining triangle is at least
+    `tolerance_km` ** 2 (a tolerance-wide square). Returns a boolean mask of
+    the vertices to keep; endpoints are always kept.
+    """
+    n = len(coords)
+    keep = np.ones(n, dtype=bool)
+    if n < 3:
+        return keep
+
+    xy = _to_local_km(coords)
+    min_area = tolerance_km ** 2
+    prev = np.arange(-1, n - 1)
+    nxt = np.arange(1, n + 1)
+
+    def area(i: int) -> float:
+        a, b, c = xy[prev[i]], xy[i], xy[nxt[i]]
+        return abs((b[0] - a[0]) * (c[1] - a[1]) - (c[0] - a[0]) * (b[1] - a[1])) * 0.5
+
+    # Initial areas for all interior vertices in one vectorized pass
+    a, b, c = xy[:-2], xy[1:-1], xy[2:]
+    areas = np.abs((b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (c[:, 0] - a[:, 0]) * (b[:, 1] - a[:, 1])) * 0.5
+    current = np.full(n, np.inf)
+    current[1:-1] = areas
+    heap = [(float(ar), i) for i, ar in zip(range(1, n - 1), areas.tolist())]
+    heapq.heapify(heap)
+
+    while heap:
+        ar, i = heapq.heappop(heap)
+        if not keep[i] or ar != current[i]:
+            continue  # Stale entry
+        if ar >= min_area:
+            break
+        keep[i] = False
+        p, q = prev[i], nxt[i]
+        nxt[p], prev[q] = q, p
+        for j in (p, q):
+            if 0 < j < n - 1:
+                # Never let a neighbour's area drop below the one just removed
+                current[j] = max(area(j), ar)
+                heapq.heappush(heap, (current[j], j))
+    return keep
+
+
+def simplify_polyline(coords, tolerance_km: float, method: str = "douglas_peucker") -> np.ndarray:
+    """Simplify a (n, 2) (lat, lon) polyline with the given method and tolerance."""
+    coords = np.asarray(coords, dtype=np.float64)
+    if tolerance_km <= 0 or len(coords) < 3:
+        return coords
+    if method == "douglas_peucker":
+        return coords[douglas_peucker(coords, tolerance_km)]
+    if method == "visvalingam":
+        return coords[visvalingam_whyatt(coords, tolerance_km)]
+    raise ValueError(f"Unknown simplification method: {method}")
+
+
+def encode_polyline(coords, precision: int = 5) -> str:
+    """
+    Encode a (n, 2) (lat, lon) polyline in the Google encoded polyline format.
+
+    Every coordinate delta is zigzag-encoded and split into 5-bit chunks; all
+    values are encoded at once with array operations.
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if len(coords) == 0:
+        return ""
+    values = np.round(coords * 10 ** precision).astype(np.int64)
+    deltas = np.diff(values, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    zigzag = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+
+    shifts = 5 * np.arange(7)  # 7 chunks hold any 32-bit value
+    chunks = (zigzag[:, None] >> shifts) & 31
+    n_chunks = 1 + ((zigzag[:, None] >> shifts[1:]) > 0).sum(axis=1)
+    used = np.arange(7) < n_chunks[:, None]
+    more = np.arange(7) < n_chunks[:, None] - 1  # All but the last chunk carry the 0x20 flag
+    chars = chunks + 63 + 32 * more
+    return chars[used].astype(np.uint8).tobytes().decode("ascii")
+
+
+def _ring_contains(ring: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """Even-odd rule: which (m, 2) points lie inside a closed (k, 2) ring."""
+    x, y = points[:, 0][:, None], points[:, 1][:, None]
+    x1, y1 = ring[:-1, 0][None, :], ring[:-1, 1][None, :]
+    x2, y2 = ring[1:, 0][None, :], ring[1:, 1][None, :]
+    crosses = (y1 > y) != (y2 > y)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+    return (crosses & (x < x_cross)).sum(axis=1) % 2 == 1
+
+
+def points_in_polygon(points, ring) -> np.ndarray:
+    """
+    Which (m, 2) (lat, lon) points lie inside a polygon ring (closed or not).
+
+    Only points inside the ring's bounding box are tested, in chunks that
+    keep the (points, ring edges) work arrays small.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    ring = np.asarray(ring, dtype=np.float64).reshape(-1, 2)
+    if len(ring) and not np.array_equal(ring[0], ring[-1]):
+        ring = np.vstack([ring, ring[:1]])
+    inside = np.zeros(len(points), dtype=bool)
+    if len(ring) < 4:
+        return inside
+    candidates = np.flatnonzero(((points >= ring.min(axis=0)) & (points <= ring.max(axis=0))).all(axis=1))
+    chunk = max(1, (1 << 22) // len(ring))
+    for lo in range(0, len(candidates), chunk):
+        idx = candidates[lo:lo + chunk]
+        inside[idx] = _ring_contains(ring, points[idx])
+    return inside
+
+
+def _segments_cross_ring(ring: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Which (m, 2) segments intersect (or touch) an edge of a closed (k, 2) ring."""
+    a, b = starts[:, None, :], ends[:, None, :]
+    c, d = ring[:-1][None, :, :], ring[1:][None, :, :]
+
+    def orient(p, q, r):
+        return np.sign((q[..., 0] - p[..., 0]) * (r[..., 1] - p[..., 1]) - (q[..., 1] - p[..., 1]) * (r[..., 0] - p[..., 0]))
+
+    def within(p, q, r):
+        # r on the bounding box of p-q (used for collinear touches)
+        return ((np.minimum(p, q) <= r) & (r <= np.maximum(p, q))).all(axis=-1)
+
+    o1, o2, o3, o4 = orient(a, b, c), orient(a, b, d), orient(c, d, a), orient(c, d, b)
+    proper = (o1 * o2 < 0) & (o3 * o4 < 0)
+    touch = (
+        ((o1 == 0) & within(a, b, c)) | ((o2 == 0) & within(a, b, d))
+        | ((o3 == 0) & within(c, d, a)) | ((o4 == 0) & within(c, d, b))
+    )
+    return (proper | touch).any(axis=1)
+
+
+def segments_cross_polygon(starts, ends, ring) -> np.ndarray:
+    """
+    Which (m, 2) (lat, lon) segments cross the boundary of a polygon ring
+    (closed or not), e.g. a polyline step passing through a small polygon
+    with both of its vertices outside.
+
+    Only segments whose bounding box meets the ring's are tested, in chunks
+    that keep the (segments, ring edges) work arrays small.
+    """
+    starts = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=np.float64).reshape(-1, 2)
+    ring = np.asarray(ring, dtype=np.float64).reshape(-1, 2)
+    if len(ring) and not np.array_equal(ring[0], ring[-1]):
+        ring = np.vstack([ring, ring[:1]])
+    crossing = np.zeros(len(starts), dtype=bool)
+    if len(ring) < 4:
+        return crossing
+    lo, hi = np.minimum(starts, ends), np.maximum(starts, ends)
+    candidates = np.flatnonzero(((hi >= ring.min(axis=0)) & (lo <= ring.max(axis=0))).all(axis=1))
+    chunk = max(1, (1 << 20) // len(ring))
+    for first in range(0, len(candidates), chunk):
+        idx = candidates[first:first + chunk]
+        crossing[idx] = _segments_cross_ring(ring, starts[idx], ends[idx])
+    return crossing
+
+
+def concave_hull(points, max_edge_km: float) -> list:
+    """
+    Concave hull of a set of (lat, lon) points.
+
+    Keeps the Delaunay triangles whose edges are all at most `max_edge_km`
+    long and traces the boundary of their union. Falls back to the convex
+    hull when no triangle is short enough.
+
+    Returns:
+        List of polygons, each a list of closed (k, 2) (lat, lon) rings: the
+        outer ring (counter-clockwise) followed by its holes (clockwise)
+    """
+    points = np.unique(np.asarray(points, dtype=np.float64).reshape(-1, 2), axis=0)
+    if len(points) < 3:
+        return []
+    xy = _to_local_km(points)
+    try:
+        triangles = Delaunay(xy).simplices
+    except Exception:
+        return []  # All points collinear
+
+    a, b, c = xy[triangles[:, 0]], xy[triangles[:, 1]], xy[triangles[:, 2]]
+    longest = np.max([np.hypot(*(a - b).T), np.hypot(*(b - c).T), np.hypot(*(c - a).T)], axis=0)
+    keep = longest <= max_edge_km
+    if keep.any():
+        triangles, a, b, c = triangles[keep], a[keep], b[keep], c[keep]
+
+    # Orient every triangle counter-clockwise; the union's boundary is then made
+    # of the directed edges whose reverse is not used by another triangle
+    clockwise = ((b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (c[:, 0] - a[:, 0]) * (b[:, 1] - a[:, 1])) < 0
+    triangles = np.where(clockwise[:, None], triangles[:, [0, 2, 1]], triangles)
+    edges = np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+    n = len(points)
+    forward = edges[:, 0] * n + edges[:, 1]
+    backward = edges[:, 1] * n + edges[:, 0]
+    boundary = edges[~np.isin(forward, backward)]
+
+    following: dict = {}
+    for start, end in boundary.tolist():
+        following.setdefault(start, []).append(end)
+
+    outers, holes = [], []
+    while following:
+        first = next(iter(following))
+        ring = [first]
+        node = first
+        while True:
+            ends = following[node]
+            nxt = ends.pop()
+            if not ends:
+                del following[node]
+            ring.append(nxt)
+            node = nxt
+            if node == first:
+                break
+        ring = np.array(ring)
+        ring_xy = xy[ring]
+        area = np.sum(ring_xy[:-1, 0] * ring_xy[1:, 1] - ring_xy[1:, 0] * ring_xy[:-1, 1]) / 2
+        (outers if area > 0 else holes).append(ring)
+
+    polygons = [[points[ring]] for ring in outers]
+    for hole in holes:
+        # The midpoint of a hole edge is never on an outer ring (vertices may be)
+        probe = (xy[hole[:1]] + xy[hole[1:2]]) / 2
+        for polygon, ring in zip(polygons, outers):
+            if _ring_contains(xy[ring], probe)[0]:
+                polygon.append(points[hole])
+                break
+    return polygons
@@ -3,6 +3,7 @@ from graphmaker import make_graph, simplify_graph
 from viewer import *
 from monuments import get_monuments, Monument, Monuments
 from routes import *
+from geometry import haversine_points, point_segment_distance
 
 from rich.console import Console
 from rich.markdown import Markdown
@@ -43,30 +44,18 @@ class Settings:
 
 def _closest_point(graph: nx.Graph, point: Point) -> Point:
     """Find the closest node to the given point."""
-    min_dist = float("inf")
-    for node in graph.nodes:
-        dist = haversine((point.lat, point.lon), (node.lat, node.lon))
-        if dist < min_dist:
-            min_dist = dist
-            closest_point = node
-    return closest_point
+    nodes = list(graph.nodes)
+    coords = [(node.lat, node.lon) for node in nodes]
+    dists = haversine_points(coords, (point.lat, point.lon))
+    return nodes[int(dists.argmin())]
 
 
 def _closest_edge(m: Monument, segments: Segments) -> Segment:
     """Find the closest edge to the monument."""
-    min_dist = float("inf")
-    for segment in segments:
-        dist_end = haversine(
-            (m.location.lat, m.location.lon), (segment.end.lat, segment.end.lon)
-        )
-        dist_start = haversine(
-            (m.location.lat, m.location.lon), (segment.start.lat, segment.start.lon)
-        )
-        dist = min(dist_end, dist_start)
-        if dist < min_dist:
-            min_dist = dist
-            closest_edge = segment
-    return closest_edge
+    starts = [(s.start.lat, s.start.lon) for s in segments]
+    ends = [(s.end.lat, s.end.lon) for s in segments]
+    dists = point_segment_distance((m.location.lat, m.location.lon), starts, ends)
+    return segments[int(dists.argmin())]
 
 
 def _monuments_in_box(m: Monuments, box: Box) -> Monuments:
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Test reuse of stored cluster centers across overlapping boxes:
+- Cold: every box clustered from scratch (ShardedClustering without a store)
+- Warm: boxes clustered with a ClusterCenterStore; points of tiles covered by an
+  earlier box take its centers and only the rest is clustered
+- Consistency: share of points in the overlap given the same center in both boxes
+
+Usage:
+    python test_cluster_store_speed.py
+
+Synthetic trail-like points (random walks) are used; a box slides by half its
+side each step, so every box overlaps the previous one. Stored centers are kept
+in a temporary directory.
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent / "web" / "backend"))
+sys.path.insert(0, str(Path(__file__).parent / "skeleton"))
+from models import BoxModel, PointModel  # noqa: E402
+from services.clustering import ClusterCenterStore, ShardedClustering  # noqa: E402
+
+N_CLUSTERS = 500  # settings_file.json
+BOX_TILES = 2  # Box side in clustering tiles
+STEPS = 4  # Boxes, each shifted by half a box to the north-east
+WALKS_PER_TILE = 150
+
+
+def trail_points(size: float, seed: int = 0) -> np.ndarray:
+    """Random walks of 40 points (~30 m steps) over a size x size degree square"""
+    rng = np.random.default_rng(seed)
+    tiles = (size / ShardedClustering.TILE_DEGREES) ** 2
+    starts = rng.uniform([41.5, 1.5], [41.5 + size, 1.5 + size], size=(int(WALKS_PER_TILE * tiles), 2))
+    steps = rng.normal(size=(len(starts), 1, 2)) * 0.0003 + rng.normal(size=(len(starts), 40, 2)) * 0.0001
+    return (starts[:, None, :] + np.cumsum(steps, axis=1)).reshape(-1, 2)
+
+
+def boxes():
+    side = BOX_TILES * ShardedClustering.TILE_DEGREES
+    for step in range(STEPS):
+        lat, lon = 41.52 + step * side / 2, 1.52 + step * side / 2
+        yield BoxModel(bottom_left=PointModel(lat=lat, lon=lon),
+                       top_right=PointModel(lat=lat + side, lon=lon + side))
+
+
+def inside(points: np.ndarray, box: BoxModel) -> np.ndarray:
+    return ((points[:, 0] >= box.bottom_left.lat) & (points[:, 0] <= box.top_right.lat)
+            & (points[:, 1] >= box.bottom_left.lon) & (points[:, 1] <= box.top_right.lon))
+
+
+def agreement(previous, current) -> float:
+    """Share of points found in both boxes that got the same center coordinates"""
+    shared = set(previous) & set(current)
+    return sum(previous[p] == current[p] for p in shared) / max(len(shared), 1)
+
+
+def test_cluster_store_speeds():
+    """Compare clustering overlapping boxes from scratch and from stored centers"""
+
+    print("🧪 Stored Cluster Centers Comparison\n")
+    print("=" * 70)
+
+    side = BOX_TILES * ShardedClustering.TILE_DEGREES
+    points = trail_points(side * (STEPS + 1) / 2 + 0.05)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = {
+            "Cold (OLD)": ShardedClustering(max_workers=1),
+            "Warm (NEW)": ShardedClustering(max_workers=1, store=ClusterCenterStore(Path(tmp))),
+        }
+        totals = {}
+        for label, clustering in runs.items():
+            print(f"\n📊 {label}")
+            print("-" * 70)
+            total, previous, agree = 0.0, None, []
+            for number, box in enumerate(boxes(), 1):
+                box_points = points[inside(points, box)]
+                start = time.perf_counter()
+                centers, labels = clustering.cluster(box_points, N_CLUSTERS, box)
+                seconds = time.perf_counter() - start
+                total += seconds
+                current = dict(zip(map(tuple, box_points.tolist()), map(tuple, centers[labels].tolist())))
+                if previous is not None:
+                    agree.append(agreement(previous, current))
+                previous = current
+                clustered = clustering.last_report.get("clustered_points", len(box_points))
+                print(f"  Box {number}: {seconds:6.2f}s  {len(box_points):7,} points, "
+                      f"{clustered:7,} clustered, {len(centers):5,} clusters")
+            totals[label] = total
+            print(f"  Total {total:6.2f}s, same center in overlaps: {np.mean(agree) * 100:5.1f}%")
+
+    old, new = totals.values()
+    print("\n" + "=" * 70)
+    print(f"\n⚡ Warm start: {old / max(new, 1e-9):.1f}x faster over {STEPS} overlapping boxes")
+    print("\n✅ Summary:")
+    print("  • Tiles covered by an earlier box reuse its centers; only uncovered points are clustered")
+    print("  • Points in an overlap keep their center from one request to the next")
+    print("  • Centers are stored per tile and per clustering parameters")
+    print()
+
+
+if __name__ == "__main__":
+    test_cluster_store_speeds()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Test which edges an avoid polygon masks (EdgeMaskService.edges_in_polygons):
+- Correctness: a polygon sitting on an edge between two of its geometry
+  points masks the edge; a polygon beside it does not
+- Vertices only (OLD) against vertices plus boundary crossings (NEW): edges
+  masked by small polygons over a simplified network, and the time taken
+
+Usage:
+    python test_edge_mask_speed.py
+
+A synthetic trail network (jittered ~0.4 km grid, simplified, so most edges
+keep only a few geometry points) is used.
+"""
+
+import random
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent / "web" / "backend"))
+sys.path.insert(0, str(Path(__file__).parent / "skeleton"))
+from models import PointModel  # noqa: E402
+from services.edge_masks import EdgeMaskService  # noqa: E402
+from services.graph import GraphService  # noqa: E402
+from services.trail_graph import TrailGraph  # noqa: E402
+from geometry import points_in_polygon  # noqa: E402
+
+POLYGONS = 200  # Random avoid polygons
+POLYGON_SIDE = 0.0005  # Degrees (~50 m): closures and small avoid areas
+REPEATS = 3  # Best of
+
+
+def square(lat: float, lon: float, side: float):
+    return [[lat - side / 2, lon - side / 2], [lat - side / 2, lon + side / 2],
+            [lat + side / 2, lon + side / 2], [lat + side / 2, lon - side / 2]]
+
+
+def synthetic_graph(size: int = 120, seed: int = 0) -> TrailGraph:
+    """Jittered trail grid (~0.4 km blocks), each block side one straight segment"""
+    rng = random.Random(seed)
+    step = 0.004
+    nodes = {(i, j): (41.5 + (i + rng.uniform(-0.2, 0.2)) * step, 1.5 + (j + rng.uniform(-0.2, 0.2)) * step)
+             for i in range(size) for j in range(size)}
+    segments = [
+        (PointModel(lat=nodes[i, j][0], lon=nodes[i, j][1]), PointModel(lat=nodes[i + di, j + dj][0], lon=nodes[i + di, j + dj][1]))
+        for i in range(size) for j in range(size) for di, dj in ((1, 0), (0, 1))
+        if i + di < size and j + dj < size and rng.random() < 0.8
+    ]
+    return TrailGraph.from_networkx(GraphService.simplify_graph(GraphService.make_graph(segments)))
+
+
+def vertex_only(graph: TrailGraph, polygons) -> np.ndarray:
+    """Edges with a geometry point inside a polygon (the rule before crossings were tested)"""
+    hit = np.zeros(graph.n_edges, dtype=bool)
+    vertex_edge = np.repeat(np.arange(graph.n_edges), np.diff(graph.geom_offsets))
+    for polygon in polygons:
+        hit[vertex_edge[points_in_polygon(graph.geom_coords, polygon)]] = True
+    return hit
+
+
+def test_edge_mask_speeds():
+    """Check polygons between geometry points and compare both masking rules"""
+
+    print("🧪 Edge Mask Comparison\n")
+    print("=" * 70)
+
+    print("\n📊 Polygon between two geometry points")
+    print("-" * 70)
+    # One straight edge of ~1.7 km with no geometry point in its middle
+    edge = GraphService.make_graph([(PointModel(lat=41.5, lon=1.5), PointModel(lat=41.5, lon=1.52))])
+    graph = TrailGraph.from_networkx(edge)
+    on_edge = [square(41.5, 1.51, 0.001)]
+    beside = [square(41.502, 1.51, 0.001)]
+    assert not vertex_only(graph, on_edge).any()
+    assert EdgeMaskService.edges_in_polygons(graph, on_edge).all()
+    assert not EdgeMaskService.edges_in_polygons(graph, beside).any()
+    print("  Polygon on the edge:  masked by NEW, missed by OLD")
+    print("  Polygon beside it:    not masked")
+
+    graph = synthetic_graph()
+    rng = np.random.default_rng(0)
+    lo, hi = graph.node_coords.min(axis=0), graph.node_coords.max(axis=0)
+    polygons = [square(lat, lon, POLYGON_SIDE) for lat, lon in rng.uniform(lo, hi, size=(POLYGONS, 2))]
+
+    print(f"\n📊 {POLYGONS} polygons of ~{POLYGON_SIDE * 1e5:.0f} m over {graph.n_edges:,} edges "
+          f"({len(graph.geom_coords):,} geometry points)")
+    print("-" * 70)
+    results = {}
+    for label, rule in (("Vertices only (OLD)", vertex_only), ("Vertices + crossings (NEW)", EdgeMaskService.edges_in_polygons)):
+        seconds = []
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            hit = rule(graph, polygons)
+            seconds.append(time.perf_counter() - start)
+        results[label] = hit
+        print(f"  {label:28s} {min(seconds):.3f}s  {int(hit.sum()):5,} edges masked")
+    old, new = results.values()
+    assert not (old & ~new).any()
+    print(f"  Edges crossed between geometry points: {int((new & ~old).sum()):,} (open to routing before)")
+
+    print("\n" + "=" * 70)
+    print("\n✅ Summary:")
+    print("  • Simplified edges can pass a small polygon with no geometry point inside it")
+    print("  • Boundary crossings are tested on every geometry step, vectorized per polygon")
+    print("  • Only steps whose bounding box meets the polygon's are tested")
+    print()
+
+
+if __name__ == "__main__":
+    test_edge_mask_speeds()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Test node renumbering for cache-friendly graph searches:
+- Insertion order (as make_graph produced it) vs Hilbert / Morton / reverse Cuthill-McKee
+- Settled nodes per second of full Dijkstra trees (as grown for the tree
+  cache and monument trees) on the renumbered CSR
+
+Usage:
+    python test_graph_order_speed.py [static/<box>/segments.txt ...]
+
+Without arguments a synthetic trail network over central Catalunya is used,
+with its ways in random order like the way ids returned by Overpass.
+"""
+
+import random
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+sys.path.insert(0, str(Path(__file__).parent / "web" / "backend"))
+sys.path.insert(0, str(Path(__file__).parent / "skeleton"))
+from models import PointModel  # noqa: E402
+from services.graph import GraphService  # noqa: E402
+from services.trail_graph import TrailGraph  # noqa: E402
+from geometry import pack_coords  # noqa: E402
+
+ORDERS = ["none", "hilbert", "morton", "rcm"]
+SEARCHES = 30
+
+
+def synthetic_segments(size: int = 450, seed: int = 0):
+    """Jittered grid of trails (~0.4 km blocks), each way split in 3 segments, ways shuffled"""
+    rng = random.Random(seed)
+    step = 0.004
+    ways = []
+    for i in range(size):
+        for j in range(size):
+            for di, dj in ((1, 0), (0, 1)):
+                if i + di < size and j + dj < size and rng.random() < 0.75:
+                    pts = [
+                        (41.5 + (i + di * k / 3) * step + (rng.uniform(-1, 1) * step * 0.1 if 0 < k < 3 else 0),
+                         1.5 + (j + dj * k / 3) * step + (rng.uniform(-1, 1) * step * 0.1 if 0 < k < 3 else 0))
+                        for k in range(4)
+                    ]
+                    ways.append(pts)
+    rng.shuffle(ways)
+    return [
+        (PointModel(lat=a[0], lon=a[1]), PointModel(lat=b[0], lon=b[1]))
+        for pts in ways for a, b in zip(pts, pts[1:])
+    ]
+
+
+def file_segments(path: str):
+    segments = []
+    with open(path) as f:
+        for line in f:
+            lat1, lon1, lat2, lon2 = line.strip().split(",")[:4]
+            segments.append((PointModel(lat=float(lat1), lon=float(lon1)), PointModel(lat=float(lat2), lon=float(lon2))))
+    return segments
+
+
+def settled_per_second(trail_graph: TrailGraph, sources: np.ndarray):
+    """Grow full trees from the given nodes; returns (settled nodes/s, settled total)"""
+    matrix = csr_matrix(
+        (trail_graph.edge_weight[trail_graph.csr_edge], trail_graph.indices, trail_graph.indptr),
+        shape=(trail_graph.n_nodes, trail_graph.n_nodes)
+    )
+    settled = 0
+    start = time.perf_counter()
+    for source in sources:
+        dist = dijkstra(matrix, directed=True, indices=int(source))
+        settled += int(np.isfinite(dist).sum())
+    elapsed = time.perf_counter() - start
+    return settled / elapsed, settled
+
+
+def test_graph_order_speeds():
+    """Compare settled nodes per second for every node order"""
+
+    datasets = [(path, file_segments(path)) for path in sys.argv[1:]] or [("synthetic", synthetic_segments())]
+
+    print("🧪 Node Order Speed Comparison\n")
+    print("=" * 70)
+
+    for name, segments in datasets:
+        graph = GraphService.simplify_graph(GraphService.make_graph(segments))
+        print(f"\n📊 Dataset: {name} ({graph.number_of_nodes():,} nodes, {graph.number_of_edges():,} edges)")
+        print("-" * 70)
+
+        # Same physical start points for every order
+        rng = np.random.default_rng(0)
+        nodes = list(graph.nodes)
+        picks = [nodes[i] for i in rng.choice(len(nodes), size=min(SEARCHES, len(nodes)), replace=False)]
+
+        baseline = None
+        settled_ref = None
+        for order in ORDERS:
+            start = time.perf_counter()
+            trail_graph = TrailGraph.from_networkx(graph, node_order=order)
+            build = time.perf_counter() - start
+            index = {key: i for i, key in enumerate(pack_coords(trail_graph.node_coords).tolist())}
+            sources = np.array([index[p] for p in picks])
+            rate, settled = settled_per_second(trail_graph, sources)
+            if baseline is None:
+                baseline, settled_ref = rate, settled
+                print(f"  {order:8s} (OLD):  {rate / 1e6:6.2f} M settled nodes/s  (build {build:.2f}s)")
+            else:
+                print(f"  {order:8s} (NEW):  {rate / 1e6:6.2f} M settled nodes/s  (build {build:.2f}s)  "
+                      f"⚡ {rate / baseline:.2f}x")
+            assert settled == settled_ref
+
+    print("\n" + "=" * 70)
+    print("\n✅ Summary:")
+    print("  • Every order settles the same nodes: only memory layout changes")
+    print("  • Space-filling curves keep a search frontier in few cache lines")
+    print("  • GraphCache builds graphs in Hilbert order (TrailGraph.node_order)")
+    print()
+
+
+if __name__ == "__main__":
+    test_graph_order_speeds()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Test the process pool of distance matrices (MatrixService):
+- Whether scipy's Dijkstra releases the GIL (if it did, threads would do)
+- Search time of one batch of origins against what a batch costs on a warm
+  pool (sending snaps and weights, returning rows), which sets
+  PARALLEL_MIN_ORIGINS
+- Matrices in one process, on a pool started per request (OLD) and on the
+  long-lived pool of the graph (NEW), plain and on a profile view
+
+Usage:
+    python test_matrix_pool_speed.py
+
+A synthetic trail network (jittered ~0.4 km grid) is used. With a single
+CPU the pools cannot beat one process; the difference to it is their overhead.
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent / "web" / "backend"))
+sys.path.insert(0, str(Path(__file__).parent / "skeleton"))
+from models import PointModel  # noqa: E402
+from services.graph import GraphService  # noqa: E402
+from services.matrix_service import MatrixService  # noqa: E402
+from services.trail_graph import TrailGraph  # noqa: E402
+from services.trail_tags import encode_tags  # noqa: E402
+
+GRID = 200  # Nodes per side (~80 km)
+DESTINATIONS = 50
+MAX_KM = 20.0  # Matrix bound (None = unbounded searches)
+ORIGIN_COUNTS = [32, 64, 128, 256]
+WORKERS = 2
+
+
+def synthetic_graph(size: int = GRID, seed: int = 0) -> TrailGraph:
+    """Jittered trail grid (~0.4 km blocks) of paths and tracks"""
+    rng = random.Random(seed)
+    step = 0.004
+    nodes = {(i, j): PointModel(lat=41.5 + (i + rng.uniform(-0.2, 0.2)) * step, lon=1.5 + (j + rng.uniform(-0.2, 0.2)) * step)
+             for i in range(size) for j in range(size)}
+    segments = [
+        (nodes[i, j], nodes[i + di, j + dj])
+        for i in range(size) for j in range(size) for di, dj in ((1, 0), (0, 1))
+        if i + di < size and j + dj < size and rng.random() < 0.8
+    ]
+    codes = [encode_tags({"highway": "path"}), encode_tags({"highway": "track"})]
+    tags = np.array([rng.choice(codes) for _ in segments])
+    return TrailGraph.from_networkx(GraphService.make_graph(segments, tags))
+
+
+def random_points(graph: TrailGraph, count: int, rng: np.random.Generator):
+    lo, hi = graph.node_coords.min(axis=0), graph.node_coords.max(axis=0)
+    return [graph.snap(lat, lon) for lat, lon in rng.uniform(lo, hi, size=(count, 2))]
+
+
+def gil_share(graph: TrailGraph, sources) -> float:
+    """Share of a Python thread's speed it keeps while Dijkstra runs (about half if the GIL is released)"""
+    count, stop = [0], [False]
+
+    def spin():
+        while not stop[0]:
+            count[0] += 1
+
+    thread = threading.Thread(target=spin)
+    thread.start()
+    time.sleep(0.2)
+    before = count[0]
+    start = time.perf_counter()
+    time.sleep(0.2)
+    alone = (count[0] - before) / (time.perf_counter() - start)
+    before = count[0]
+    start = time.perf_counter()
+    graph.search_many(sources)
+    during = (count[0] - before) / (time.perf_counter() - start)
+    stop[0] = True
+    thread.join()
+    return during / alone
+
+
+class Workers(MatrixService):
+    """MatrixService with a fixed worker count"""
+
+    def __init__(self, workers: int):
+        super().__init__()
+        self.MAX_WORKERS = workers
+
+
+def timed(service: MatrixService, graph: TrailGraph, origins, targets):
+    start = time.perf_counter()
+    matrix = service.snap_matrix(graph, origins, targets, MAX_KM)
+    return time.perf_counter() - start, matrix
+
+
+def test_matrix_pool_speeds():
+    """Measure the pool overhead and compare per-request and long-lived pools"""
+
+    print("🧪 Distance Matrix Pool Comparison\n")
+    print("=" * 70)
+
+    graph = synthetic_graph()
+    rng = np.random.default_rng(0)
+    targets = random_points(graph, DESTINATIONS, rng)
+    batch = random_points(graph, MatrixService.BATCH_SIZE, rng)
+    print(f"\n{graph.n_nodes:,} nodes, {graph.n_edges:,} edges, {DESTINATIONS} destinations, "
+          f"bound {MAX_KM} km, {os.cpu_count()} CPU(s)")
+
+    print("\n📊 GIL during one unbounded search")
+    print("-" * 70)
+    share = gil_share(graph, batch)
+    print(f"  A Python thread keeps {share:.1%} of its speed while Dijkstra runs "
+          f"({'released' if share > 0.2 else 'held'}: {'threads' if share > 0.2 else 'processes'} needed)")
+
+    print(f"\n📊 One batch of {MatrixService.BATCH_SIZE} origins")
+    print("-" * 70)
+    serial = Workers(1)
+    pooled = Workers(WORKERS)
+    two = batch + random_points(graph, MatrixService.BATCH_SIZE, rng)  # Two batches reach the pool
+    timed(pooled, graph, two, targets)  # Start the workers
+    search = min(timed(serial, graph, batch, targets)[0] for _ in range(3))
+    on_serial = min(timed(serial, graph, two, targets)[0] for _ in range(3))
+    on_pool = min(timed(pooled, graph, two, targets)[0] for _ in range(3))
+    # With one CPU the two workers take turns: the difference is the transfer cost
+    overhead = (on_pool - on_serial) / 2 if (os.cpu_count() or 1) == 1 else None
+    print(f"  Search in this process:         {search * 1000:7.1f} ms")
+    if overhead is not None:
+        print(f"  Transfers per batch, warm pool: {overhead * 1000:7.1f} ms ({overhead / search:.1%} of the search)")
+    else:
+        print(f"  Two batches, one process:       {on_serial * 1000:7.1f} ms")
+        print(f"  Two batches, warm pool:         {on_pool * 1000:7.1f} ms ({on_serial / on_pool:.2f}x)")
+
+    print(f"\n📊 Matrices on {WORKERS} workers")
+    print("-" * 70)
+    print(f"  {'Origins':>8s} {'One process':>12s} {'Pool per request':>17s} {'Graph pool':>11s}")
+    view = graph.profile("avoid_tracks")
+    for label, g in (("plain", graph), ("profile", view)):
+        for count in ORIGIN_COUNTS:
+            origins = random_points(graph, count, rng)
+            t_serial, expected = timed(serial, g, origins, targets)
+            pooled.shutdown()  # As before: a new pool for this request
+            t_cold, cold = timed(pooled, g, origins, targets)
+            t_warm, warm = timed(pooled, g, origins, targets)
+            assert np.array_equal(expected, cold) and np.array_equal(expected, warm)
+            print(f"  {count:8d} {t_serial:11.3f}s {t_cold:16.3f}s {t_warm:10.3f}s   ({label})")
+    pooled.shutdown()
+
+    print("\n" + "=" * 70)
+    print("\n✅ Summary:")
+    print("  • scipy's Dijkstra holds the GIL: batches run in worker processes")
+    print("  • A pool per request forks and copies the graph every time; the graph pool does it once")
+    print("  • Profile and masked views reuse their graph's pool and only send their weights")
+    print(f"  • Transfers are small next to a batch search: two batches "
+          f"({MatrixService.PARALLEL_MIN_ORIGINS} origins) already pay for a second worker")
+    print()
+
+
+if __name__ == "__main__":
+    test_matrix_pool_speeds()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Test region-wide routing:
+- Route distance by Dijkstra on one graph stitched from every tile (what a
+  single region graph would need)
+- Same routes on the tile overlay (RegionRouter): searches in the two end
+  tiles plus the overlay of tile boundary nodes
+
+Usage:
+    python test_region_route_speed.py
+
+A synthetic trail network over 10 x 10 tiles of central Catalunya (~110 km
+north-south) is used; tiles and the overlay are stored in a temporary directory.
+"""
+
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent / "web" / "backend"))
+sys.path.insert(0, str(Path(__file__).parent / "skeleton"))
+from models import PointModel  # noqa: E402
+from services.region_router import RegionRouter  # noqa: E402
+from services.tile_store import TileStore  # noqa: E402
+from services.trail_graph import TrailGraph  # noqa: E402
+
+TILES = 10  # Tiles per side of the synthetic area
+ROW0, COL0 = 410, 10  # Tile of the south-west corner (41.0, 1.0)
+ROUTES = 20
+MIN_ROUTE_KM = 80  # Straight-line distance between route ends
+
+
+class SyntheticOverpass:
+    """Serves the segments of a synthetic trail grid (~0.4 km blocks) like a tile download"""
+
+    def __init__(self, seed: int = 0):
+        rng = random.Random(seed)
+        step = 0.004
+        size = int(TILES * TileStore.TILE_DEGREES / step)
+        lat0, lon0 = ROW0 * TileStore.TILE_DEGREES + step / 2, COL0 * TileStore.TILE_DEGREES + step / 2
+        self.by_tile = defaultdict(list)
+        for i in range(size - 1):
+            for j in range(size - 1):
+                for di, dj in ((1, 0), (0, 1)):
+                    if rng.random() < 0.75:
+                        pts = [
+                            (lat0 + (i + di * k / 3) * step + (rng.uniform(-1, 1) * step * 0.1 if 0 < k < 3 else 0),
+                             lon0 + (j + dj * k / 3) * step + (rng.uniform(-1, 1) * step * 0.1 if 0 < k < 3 else 0))
+                            for k in range(4)
+                        ]
+                        points = [PointModel(lat=a, lon=b) for a, b in pts]
+                        way = [(a, b, rng.randrange(4)) for a, b in zip(points, points[1:])]
+                        for tile in {tuple(t) for t in TileStore.tiles_of(pts).tolist()}:
+                            self.by_tile[tile].append(way)
+
+    def download_trails(self, box):
+        tile = tuple(TileStore.tiles_of([(box.bottom_left.lat + 0.05, box.bottom_left.lon + 0.05)])[0].tolist())
+        return [segment for way in self.by_tile[tile] for segment in way]
+
+
+def test_region_route_speeds():
+    """Compare routing on one stitched region graph with the tile overlay"""
+
+    print("🧪 Region Routing Comparison\n")
+    print("=" * 70)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TileStore(SyntheticOverpass())
+        store.tiles_dir = Path(tmp)
+        router = RegionRouter(store)
+        router.overlay_path = store.tiles_dir / RegionRouter.OVERLAY_FILE
+
+        tiles = [(row, col) for row in range(ROW0, ROW0 + TILES) for col in range(COL0, COL0 + TILES)]
+        start = time.perf_counter()
+        for tile in tiles:
+            store.get_tile(tile)
+        print(f"\n  Built {len(tiles)} tiles with their shortcuts in {time.perf_counter() - start:.2f}s")
+        report = router.build_overlay(store.tile_box(tiles[0]).model_copy(
+            update={"top_right": store.tile_box(tiles[-1]).top_right}
+        ))
+        print(f"  Overlay: {report['nodes']:,} nodes, {report['edges']:,} shortcuts, "
+              f"{report['bytes'] / 1e6:.2f} MB in {report['seconds']:.2f}s")
+
+        start = time.perf_counter()
+        region = TrailGraph.stitch([(t.graph, t.boundary) for t in (store.get_tile(tile) for tile in tiles)])
+        region.edge_index
+        print(f"  Stitched region graph: {region.n_nodes:,} nodes in {time.perf_counter() - start:.2f}s")
+
+        rng = np.random.default_rng(0)
+        lo = np.array([ROW0, COL0]) * TileStore.TILE_DEGREES + 0.02
+        hi = lo + TILES * TileStore.TILE_DEGREES - 0.04
+        pairs = []
+        while len(pairs) < ROUTES:
+            a, b = rng.uniform(lo, hi), rng.uniform(lo, hi)
+            if np.hypot((a[0] - b[0]) * 111.2, (a[1] - b[1]) * 83.5) >= MIN_ROUTE_KM:
+                pairs.append((PointModel(lat=a[0], lon=a[1]), PointModel(lat=b[0], lon=b[1])))
+
+        print(f"\n📊 {ROUTES} routes at least {MIN_ROUTE_KM} km apart")
+        print("-" * 70)
+        old = new = 0.0
+        loaded = []
+        for a, b in pairs:
+            begin = time.perf_counter()
+            result = router.route(a, b, geometry=False)
+            new += time.perf_counter() - begin
+            with_geometry = router.route(a, b)
+            loaded.append(with_geometry["tiles_loaded"])
+
+            begin = time.perf_counter()
+            source = region.snap(result["start"].lat, result["start"].lon)
+            target = region.snap(result["end"].lat, result["end"].lon)
+            dist = region.search_many([source])[0]
+            expected, _ = region.distance_to(dist, source, target)
+            old += time.perf_counter() - begin
+            assert abs(expected - result["distance_km"]) < 1e-3, (expected, result["distance_km"])
+
+        print(f"  Region graph Dijkstra (OLD): {old / ROUTES * 1000:7.1f} ms/route")
+        print(f"  Tile overlay          (NEW): {new / ROUTES * 1000:7.1f} ms/route  ⚡ {old / max(new, 1e-9):.1f}x")
+        print(f"  Tiles searched: 2 per route, loaded with geometry: {np.mean(loaded):.1f} of {len(tiles)}")
+
+    print("\n" + "=" * 70)
+    print("\n✅ Summary:")
+    print("  • Every overlay distance equals the region graph distance")
+    print("  • Only the end tiles are searched; the overlay is a small fraction of the region")
+    print("  • The geometry reads the tiles along the route only")
+    print()
+
+
+if __name__ == "__main__":
+    test_region_route_speeds()
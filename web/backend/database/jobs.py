@@ -111,6 +111,16 @@ class JobStorage:
                 job_data["job_id"]
             ))
     
+    def file_in_use(self, path: str, exclude_job_id: str) -> bool:
+        """Whether the result of any job other than exclude_job_id refers to the file"""
+        with self._get_cursor() as cursor:
+            cursor.execute("""
+                SELECT 1 FROM jobs
+                WHERE job_id != ? AND instr(result, ?) > 0
+                LIMIT 1
+            """, (exclude_job_id, json.dumps(path)))
+            return cursor.fetchone() is not None
+    
     def cleanup_old_jobs(self, days: int = 7) -> int:
         """Clean up jobs older than specified days"""
         with self._get_cursor() as cursor:
@@ -27,7 +27,20 @@ from .monuments import (
 from .routes import (
     RouteRequest,
     RouteResponse,
-    RouteCalculationRequest
+    RouteCalculationRequest,
+    DistanceMatrixRequest,
+    DistanceMatrixResponse,
+    IsochroneResponse,
+    MonumentTreesRequest,
+    MonumentTreesResponse,
+    MonumentTreesListResponse,
+    EdgeMaskRequest,
+    EdgeMaskResponse,
+    EdgeMaskListResponse,
+    RegionRouteRequest,
+    RegionRouteResponse,
+    RegionOverlayRequest,
+    RegionOverlayResponse
 )
 
 # Segment models
@@ -88,6 +101,19 @@ __all__ = [
     "RouteRequest",
     "RouteResponse",
     "RouteCalculationRequest",
+    "DistanceMatrixRequest",
+    "DistanceMatrixResponse",
+    "IsochroneResponse",
+    "MonumentTreesRequest",
+    "MonumentTreesResponse",
+    "MonumentTreesListResponse",
+    "EdgeMaskRequest",
+    "EdgeMaskResponse",
+    "EdgeMaskListResponse",
+    "RegionRouteRequest",
+    "RegionRouteResponse",
+    "RegionOverlayRequest",
+    "RegionOverlayResponse",
     
     # Segments
     "SegmentResponse",
@@ -1,8 +1,8 @@
 """
 Route calculation related models
 """
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any, List, Literal
 from .common import PointModel, BoxModel
 
 
@@ -28,7 +28,144 @@ class RouteCalculationRequest(BaseModel):
     start_point: PointModel
     monument_type: str
     search_box: BoxModel
-    max_distance_km: Optional[float] = None
+    max_distance_km: Optional[float] = Field(default=None, gt=0.0)  # Round trip budget ("balanced")
     max_monuments: Optional[int] = None
     optimization_mode: Optional[str] = "shortest"  # "shortest", "most_monuments", "balanced"
-    settings: Optional[Dict[str, Any]] = None
\ No newline at end of file
+    return_to_start: bool = False  # Close tours with a leg back to the start
+    alternatives: int = Field(default=0, ge=0, le=5)  # Extra routes per monument ("shortest")
+    avoid_masks: Optional[List[str]] = None  # Named edge masks of the search box
+    avoid_polygons: Optional[List[List[PointModel]]] = None  # Ad-hoc areas whose trails are closed
+    profile: Literal["shortest", "prefer_marked", "avoid_tracks"] = "shortest"  # Tag-based edge weights
+    tiled: bool = False  # Route on the fixed tiles covering the box (routes may leave the box)
+    simplify_tolerance_m: Optional[float] = Field(default=None, ge=0.0)  # Route geometry tolerance
+    simplify_zoom: Optional[int] = Field(default=None, ge=0, le=22)  # Derive tolerance from map zoom
+    settings: Optional[Dict[str, Any]] = None
+
+
+class DistanceMatrixRequest(BaseModel):
+    """Request for trail distances between origins and destinations"""
+    search_box: BoxModel
+    origins: List[PointModel] = Field(min_length=1, max_length=2000)
+    destinations: Optional[List[PointModel]] = Field(default=None, max_length=20000)
+    monument_type: Optional[str] = None  # Use all monuments of this type in the box as destinations
+    max_distance_km: Optional[float] = Field(default=None, gt=0.0)  # Bound on the walking length of each path
+    format: Literal["auto", "dense", "sparse"] = "auto"
+    avoid_masks: Optional[List[str]] = None  # Named edge masks of the search box
+    avoid_polygons: Optional[List[List[PointModel]]] = None  # Ad-hoc areas whose trails are closed
+    profile: Literal["shortest", "prefer_marked", "avoid_tracks"] = "shortest"  # Tag-based edge weights
+    tiled: bool = False  # Route on the fixed tiles covering the box (routes may leave the box)
+
+
+class DistanceMatrixResponse(BaseModel):
+    """
+    Trail distance matrix (km), origins as rows and destinations as columns.
+
+    `matrix` holds base64 little-endian arrays: `data` (float32) for the dense
+    row-major matrix, where inf marks unreachable pairs, or `rows`/`cols`
+    (int32) plus `data` for the reachable pairs of a sparse matrix.
+    """
+    origins: List[PointModel]
+    destinations: List[PointModel]
+    destination_names: Optional[List[str]] = None
+    origin_snap_km: List[float]
+    destination_snap_km: List[float]
+    matrix: Dict[str, Any]
+
+
+class IsochroneResponse(BaseModel):
+    """
+    Trails reachable within a walking distance of a start point.
+
+    With format "polyline", `polylines` holds one Google encoded polyline
+    (precision 5) per reachable trail stretch and `hull` their concave hull as
+    a GeoJSON MultiPolygon. With format "geojson", `geojson` is a
+    FeatureCollection with the stretches (MultiLineString) and the hull.
+    """
+    start: PointModel
+    snapped_start: PointModel
+    snap_distance_km: float
+    max_distance_km: float
+    format: str
+    edge_count: int
+    length_km: float  # Total length of reachable trail
+    polylines: Optional[List[str]] = None
+    hull: Optional[Dict[str, Any]] = None
+    geojson: Optional[Dict[str, Any]] = None
+
+
+class MonumentTreesRequest(BaseModel):
+    """Request to precompute the search trees of every monument of a type in a box"""
+    search_box: BoxModel
+    monument_type: str
+
+
+class MonumentTreesResponse(BaseModel):
+    """Memory report of one stored set of monument trees"""
+    box: str  # Box directory under static/
+    monument_type: str
+    monuments: int
+    nodes: int
+    bytes: int  # float32 distances + int32 predecessors, (monuments x nodes) each
+    build_seconds: float
+
+
+class MonumentTreesListResponse(BaseModel):
+    """Every stored set of monument trees"""
+    trees: List[MonumentTreesResponse]
+    total_bytes: int
+
+
+class EdgeMaskRequest(BaseModel):
+    """
+    Named mask of a box: trails touching any polygon are closed, or weigh
+    `penalty` times their length when a penalty is given
+    """
+    search_box: BoxModel
+    polygons: List[List[PointModel]] = Field(min_length=1)
+    penalty: Optional[float] = Field(default=None, gt=1.0)
+
+
+class EdgeMaskResponse(BaseModel):
+    """A named edge mask"""
+    name: str
+    box: str  # Box directory under static/
+    polygons: int
+    penalty: Optional[float] = None  # None when the trails are closed
+    edges: Optional[int] = None  # Edges of the current graph it covers
+
+
+class EdgeMaskListResponse(BaseModel):
+    """Named edge masks of a box"""
+    masks: List[EdgeMaskResponse]
+
+
+class RegionRouteRequest(BaseModel):
+    """Route between two points anywhere in the region (tile graphs plus overlay)"""
+    start: PointModel
+    end: PointModel
+    geometry: bool = True  # Return the route as an encoded polyline
+
+
+class RegionRouteResponse(BaseModel):
+    """Shortest trail route across the region"""
+    distance_km: float
+    start: PointModel  # Snapped onto the trail
+    end: PointModel
+    polyline: Optional[str] = None  # Encoded polyline (precision 5)
+    tiles_searched: int  # Tiles whose graph was searched for the distance
+    tiles_loaded: int  # Tiles read, including those unpacked for the geometry
+    seconds: float
+
+
+class RegionOverlayRequest(BaseModel):
+    """Request to build the region overlay (the whole region by default)"""
+    search_box: Optional[BoxModel] = None
+
+
+class RegionOverlayResponse(BaseModel):
+    """Size of a built region overlay"""
+    tiles: int
+    nodes: int  # Tile boundary nodes
+    edges: int  # Shortcuts inside tiles
+    bytes: int
+    seconds: float
@@ -1,9 +1,9 @@
 """
 Routes router - handles route calculation endpoints
 """
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Query
 from fastapi.responses import FileResponse
-from typing import Optional
+from typing import List, Optional
 import uuid
 import asyncio
 from pathlib import Path
@@ -11,15 +11,34 @@ from pathlib import Path
 from models import (
     RouteRequest,
     RouteCalculationRequest,
+    DistanceMatrixRequest,
+    DistanceMatrixResponse,
+    IsochroneResponse,
+    MonumentTreesRequest,
+    MonumentTreesResponse,
+    MonumentTreesListResponse,
+    EdgeMaskRequest,
+    EdgeMaskResponse,
+    EdgeMaskListResponse,
+    RegionRouteRequest,
+    RegionRouteResponse,
+    RegionOverlayRequest,
+    RegionOverlayResponse,
     JobStartResponse,
     JobResultResponse,
     BoxModel,
     PointModel
 )
 from services.route_service import RouteService
-from services.graph import GraphService
+from services.graph_cache import GraphCache
+from services.matrix_service import MatrixService
+from services.isochrone_service import IsochroneService
+from services.monument_trees import MonumentTreeStore
+from services.edge_masks import EdgeMaskService
+from services.region_router import RegionRouter
 from services.segment_service import SegmentService
 from services.monument_service import MonumentService
+from services.route_pipeline import RoutePipeline
 from database.jobs import JobStorage
 from core.utils import get_logger
 from core.config import STATIC_DIR, DATABASE_CONFIG
@@ -29,9 +48,17 @@ router = APIRouter()
 
 # Initialize services
 route_service = RouteService()
-graph_service = GraphService()
 segment_service = SegmentService()
 monument_service = MonumentService()
+graph_cache = GraphCache(segment_service, monument_service=monument_service)
+matrix_service = MatrixService()
+isochrone_service = IsochroneService()
+monument_trees = MonumentTreeStore()
+edge_masks = EdgeMaskService()
+region_router = RegionRouter(graph_cache.tile_store)
+route_pipeline = RoutePipeline(
+    segment_service, graph_cache, monument_service, route_service, monument_trees, edge_masks
+)
 job_storage = JobStorage(DATABASE_CONFIG["jobs_db_path"])
 
 
@@ -39,7 +66,17 @@ def process_route_calculation(
     job_id: str,
     start_point: PointModel,
     monument_type: str,
-    search_box: BoxModel
+    search_box: BoxModel,
+    simplify_tolerance_m: Optional[float] = None,
+    simplify_zoom: Optional[int] = None,
+    optimization_mode: Optional[str] = "shortest",
+    return_to_start: bool = False,
+    max_distance_km: Optional[float] = None,
+    alternatives: int = 0,
+    avoid_masks: Optional[List[str]] = None,
+    avoid_polygons: Optional[List[List[PointModel]]] = None,
+    profile: str = "shortest",
+    tiled: bool = False
 ):
     """Background task for route calculation"""
     try:
@@ -54,68 +91,33 @@ def process_route_calculation(
         
         logger.info(f"Job {job_id}: Starting route calculation")
         
-        # Step 1: Get segments 
-        logger.info(f"Job {job_id}: Downloading/loading segments")
-        segments = segment_service.get_segments(search_box, "segments.txt")
-        job_storage.update_job({
-            "job_id": job_id,
-            "status": "processing",
-            "progress": 0.3,
-            "result": None,
-            "error": None
-        })
-        
-        if not segments:
-            raise Exception("No segments found in the specified area")
-        
-        # Step 2: Build graph 
-        logger.info(f"Job {job_id}: Building graph from {len(segments)} segments")
-        graph = graph_service.make_graph(segments)
-        graph = graph_service.simplify_graph(graph, epsilon=5.0)
-        job_storage.update_job({
-            "job_id": job_id,
-            "status": "processing",
-            "progress": 0.5,
-            "result": None,
-            "error": None
-        })
-        
-        # Step 3: Get monuments
-        logger.info(f"Job {job_id}: Getting monuments of type {monument_type}")
-        monuments = monument_service.get_monuments_by_type_and_area(
+        def progress(fraction: float) -> None:
+            job_storage.update_job({
+                "job_id": job_id,
+                "status": "processing",
+                "progress": fraction,
+                "result": None,
+                "error": None
+            })
+        
+        # Steps 1-4: segments, monuments, graph, routes and export (each reused when already computed)
+        result = route_pipeline.run(
+            job_id=job_id,
+            start_point=start_point,
             monument_type=monument_type,
-            bottom_left_lat=search_box.bottom_left.lat,
-            bottom_left_lon=search_box.bottom_left.lon,
-            top_right_lat=search_box.top_right.lat,
-            top_right_lon=search_box.top_right.lon
-        )
-        job_storage.update_job({
-            "job_id": job_id,
-            "status": "processing",
-            "progress": 0.7,
-            "result": None,
-            "error": None
-        })
-        
-        if not monuments:
-            raise Exception(f"No monuments of type {monument_type} found in the area")
-        
-        # Step 4: Calculate routes and export 
-        logger.info(f"Job {job_id}: Calculating routes to {len(monuments)} monuments")
-        result = route_service.calculate_and_export(
-            graph=graph,
-            start=start_point,
-            monuments=monuments,
-            box=search_box,
-            job_id=job_id
+            search_box=search_box,
+            simplify_tolerance_m=simplify_tolerance_m,
+            simplify_zoom=simplify_zoom,
+            optimization_mode=optimization_mode,
+            return_to_start=return_to_start,
+            max_distance_km=max_distance_km,
+            alternatives=alternatives,
+            avoid_masks=avoid_masks,
+            avoid_polygons=avoid_polygons,
+            profile=profile,
+            tiled=tiled,
+            progress=progress
         )
-        job_storage.update_job({
-            "job_id": job_id,
-            "status": "processing",
-            "progress": 0.95,
-            "result": None,
-            "error": None
-        })
         
         # Step 5: Complete job
         logger.info(f"Job {job_id}: Route calculation completed")
@@ -150,11 +152,21 @@ async def calculate_routes(
     1. Downloads/loads trail segments
     2. Builds a graph network
     3. Finds monuments in the area
-    4. Calculates shortest paths
+    4. Calculates shortest paths (plus `alternatives` alternative routes per monument)
     5. Exports PNG and KML files
     
+    Every step whose output already exists for the same inputs and settings
+    is skipped; the job result reports which ones were reused (`stages`).
     Returns a job ID to track progress.
     """
+    if request.optimization_mode == "balanced" and not request.max_distance_km:
+        raise HTTPException(status_code=400, detail="The balanced optimization mode needs max_distance_km")
+    if request.avoid_masks:
+        known = {mask["name"] for mask in edge_masks.list_masks(request.search_box)}
+        missing = sorted(set(request.avoid_masks) - known)
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Unknown masks for this box: {', '.join(missing)}")
+    
     try:
         # Create job
         job_id = str(uuid.uuid4())
@@ -175,7 +187,17 @@ async def calculate_routes(
             job_id=job_id,
             start_point=request.start_point,
             monument_type=request.monument_type,
-            search_box=request.search_box
+            search_box=request.search_box,
+            simplify_tolerance_m=request.simplify_tolerance_m,
+            simplify_zoom=request.simplify_zoom,
+            optimization_mode=request.optimization_mode,
+            return_to_start=request.return_to_start,
+            max_distance_km=request.max_distance_km,
+            alternatives=request.alternatives,
+            avoid_masks=request.avoid_masks,
+            avoid_polygons=request.avoid_polygons,
+            profile=request.profile,
+            tiled=request.tiled
         )
         
         return JobStartResponse(
@@ -189,6 +211,278 @@ async def calculate_routes(
         raise HTTPException(status_code=500, detail=f"Error starting route calculation: {str(e)}")
 
 
+def compute_distance_matrix(request: DistanceMatrixRequest) -> DistanceMatrixResponse:
+    """Build (or reuse) the box graph and compute the requested matrix"""
+    box = request.search_box
+    destinations = list(request.destinations or [])
+    names = None
+    if request.monument_type:
+        monuments = monument_service.get_monuments_by_type_and_area(
+            monument_type=request.monument_type,
+            bottom_left_lat=box.bottom_left.lat,
+            bottom_left_lon=box.bottom_left.lon,
+            top_right_lat=box.top_right.lat,
+            top_right_lon=box.top_right.lon
+        )
+        names = [None] * len(destinations) + [m.name for m in monuments]
+        destinations += [m.location for m in monuments]
+    
+    if request.tiled:
+        trail_graph = graph_cache.get_tiled_graph(box).profile(request.profile)
+    else:
+        trail_graph = graph_cache.get_graph(box, "segments.txt").profile(request.profile)
+    trail_graph = edge_masks.apply(trail_graph, box, request.avoid_masks, request.avoid_polygons)
+    result = matrix_service.distance_matrix(
+        trail_graph, request.origins, destinations, request.max_distance_km
+    )
+    return DistanceMatrixResponse(
+        origins=request.origins,
+        destinations=destinations,
+        destination_names=names,
+        origin_snap_km=result["origin_snap_km"],
+        destination_snap_km=result["destination_snap_km"],
+        matrix=matrix_service.encode_matrix(result["matrix"], request.format)
+    )
+
+
+@router.post("/routes/matrix", response_model=DistanceMatrixResponse)
+async def distance_matrix(request: DistanceMatrixRequest):
+    """
+    Trail distance matrix between origins and destinations.
+    
+    Destinations are the given points plus, if monument_type is set, every
+    monument of that type in the search box. Runs on the cached graph of the
+    box; max_distance_km bounds every search (farther pairs are unreachable).
+    With a profile or masks, paths are the cheapest under those weights and
+    the values (and max_distance_km) are their walking lengths in km.
+    """
+    if not request.destinations and not request.monument_type:
+        raise HTTPException(status_code=400, detail="Provide destinations or a monument_type")
+    
+    try:
+        # Graph build and searches are CPU-bound: keep them off the event loop
+        return await asyncio.to_thread(compute_distance_matrix, request)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=str(e.args[0]))
+    except Exception as e:
+        logger.error(f"Error computing distance matrix: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error computing distance matrix: {str(e)}")
+
+
+def compute_isochrone(
+    start: PointModel,
+    km: float,
+    output_format: str,
+    hull_edge_km: Optional[float]
+) -> IsochroneResponse:
+    """Load the graph of the box around the start and run the bounded search"""
+    box = isochrone_service.box_around(start, km)
+    trail_graph = graph_cache.get_graph(box, "segments.txt")
+    return IsochroneResponse(**isochrone_service.isochrone(
+        trail_graph, start, km, output_format, hull_edge_km
+    ))
+
+
+@router.get("/routes/isochrone", response_model=IsochroneResponse)
+async def get_isochrone(
+    lat: float,
+    lon: float,
+    km: float = Query(gt=0.0, le=20.0),
+    format: str = Query(default="polyline", pattern="^(polyline|geojson)$"),
+    hull_edge_km: Optional[float] = Query(default=None, gt=0.0)
+):
+    """
+    Get every trail stretch reachable within a walking distance of a point.
+    
+    Runs one Dijkstra search bounded at `km` on the cached graph of the box
+    around the point (downloading its segments the first time).
+    
+    Query Parameters:
+    - lat, lon: Start point
+    - km: Walking distance
+    - format: "polyline" (encoded polylines + GeoJSON hull) or "geojson" (FeatureCollection)
+    - hull_edge_km: Detail of the concave hull (longest triangle edge kept)
+    """
+    try:
+        start = PointModel(lat=lat, lon=lon)
+        # Graph build and search are CPU-bound: keep them off the event loop
+        return await asyncio.to_thread(compute_isochrone, start, km, format, hull_edge_km)
+    except ValueError as e:
+        # Bad input, an area without trails, or a pydantic ValidationError (a ValueError)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error computing isochrone: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error computing isochrone: {str(e)}")
+
+
+def build_monument_trees(request: MonumentTreesRequest) -> MonumentTreesResponse:
+    """Build (or reuse) the box graph and store the trees of its monuments"""
+    box = request.search_box
+    monuments = monument_service.get_monuments_by_type_and_area(
+        monument_type=request.monument_type,
+        bottom_left_lat=box.bottom_left.lat,
+        bottom_left_lon=box.bottom_left.lon,
+        top_right_lat=box.top_right.lat,
+        top_right_lon=box.top_right.lon
+    )
+    if not monuments:
+        raise ValueError(f"No monuments of type {request.monument_type} found in the area")
+    trail_graph = graph_cache.get_graph(box, "segments.txt")
+    return MonumentTreesResponse(**monument_trees.build(trail_graph, box, request.monument_type, monuments))
+
+
+@router.post("/routes/trees", response_model=MonumentTreesResponse)
+async def precompute_monument_trees(request: MonumentTreesRequest):
+    """
+    Precompute the shortest-path tree of every monument of a type in a box.
+    
+    Trees are stored under static/<box>/trees/ as float32 distances and int32
+    predecessors and memory-mapped by later route jobs, which then answer the
+    "shortest" mode for any start point without a search. Trees built from an
+    older segments file are ignored. Returns the size of the stored arrays.
+    """
+    try:
+        # One search per monument: keep it off the event loop
+        return await asyncio.to_thread(build_monument_trees, request)
+    except ValueError as e:
+        # No monuments of the type (or no trails) in the box
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error precomputing monument trees: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error precomputing monument trees: {str(e)}")
+
+
+@router.get("/routes/trees", response_model=MonumentTreesListResponse)
+async def list_monument_trees():
+    """
+    List the stored monument trees with their memory use per box and type.
+    """
+    try:
+        trees = [MonumentTreesResponse(**item) for item in monument_trees.memory_report()]
+        return MonumentTreesListResponse(trees=trees, total_bytes=sum(t.bytes for t in trees))
+    except Exception as e:
+        logger.error(f"Error listing monument trees: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error listing monument trees: {str(e)}")
+
+
+def define_edge_mask(name: str, request: EdgeMaskRequest) -> EdgeMaskResponse:
+    """Store a named mask and count the edges it covers on the box graph"""
+    trail_graph = graph_cache.get_graph(request.search_box, "segments.txt")
+    return EdgeMaskResponse(**edge_masks.define(
+        trail_graph, request.search_box, name, request.polygons, request.penalty
+    ))
+
+
+@router.put("/routes/masks/{name}", response_model=EdgeMaskResponse)
+async def put_edge_mask(name: str, request: EdgeMaskRequest):
+    """
+    Create or replace a named edge mask of a search box.
+    
+    Trails touching any of the polygons are closed, or weigh `penalty` times
+    their length if a penalty is given. Route and matrix requests select
+    masks by name (avoid_masks); the cached graph is never rebuilt.
+    """
+    try:
+        # Counting the covered edges may build the graph: keep it off the event loop
+        return await asyncio.to_thread(define_edge_mask, name, request)
+    except Exception as e:
+        logger.error(f"Error defining edge mask: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error defining edge mask: {str(e)}")
+
+
+@router.get("/routes/masks", response_model=EdgeMaskListResponse)
+async def get_edge_masks(
+    bottom_left_lat: float,
+    bottom_left_lon: float,
+    top_right_lat: float,
+    top_right_lon: float
+):
+    """
+    List the named edge masks of a search box.
+    
+    Query Parameters:
+    - bottom_left_lat, bottom_left_lon: Southwest corner of bounding box
+    - top_right_lat, top_right_lon: Northeast corner of bounding box
+    """
+    try:
+        box = BoxModel(
+            bottom_left=PointModel(lat=bottom_left_lat, lon=bottom_left_lon),
+            top_right=PointModel(lat=top_right_lat, lon=top_right_lon)
+        )
+        return EdgeMaskListResponse(masks=[EdgeMaskResponse(**mask) for mask in edge_masks.list_masks(box)])
+    except Exception as e:
+        logger.error(f"Error listing edge masks: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error listing edge masks: {str(e)}")
+
+
+@router.delete("/routes/masks/{name}")
+async def delete_edge_mask(
+    name: str,
+    bottom_left_lat: float,
+    bottom_left_lon: float,
+    top_right_lat: float,
+    top_right_lon: float
+):
+    """
+    Delete a named edge mask of a search box.
+    
+    Query Parameters:
+    - bottom_left_lat, bottom_left_lon: Southwest corner of bounding box
+    - top_right_lat, top_right_lon: Northeast corner of bounding box
+    """
+    try:
+        box = BoxModel(
+            bottom_left=PointModel(lat=bottom_left_lat, lon=bottom_left_lon),
+            top_right=PointModel(lat=top_right_lat, lon=top_right_lon)
+        )
+        if not edge_masks.delete(box, name):
+            raise HTTPException(status_code=404, detail=f"Mask {name} not found")
+        return {"message": f"Mask {name} deleted successfully"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error deleting edge mask: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error deleting edge mask: {str(e)}")
+
+
+@router.post("/routes/region", response_model=RegionRouteResponse)
+async def region_route(request: RegionRouteRequest):
+    """
+    Shortest trail route between two points anywhere in the region.
+    
+    Only the tiles of the two points are searched; the rest of the route runs
+    on the overlay of tile boundary nodes (build it first with
+    POST /routes/region/overlay). The geometry is unpacked from the tiles the
+    route crosses.
+    """
+    try:
+        # Searches are CPU-bound: keep them off the event loop
+        result = await asyncio.to_thread(region_router.route, request.start, request.end, request.geometry)
+        return RegionRouteResponse(**result)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error computing region route: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error computing region route: {str(e)}")
+
+
+@router.post("/routes/region/overlay", response_model=RegionOverlayResponse)
+async def build_region_overlay(request: RegionOverlayRequest):
+    """
+    Build the overlay graph of region routing.
+    
+    Every tile covering the box (all of Catalunya by default) is downloaded
+    and built if it is not stored yet, which can take long the first time.
+    Returns the size of the overlay.
+    """
+    try:
+        # Tile builds and shortcut searches: keep them off the event loop
+        return RegionOverlayResponse(**await asyncio.to_thread(region_router.build_overlay, request.search_box))
+    except Exception as e:
+        logger.error(f"Error building region overlay: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error building region overlay: {str(e)}")
+
+
 @router.get("/routes/job/{job_id}", response_model=JobResultResponse)
 async def get_job_status(job_id: str):
     """
@@ -308,7 +602,8 @@ async def delete_job(job_id: str):
     """
     Delete a job and its associated files.
     
-    This will remove the job from the database and delete PNG/KML files if they exist.
+    This will remove the job from the database and delete PNG/KML files if they exist
+    and no other job refers to them (jobs with the same routes share their files).
     """
     try:
         job = job_storage.get_job(job_id)
@@ -316,19 +611,19 @@ async def delete_job(job_id: str):
         if not job:
             raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
         
-        # Delete files if they exist
+        # Delete files if they exist and no other job shares them
         if job.get("result"):
-            if job["result"].get("png_file"):
-                png_path = Path(job["result"]["png_file"])
-                if png_path.exists():
-                    png_path.unlink()
-                    logger.info(f"Deleted PNG file: {png_path}")
-            
-            if job["result"].get("kml_file"):
-                kml_path = Path(job["result"]["kml_file"])
-                if kml_path.exists():
-                    kml_path.unlink()
-                    logger.info(f"Deleted KML file: {kml_path}")
+            for field in ("png_file", "kml_file"):
+                if not job["result"].get(field):
+                    continue
+                file_path = Path(job["result"][field])
+                if not file_path.exists():
+                    continue
+                if job_storage.file_in_use(job["result"][field], job_id):
+                    logger.info(f"Keeping {file_path}: other jobs refer to it")
+                    continue
+                file_path.unlink()
+                logger.info(f"Deleted {field.split('_')[0].upper()} file: {file_path}")
         
         # Note: JobStorage doesn't have delete method, so we can't delete from DB
         # In a production system, you'd implement this
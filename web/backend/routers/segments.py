@@ -194,7 +194,7 @@ async def get_segment_stats(
         )
         
         # Check if segments exist
-        dir_name = segment_service._get_directory_name(box)
+        dir_name = segment_service.get_directory_name(box)
         segment_file = Path(STATIC_DIR) / dir_name / "segments.txt"
         points_file = Path(STATIC_DIR) / dir_name / "pointinfo.txt"
         
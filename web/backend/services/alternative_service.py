@@ -0,0 +1,149 @@
+"""
+Alternative route service - plateau-based alternatives to a shortest route
+"""
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from typing import Any, Dict, List, Tuple
+
+from core.utils import get_logger
+from services.edge_index import EdgeSnap
+from services.trail_graph import TrailGraph
+
+logger = get_logger("alternative_service")
+
+Pieces = List[Tuple[int, float, float]]
+
+
+class AlternativeRouteService:
+    """
+    Alternative routes from the shortest-path trees of both route ends.
+
+    With a tree grown from the start and one grown from the monument, every
+    node x gives a via route start → x → monument of length ds[x] + dt[x].
+    Edges that lie on both trees form "plateaus": all nodes of a plateau give
+    the same via route, and a long plateau means a long stretch that is
+    locally shortest in both directions. Plateaus are tried longest first and
+    a via route is kept when it is not much longer than the shortest route
+    and shares little of its length with the shortest route and with the
+    alternatives kept before it. Only the monument tree is searched on top of
+    the single start search (none with precomputed monument trees).
+    """
+
+    MAX_STRETCH = 1.4  # Alternatives at most this many times longer than the shortest route
+    MAX_SHARING = 0.7  # Largest share of an alternative's length walked on an earlier route
+    MAX_CANDIDATES = 200  # Longest plateaus examined per monument
+
+    @staticmethod
+    def _intervals(pieces: Pieces) -> Dict[int, Tuple[float, float]]:
+        """Covered fraction [lo, hi] of each edge of a route"""
+        return {e: (min(t0, t1), max(t0, t1)) for e, t0, t1 in pieces}
+
+    @staticmethod
+    def shared_length(graph: TrailGraph, a: Dict[int, Tuple[float, float]], b: Dict[int, Tuple[float, float]]) -> float:
+        """Length (km) of trail covered by both routes, given their edge intervals"""
+        shared = 0.0
+        for e, (lo, hi) in a.items():
+            if e in b:
+                overlap = min(hi, b[e][1]) - max(lo, b[e][0])
+                if overlap > 0:
+                    shared += float(graph.edge_length[e]) * overlap
+        return shared
+
+    @staticmethod
+    def plateaus(
+        graph: TrailGraph,
+        pred_s: np.ndarray,
+        pred_t: np.ndarray
+    ) -> Tuple[int, np.ndarray]:
+        """
+        Label the plateaus of two shortest-path trees.
+
+        An edge x-y is on a plateau when the monument tree leaves x through y
+        and the start tree reaches y from x.
+
+        Returns:
+            (count, labels) with one plateau label per graph node
+        """
+        n = graph.n_nodes
+        x = np.arange(n)
+        y = pred_t[:n].astype(np.int64)
+        on = (y >= 0) & (y < n)
+        on[on] = pred_s[y[on]] == x[on]
+        pairs = coo_matrix((np.ones(int(on.sum())), (x[on], y[on])), shape=(n, n))
+        return connected_components(pairs, directed=False)
+
+    def alternatives(
+        self,
+        graph: TrailGraph,
+        start: EdgeSnap,
+        target: EdgeSnap,
+        start_tree: Tuple[np.ndarray, np.ndarray],
+        target_tree: Tuple[np.ndarray, np.ndarray],
+        primary: Pieces,
+        primary_km: float,
+        count: int
+    ) -> List[Dict[str, Any]]:
+        """
+        Find up to `count` alternatives to the shortest route.
+
+        Args:
+            graph: Array-backed trail network
+            start, target: Snapped route ends
+            start_tree: (dist, pred) of the search from the start
+            target_tree: (dist, pred) of the search from the target
+            primary: Pieces of the shortest route
+            primary_km: Search cost of the shortest route (its length unless the graph is masked)
+            count: Number of alternatives wanted
+
+        Returns:
+            [{"distance_km", "sharing", "pieces"}, ...] shortest first, where
+            sharing is the share of the alternative walked on the shortest route
+        """
+        n = graph.n_nodes
+        ds = np.asarray(start_tree[0][:n], dtype=np.float64)
+        dt = np.asarray(target_tree[0][:n], dtype=np.float64)
+        pred_s, pred_t = start_tree[1], target_tree[1]
+        via = ds + dt
+
+        n_plateaus, labels = self.plateaus(graph, pred_s, pred_t)
+        ok = np.isfinite(via) & (via <= primary_km * self.MAX_STRETCH)
+        if not ok.any():
+            return []
+        nodes = np.flatnonzero(ok)
+        # Plateau length is the spread of start distances along it; its entry node
+        # (closest to the start) stands for the whole plateau
+        lo = np.full(n_plateaus, np.inf)
+        hi = np.full(n_plateaus, -np.inf)
+        np.minimum.at(lo, labels[nodes], ds[nodes])
+        np.maximum.at(hi, labels[nodes], ds[nodes])
+        by_plateau = nodes[np.lexsort((ds[nodes], labels[nodes]))]
+        candidates, first = np.unique(labels[by_plateau], return_index=True)
+        entry = np.full(n_plateaus, -1)
+        entry[candidates] = by_plateau[first]
+        candidates = candidates[np.argsort(-(hi[candidates] - lo[candidates]), kind="stable")]
+
+        kept: List[Dict[str, Any]] = []
+        covered = [self._intervals(primary)]
+        for plateau in candidates[:self.MAX_CANDIDATES]:
+            x = int(entry[plateau])
+            path = graph.node_path(pred_s, x) + graph.node_path(pred_t, x)[::-1][1:]
+            if len(set(path)) < len(path):
+                continue  # Walks back over itself
+            pieces = graph.path_pieces(start, target, path)
+            edges = [e for e, _, _ in pieces[1:-1]]
+            if start.edge in edges or target.edge in edges:
+                continue  # Turns back onto an end edge
+            # Masked graphs search on penalized weights; report the walking length
+            distance = graph.pieces_length(pieces) if graph.masked else float(via[x])
+            intervals = self._intervals(pieces)
+            sharing = [self.shared_length(graph, intervals, other) / max(distance, 1e-12) for other in covered]
+            if max(sharing) > self.MAX_SHARING:
+                continue
+            kept.append({"distance_km": distance, "sharing": sharing[0], "pieces": pieces})
+            covered.append(intervals)
+            if len(kept) == count:
+                break
+
+        logger.debug(f"{len(kept)} alternatives from {min(len(candidates), self.MAX_CANDIDATES)} plateaus")
+        return sorted(kept, key=lambda alt: alt["distance_km"])
@@ -0,0 +1,316 @@
+"""
+Point clustering - MiniBatchKMeans sharded by spatial tile and run in a process pool
+Every tile gets clusters in proportion to its points; tile borders are reconciled afterwards
+Cluster centers are kept per tile in static/cluster_centers/ and seed later boxes
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from math import cos, radians
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+from sklearn.cluster import MiniBatchKMeans  # Much faster than KMeans!
+
+from models import BoxModel
+from core.utils import get_logger
+from core.config import STATIC_DIR
+
+logger = get_logger("clustering")
+
+# Approximate km per degree of latitude (local planar distances only)
+KM_PER_DEGREE = 111.2
+
+Cell = Tuple[int, int]  # (row, col) of a clustering tile
+
+
+def _km_scale(lat: float) -> np.ndarray:
+    """Factors turning (lat, lon) degrees into local planar km around a latitude"""
+    return np.array([KM_PER_DEGREE, KM_PER_DEGREE * cos(radians(lat))])
+
+
+def _cluster_tile(points: np.ndarray, n_clusters: int, warm: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Centers and labels of the points of one tile (every point its own center when there are few).
+
+    Warm tiles only cluster the points their stored centers left over, in
+    one initialization and a few iterations.
+    """
+    if n_clusters >= len(points):
+        return points.copy(), np.arange(len(points))
+    kmeans = MiniBatchKMeans(
+        n_clusters=n_clusters,
+        random_state=0,
+        batch_size=1000,  # Process in batches for speed
+        max_iter=ShardedClustering.WARM_MAX_ITER if warm else 100,  # Limit iterations
+        n_init=1 if warm else 3  # Fewer initializations (faster)
+    ).fit(points)
+    return kmeans.cluster_centers_, kmeans.predict(points)
+
+
+@dataclass(frozen=True)
+class StoredCenters:
+    """Cluster centers kept for one tile"""
+    centers: np.ndarray  # (k, 2) lat, lon
+    coverage: np.ndarray  # (r, 4) lat0, lon0, lat1, lon1 of the areas whose points were clustered
+    radius_km: float  # Median distance from a point to its center when the centers were made
+
+    def covers(self, points: np.ndarray) -> np.ndarray:
+        """Which points lie in an area these centers were made for"""
+        lat, lon = points[:, :1], points[:, 1:]
+        cov = self.coverage
+        return ((lat >= cov[:, 0]) & (lon >= cov[:, 1]) & (lat <= cov[:, 2]) & (lon <= cov[:, 3])).any(axis=1)
+
+
+class ClusterCenterStore:
+    """
+    Cluster centers per clustering tile, stored as .npz files.
+
+    Entries are keyed on the tile and on the clustering parameters (tile
+    size, points per cluster, clusters per tile), so other settings never
+    reuse them. Every box clustered over a tile adds its area to the tile's
+    coverage and its new centers to the tile's centers.
+    """
+
+    STORE_DIR = "cluster_centers"
+
+    def __init__(self, base_dir: Optional[Path] = None):
+        self.base_dir = Path(base_dir) if base_dir is not None else Path(STATIC_DIR) / self.STORE_DIR
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _path(self, cell: Cell, params: str) -> Path:
+        return self.base_dir / params / f"{cell[0]}_{cell[1]}.npz"
+
+    def get(self, cell: Cell, params: str) -> Optional[StoredCenters]:
+        path = self._path(cell, params)
+        if not path.exists():
+            return None
+        with np.load(path) as data:
+            return StoredCenters(data["centers"], data["coverage"], float(data["radius_km"]))
+
+    def put(self, cell: Cell, params: str, entry: StoredCenters) -> None:
+        path = self._path(cell, params)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            # Written under a temporary name first: a half-written entry is never loaded
+            tmp = path.with_suffix(".tmp.npz")
+            np.savez(tmp, centers=entry.centers, coverage=entry.coverage, radius_km=entry.radius_km)
+            tmp.replace(path)
+
+
+class ShardedClustering:
+    """
+    Clusters (lat, lon) points tile by tile.
+
+    Points are split into tiles of TILE_DEGREES and every tile is clustered
+    on its own with MiniBatchKMeans, one cluster per POINTS_PER_CLUSTER points
+    (at most `max_tile_clusters`), so detail follows point density and does
+    not depend on the size of the area. Tiles are clustered in a process
+    pool when there are enough points to pay for it.
+
+    Tile borders are reconciled afterwards: centers of neighbouring tiles
+    closer than MERGE_KM become one (their weighted mean), and points within
+    BORDER_KM of their tile border move to the nearest center of any tile.
+
+    With a ClusterCenterStore and the box being clustered, the centers of
+    every tile are kept and seed later boxes over the same tile: points in an
+    area clustered before, or within the stored cluster radius of a stored
+    center, take their nearest stored center; only the rest is clustered
+    (warm, WARM_MAX_ITER iterations) into new centers, one per
+    POINTS_PER_CLUSTER of them (at most `max_tile_clusters`). Stored centers never
+    move, so overlapping boxes share their centers and graph nodes.
+    """
+
+    TILE_DEGREES = 0.05  # Shard size (~5.5 km north-south)
+    POINTS_PER_CLUSTER = 10  # Density of clusters in every tile
+    MERGE_KM = 0.05  # Centers of different tiles closer than this are merged
+    BORDER_KM = 0.2  # Points this close to a tile border may join a neighbouring tile's center
+    WARM_MAX_ITER = 20  # Iterations when clustering the points stored centers left over
+    PARALLEL_MIN_POINTS = 50_000  # Below this, starting worker processes costs more than it saves
+    MAX_WORKERS = max(1, min(8, (os.cpu_count() or 1) - 1))
+
+    def __init__(self, max_workers: int = MAX_WORKERS, store: Optional[ClusterCenterStore] = None):
+        self.max_workers = max_workers
+        self.store = store
+        self.last_report: Dict[str, int] = {}
+
+    def cluster(
+        self,
+        points: np.ndarray,
+        max_tile_clusters: int,
+        box: Optional[BoxModel] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Cluster points tile by tile.
+
+        Args:
+            points: (n, 2) array of (lat, lon)
+            max_tile_clusters: Most clusters any one tile gets
+            box: Area the points were downloaded for; with a store, tiles are
+                 seeded from their stored centers and the store is updated
+
+        Returns:
+            (centers, labels): (k, 2) cluster centers and the center of every point
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        cells = np.floor(points / self.TILE_DEGREES).astype(np.int64)
+        tiles, tile_of, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+        tile_of = tile_of.ravel()
+        order = np.argsort(tile_of, kind="stable")
+        members = np.split(order, np.cumsum(counts)[:-1])
+        params = f"{self.TILE_DEGREES}-{self.POINTS_PER_CLUSTER}-{max_tile_clusters}"
+        use_store = self.store is not None and box is not None
+
+        # Seed every tile from its stored centers; the rest of its points is clustered
+        seeds: List[np.ndarray] = []
+        seeded: List[np.ndarray] = []
+        seed_labels: List[np.ndarray] = []
+        jobs: List[Tuple[np.ndarray, int, bool]] = []
+        stored: List[Optional[StoredCenters]] = []
+        for cell, m in zip(tiles.tolist(), members):
+            tile_points = points[m]
+            entry = self.store.get(tuple(cell), params) if use_store else None
+            stored.append(entry)
+            if entry is None or not len(entry.centers):
+                seeds.append(np.zeros((0, 2)))
+                seeded.append(np.zeros(len(m), dtype=bool))
+                seed_labels.append(np.zeros(0, dtype=np.int64))
+                jobs.append((tile_points, min(max_tile_clusters, -(-len(m) // self.POINTS_PER_CLUSTER)), False))
+                continue
+            scale = _km_scale(float(tile_points[:, 0].mean()))
+            distance, nearest = cKDTree(entry.centers * scale).query(tile_points * scale)
+            hit = entry.covers(tile_points) | (distance <= entry.radius_km)
+            # Points outside the stored area get their own budget, as in a cold tile
+            new_clusters = min(max_tile_clusters, -(-int((~hit).sum()) // self.POINTS_PER_CLUSTER))
+            seeds.append(entry.centers)
+            seeded.append(hit)
+            seed_labels.append(nearest[hit])
+            jobs.append((tile_points[~hit], new_clusters, True))
+
+        workers = min(self.max_workers, len(jobs))
+        clustered = sum(len(job[0]) for job in jobs)
+        if clustered >= self.PARALLEL_MIN_POINTS and workers > 1:
+            logger.info(f"Clustering {clustered} points in {len(jobs)} tiles on {workers} processes")
+            with ProcessPoolExecutor(workers) as pool:
+                results = list(pool.map(
+                    _cluster_tile, *zip(*jobs), chunksize=max(1, len(jobs) // (4 * workers))
+                ))
+        else:
+            logger.info(f"Clustering {clustered} points in {len(jobs)} tiles")
+            results = [_cluster_tile(*job) for job in jobs]
+
+        parts, fixed, center_tile = [], [], []
+        labels = np.empty(len(points), dtype=np.int64)
+        offset = 0
+        for i, (m, (new_centers, new_labels)) in enumerate(zip(members, results)):
+            tile_labels = np.empty(len(m), dtype=np.int64)
+            tile_labels[seeded[i]] = seed_labels[i] + offset
+            tile_labels[~seeded[i]] = new_labels + offset + len(seeds[i])
+            labels[m] = tile_labels
+            parts += [seeds[i], new_centers]
+            fixed += [np.ones(len(seeds[i]), dtype=bool), np.zeros(len(new_centers), dtype=bool)]
+            center_tile.append(np.full(len(seeds[i]) + len(new_centers), i))
+            offset += len(seeds[i]) + len(new_centers)
+        centers = np.concatenate(parts) if parts else np.zeros((0, 2))
+        fixed = np.concatenate(fixed) if fixed else np.zeros(0, dtype=bool)
+        center_tile = np.concatenate(center_tile) if center_tile else np.zeros(0, dtype=np.int64)
+
+        centers, labels = self._reconcile(points, cells, centers, center_tile, labels, fixed)
+        if use_store:
+            self._store_tiles(points, tiles, members, stored, centers, labels, box, params)
+
+        warm = sum(1 for entry in stored if entry is not None)
+        self.last_report = {
+            "points": len(points),
+            "clusters": len(centers),
+            "tiles": len(jobs),
+            "warm_tiles": warm,
+            "clustered_points": clustered
+        }
+        logger.info(f"Clustered {len(points)} points into {len(centers)} clusters "
+                    f"({len(jobs)} tiles, {warm} seeded from stored centers, {clustered} points clustered)")
+        return centers, labels
+
+    def _reconcile(
+        self,
+        points: np.ndarray,
+        cells: np.ndarray,
+        centers: np.ndarray,
+        center_tile: np.ndarray,
+        labels: np.ndarray,
+        fixed: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Merge near-duplicate centers across tile borders and move border points
+        to their nearest center. A group holding a stored (fixed) center keeps
+        that center's position.
+        """
+        if not len(centers):
+            return centers, labels
+        scale = _km_scale(float(points[:, 0].mean()))
+
+        # Centers of different tiles within MERGE_KM: one center per connected group
+        pairs = cKDTree(centers * scale).query_pairs(self.MERGE_KM, output_type="ndarray")
+        pairs = pairs[center_tile[pairs[:, 0]] != center_tile[pairs[:, 1]]]
+        if len(pairs):
+            graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(len(centers),) * 2)
+            _, group = connected_components(graph, directed=False)
+            weight = np.bincount(labels, minlength=len(centers)).astype(np.float64) + 1e-9
+            total = np.bincount(group, weights=weight)
+            merged = np.column_stack([
+                np.bincount(group, weights=centers[:, 0] * weight) / total,
+                np.bincount(group, weights=centers[:, 1] * weight) / total
+            ])
+            # A group holding a stored center keeps that center where it is
+            anchor = np.full(len(merged), -1)
+            anchor[group[fixed][::-1]] = np.flatnonzero(fixed)[::-1]
+            merged[anchor >= 0] = centers[anchor[anchor >= 0]]
+            centers = merged
+            labels = group[labels]
+
+        # Points near a tile border: nearest center of any tile
+        low = cells * self.TILE_DEGREES
+        to_border = np.minimum(points - low, low + self.TILE_DEGREES - points) * scale
+        border = np.flatnonzero(to_border.min(axis=1) < self.BORDER_KM)
+        if len(border):
+            _, nearest = cKDTree(centers * scale).query(points[border] * scale)
+            labels[border] = nearest
+
+        # Drop centers left without points
+        used, labels = np.unique(labels, return_inverse=True)
+        return centers[used], labels.ravel()
+
+    def _store_tiles(
+        self,
+        points: np.ndarray,
+        tiles: np.ndarray,
+        members: List[np.ndarray],
+        stored: List[Optional[StoredCenters]],
+        centers: np.ndarray,
+        labels: np.ndarray,
+        box: BoxModel,
+        params: str
+    ) -> None:
+        """Keep the centers every tile's points use, and the part of the box the tile covers"""
+        scale = _km_scale(float(points[:, 0].mean()))
+        for (row, col), m, entry in zip(tiles.tolist(), members, stored):
+            used = np.unique(labels[m])
+            tile_centers = centers[used]
+            area = np.array([[
+                max(box.bottom_left.lat, row * self.TILE_DEGREES),
+                max(box.bottom_left.lon, col * self.TILE_DEGREES),
+                min(box.top_right.lat, (row + 1) * self.TILE_DEGREES),
+                min(box.top_right.lon, (col + 1) * self.TILE_DEGREES)
+            ]])
+            radius = float(np.median(np.hypot(*((points[m] - centers[labels[m]]) * scale).T)))
+            if entry is not None:
+                tile_centers = np.unique(np.concatenate([entry.centers, tile_centers]), axis=0)
+                area = np.concatenate([entry.coverage, area])
+                radius = entry.radius_km
+            self.store.put((row, col), params, StoredCenters(tile_centers, area, radius))
@@ -0,0 +1,167 @@
+"""
+Edge spatial index - snaps points onto the nearest trail edge
+Uniform grid over every straight piece of every edge's geometry
+"""
+import numpy as np
+from dataclasses import dataclass
+from typing import List, Optional
+
+from geometry import project_to_segments  # skeleton/geometry.py
+
+# Approximate km per degree of latitude (only used to bound the grid search)
+KM_PER_DEGREE = 111.2
+
+
+@dataclass(frozen=True)
+class EdgeSnap:
+    """A point snapped onto a trail edge"""
+    edge: int            # Edge id in the TrailGraph
+    t: float             # Position along the edge, as a fraction from its u end (0) to v end (1)
+    distance_km: float   # Distance from the query point to the trail
+    lat: float           # Snapped point on the trail
+    lon: float
+
+
+class EdgeIndex:
+    """
+    Grid index over the straight pieces ("pieces") of all edge geometries.
+
+    Every piece is registered in each grid cell its bounding box touches. A query
+    scans rings of cells around the point, projecting onto all candidate pieces
+    in one vectorized call, and stops as soon as no unvisited ring can be closer.
+    """
+
+    def __init__(
+        self,
+        piece_start: np.ndarray,
+        piece_end: np.ndarray,
+        piece_edge: np.ndarray,
+        piece_from: np.ndarray,
+        piece_to: np.ndarray
+    ):
+        """
+        Args:
+            piece_start, piece_end: (k, 2) (lat, lon) endpoints of each piece
+            piece_edge: (k,) edge id of each piece
+            piece_from, piece_to: (k,) edge fraction at each end of the piece
+        """
+        self.piece_start = piece_start
+        self.piece_end = piece_end
+        self.piece_edge = piece_edge
+        self.piece_from = piece_from
+        self.piece_to = piece_to
+        self._build()
+
+    def _build(self) -> None:
+        """Bucket pieces into grid cells (sorted cell keys + offsets, no Python dicts)"""
+        k = len(self.piece_start)
+        if k == 0:
+            self.cell_size = 1.0
+            self.origin = np.zeros(2)
+            self.n_cols = self.n_rows = 0
+            self.cell_keys = np.zeros(0, dtype=np.int64)
+            self.cell_offsets = np.zeros(1, dtype=np.int64)
+            self.cell_pieces = np.zeros(0, dtype=np.int64)
+            return
+
+        lo = np.minimum(self.piece_start, self.piece_end)
+        hi = np.maximum(self.piece_start, self.piece_end)
+        extent = np.maximum(hi.max(axis=0) - lo.min(axis=0), 1e-6)
+
+        # Aim for a few pieces per cell, but never smaller than a typical piece
+        typical = float(np.median(np.max(hi - lo, axis=1)))
+        self.cell_size = max(float(np.sqrt(extent[0] * extent[1] / k)) * 2, typical, 1e-5)
+        self.origin = lo.min(axis=0)
+
+        c0 = ((lo - self.origin) // self.cell_size).astype(np.int64)
+        c1 = ((hi - self.origin) // self.cell_size).astype(np.int64)
+        self.n_rows = int(c1[:, 0].max()) + 1
+        self.n_cols = int(c1[:, 1].max()) + 1
+
+        # Expand each piece to every cell of its bounding box
+        spans = c1 - c0 + 1
+        counts = spans[:, 0] * spans[:, 1]
+        pieces = np.repeat(np.arange(k), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        rows = c0[pieces, 0] + local // spans[pieces, 1]
+        cols = c0[pieces, 1] + local % spans[pieces, 1]
+        keys = rows * self.n_cols + cols
+
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        self.cell_pieces = pieces[order]
+        self.cell_keys, starts = np.unique(keys, return_index=True)
+        self.cell_offsets = np.append(starts, len(keys)).astype(np.int64)
+
+    def _pieces_in_ring(self, row: int, col: int, radius: int) -> np.ndarray:
+        """Piece ids registered in the ring of cells at Chebyshev distance `radius`"""
+        if radius == 0:
+            cells = [(row, col)]
+        else:
+            r0, r1, c0, c1 = row - radius, row + radius, col - radius, col + radius
+            cells = [(r0, c) for c in range(c0, c1 + 1)] + [(r1, c) for c in range(c0, c1 + 1)]
+            cells += [(r, c0) for r in range(r0 + 1, r1)] + [(r, c1) for r in range(r0 + 1, r1)]
+        cells = np.array(
+            [r * self.n_cols + c for r, c in cells if 0 <= r < self.n_rows and 0 <= c < self.n_cols],
+            dtype=np.int64
+        )
+        if len(cells) == 0:
+            return np.zeros(0, dtype=np.int64)
+        pos = np.searchsorted(self.cell_keys, cells)
+        found = pos < len(self.cell_keys)
+        found[found] = self.cell_keys[pos[found]] == cells[found]
+        pos = pos[found]
+        if len(pos) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([
+            self.cell_pieces[self.cell_offsets[p]:self.cell_offsets[p + 1]] for p in pos
+        ])
+
+    def snap(self, lat: float, lon: float) -> Optional[EdgeSnap]:
+        """
+        Snap a point onto the closest edge.
+
+        Returns:
+            EdgeSnap with the exact projection, or None if the index is empty
+        """
+        if len(self.cell_keys) == 0:
+            return None
+
+        point = np.array([lat, lon])
+        row, col = ((point - self.origin) // self.cell_size).astype(np.int64)
+        # Once rings 0..r-1 are scanned, anything unscanned is >= (r - 1) * cell_km away
+        cell_km = self.cell_size * KM_PER_DEGREE * max(np.cos(np.radians(lat)), 1e-6)
+        # Rings beyond this radius lie entirely outside the grid
+        max_radius = int(max(abs(row), abs(col), abs(row - self.n_rows + 1), abs(col - self.n_cols + 1)))
+
+        best_dist, best_piece, best_t = np.inf, -1, 0.0
+        for radius in range(max_radius + 1):
+            if best_piece >= 0 and best_dist <= (radius - 1) * cell_km:
+                break
+            candidates = self._pieces_in_ring(row, col, radius)
+            if len(candidates) == 0:
+                continue
+            dists, ts = project_to_segments(
+                point, self.piece_start[candidates], self.piece_end[candidates]
+            )
+            i = int(dists.argmin())
+            if dists[i] < best_dist:
+                best_dist, best_piece, best_t = float(dists[i]), int(candidates[i]), float(ts[i])
+
+        if best_piece < 0:
+            return None
+
+        a, b = self.piece_start[best_piece], self.piece_end[best_piece]
+        snapped = a + best_t * (b - a)
+        t = self.piece_from[best_piece] + best_t * (self.piece_to[best_piece] - self.piece_from[best_piece])
+        return EdgeSnap(
+            edge=int(self.piece_edge[best_piece]),
+            t=float(t),
+            distance_km=best_dist,
+            lat=float(snapped[0]),
+            lon=float(snapped[1])
+        )
+
+    def snap_many(self, points: List[tuple]) -> List[Optional[EdgeSnap]]:
+        """Snap several (lat, lon) points"""
+        return [self.snap(lat, lon) for lat, lon in points]
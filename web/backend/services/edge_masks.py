@@ -0,0 +1,210 @@
+"""
+Edge masks - trail closures and avoid areas applied at query time
+Named masks are stored per box in static/<box>/masks.json
+"""
+import itertools
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from models import BoxModel, PointModel
+from core.utils import get_logger
+from core.config import STATIC_DIR
+from services.trail_graph import TrailGraph
+from geometry import points_in_polygon, segments_cross_polygon  # skeleton/geometry.py
+
+logger = get_logger("edge_masks")
+
+
+class EdgeMaskService:
+    """
+    Named per-box edge masks and ad-hoc avoid polygons.
+
+    A mask is a set of polygons plus either a penalty factor (edges touching
+    a polygon weigh `penalty` times their length) or none (the edges are
+    closed). Masks never touch the cached graph: `apply` returns a view of it
+    (TrailGraph.with_weights) whose weights are the graph's own (edge lengths,
+    or a tag profile's) times the largest factor of the selected masks. Views
+    of named mask sets are kept in a small LRU so their searches also reuse
+    the shortest-path tree cache.
+    """
+
+    MAX_VIEWS = 16  # Masked graph views kept for reuse
+    MASKS_FILE = "masks.json"
+
+    _revisions = itertools.count(1)
+
+    def __init__(self, max_views: int = MAX_VIEWS):
+        self.max_views = max_views
+        self._masks: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._views: "OrderedDict[Tuple, TrailGraph]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _box_dir(box: BoxModel) -> str:
+        return f"{box.bottom_left.lat}_{box.bottom_left.lon}_{box.top_right.lat}_{box.top_right.lon}"
+
+    def _box_masks(self, box_dir: str) -> Dict[str, Dict[str, Any]]:
+        """Masks of a box, read from its masks file on first use (call with the lock held)"""
+        masks = self._masks.get(box_dir)
+        if masks is None:
+            masks = {}
+            path = Path(STATIC_DIR) / box_dir / self.MASKS_FILE
+            if path.exists():
+                with open(path) as f:
+                    for name, mask in json.load(f).items():
+                        masks[name] = {**mask, "revision": next(self._revisions)}
+            self._masks[box_dir] = masks
+        return masks
+
+    def _save(self, box_dir: str) -> None:
+        path = Path(STATIC_DIR) / box_dir / self.MASKS_FILE
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            name: {k: v for k, v in mask.items() if k != "revision"}
+            for name, mask in self._masks[box_dir].items()
+        }
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+    @staticmethod
+    def edges_in_polygons(graph: TrailGraph, polygons: List[List[List[float]]]) -> np.ndarray:
+        """
+        Boolean mask of the edges that enter any polygon: with a geometry point
+        inside it, or a geometry step crossing its boundary (a clustered or
+        contracted edge can pass a small polygon between two points)
+        """
+        hit = np.zeros(graph.n_edges, dtype=bool)
+        if not polygons or not graph.n_edges:
+            return hit
+        vertex_edge = np.repeat(np.arange(graph.n_edges), np.diff(graph.geom_offsets))
+        # Consecutive geometry points of the same edge
+        is_step = np.ones(len(graph.geom_coords), dtype=bool)
+        is_step[graph.geom_offsets[1:] - 1] = False
+        steps = np.flatnonzero(is_step)
+        for polygon in polygons:
+            hit[vertex_edge[points_in_polygon(graph.geom_coords, polygon)]] = True
+            crossing = segments_cross_polygon(graph.geom_coords[steps], graph.geom_coords[steps + 1], polygon)
+            hit[vertex_edge[steps[crossing]]] = True
+        return hit
+
+    def define(
+        self,
+        graph: TrailGraph,
+        box: BoxModel,
+        name: str,
+        polygons: List[List[PointModel]],
+        penalty: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """Create or replace a named mask of a box and report the edges it covers"""
+        box_dir = self._box_dir(box)
+        rings = [[[p.lat, p.lon] for p in polygon] for polygon in polygons]
+        with self._lock:
+            self._box_masks(box_dir)[name] = {
+                "polygons": rings,
+                "penalty": penalty,
+                "revision": next(self._revisions)
+            }
+            self._save(box_dir)
+        edges = int(self.edges_in_polygons(graph, rings).sum())
+        logger.info(f"Mask '{name}' in {box_dir}: {edges} of {graph.n_edges} edges "
+                    f"{'closed' if penalty is None else f'penalized x{penalty}'}")
+        return {"name": name, "box": box_dir, "polygons": len(rings), "penalty": penalty, "edges": edges}
+
+    def delete(self, box: BoxModel, name: str) -> bool:
+        """Remove a named mask; returns whether it existed"""
+        box_dir = self._box_dir(box)
+        with self._lock:
+            masks = self._box_masks(box_dir)
+            if name not in masks:
+                return False
+            del masks[name]
+            self._save(box_dir)
+        return True
+
+    def list_masks(self, box: BoxModel) -> List[Dict[str, Any]]:
+        """Named masks of a box"""
+        box_dir = self._box_dir(box)
+        with self._lock:
+            masks = self._box_masks(box_dir)
+            return [
+                {"name": name, "box": box_dir, "polygons": len(mask["polygons"]), "penalty": mask["penalty"]}
+                for name, mask in masks.items()
+            ]
+
+    def definitions(self, box: BoxModel, names: List[str]) -> List[Dict[str, Any]]:
+        """
+        Stored content (polygons and penalty) of named masks of a box, sorted by name.
+
+        Raises:
+            KeyError: If a named mask does not exist for the box
+        """
+        box_dir = self._box_dir(box)
+        with self._lock:
+            masks = self._box_masks(box_dir)
+            missing = [name for name in names if name not in masks]
+            if missing:
+                raise KeyError(f"Unknown masks for this box: {', '.join(missing)}")
+            return [
+                {"name": name, "polygons": masks[name]["polygons"], "penalty": masks[name]["penalty"]}
+                for name in sorted(set(names))
+            ]
+
+    def apply(
+        self,
+        graph: TrailGraph,
+        box: BoxModel,
+        names: Optional[List[str]] = None,
+        avoid_polygons: Optional[List[List[PointModel]]] = None
+    ) -> TrailGraph:
+        """
+        Graph to route on with named masks and ad-hoc avoid polygons (closures).
+
+        Returns:
+            `graph` itself when nothing is masked, otherwise a masked view
+
+        Raises:
+            KeyError: If a named mask does not exist for the box
+        """
+        names = sorted(set(names or []))
+        if not names and not avoid_polygons:
+            return graph
+
+        box_dir = self._box_dir(box)
+        with self._lock:
+            masks = self._box_masks(box_dir)
+            missing = [name for name in names if name not in masks]
+            if missing:
+                raise KeyError(f"Unknown masks for this box: {', '.join(missing)}")
+            selected = [masks[name] for name in names]
+            key = (graph.version, tuple((name, mask["revision"]) for name, mask in zip(names, selected)))
+            view = self._views.get(key) if not avoid_polygons else None
+            if view is not None:
+                self._views.move_to_end(key)
+                return view
+
+        factors = np.ones(graph.n_edges, dtype=np.float32)
+        for mask in selected:
+            hit = self.edges_in_polygons(graph, mask["polygons"])
+            factors[hit] = np.maximum(factors[hit], np.inf if mask["penalty"] is None else mask["penalty"])
+        if avoid_polygons:
+            rings = [[[p.lat, p.lon] for p in polygon] for polygon in avoid_polygons]
+            factors[self.edges_in_polygons(graph, rings)] = np.inf
+
+        view = graph.with_weights(graph.edge_weight * factors)
+        if avoid_polygons:
+            view.tree_cache = None  # One-off view: keep its trees out of the shared cache
+        logger.info(f"Masked graph: {int(np.isinf(factors).sum())} edges closed, "
+                    f"{int(((factors > 1) & np.isfinite(factors)).sum())} penalized")
+        if not avoid_polygons:
+            with self._lock:
+                self._views[key] = view
+                while len(self._views) > self.max_views:
+                    _, evicted = self._views.popitem(last=False)
+                    if evicted.tree_cache is not None:
+                        evicted.tree_cache.drop_graph(evicted.version)
+        return view
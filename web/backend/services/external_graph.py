@@ -0,0 +1,256 @@
+"""
+External graph builder - builds the CSR trail graph of a segments file in fixed memory
+Sorted runs are spilled to disk, merged, and the arrays written to memory-mapped .npy files
+"""
+import itertools
+import json
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from core.utils import get_logger
+from services.trail_tags import UNKNOWN
+from geometry import haversine_points, pack_coords, unpack_coords  # skeleton/geometry.py
+
+logger = get_logger("external_graph")
+
+
+class ExternalGraphBuilder:
+    """
+    Out-of-core build of a TrailGraph straight from a segments file.
+
+    The file is read CHUNK_ROWS lines at a time. Each chunk is turned into
+    (lo, hi, line, tags) coordinate-key rows, sorted and spilled to disk, together
+    with its sorted node keys. The runs are then merged a block at a time:
+    node keys into the sorted unique node list (node id = rank), segment rows
+    into one row per node pair (the last line wins, as in make_graph). The
+    edge, geometry and CSR arrays are written into memory-mapped .npy files
+    one block at a time, so peak memory depends on CHUNK_ROWS and MERGE_ROWS
+    only, not on the size of the area.
+
+    The graph is not simplified or pruned (that needs the whole NetworkX
+    graph): every segment is an edge with a straight two-point geometry.
+    Nodes are numbered in coordinate-key order. `TrailGraph.open` maps the
+    stored arrays back without copying them into memory.
+    """
+
+    CHUNK_ROWS = 1_000_000  # Segments sorted in memory per spilled run
+    MERGE_ROWS = 1_000_000  # Rows buffered across all runs while merging
+    EDGE_ROW = np.dtype([("lo", np.int64), ("hi", np.int64), ("line", np.int64), ("tags", np.uint8)])
+    STAMP_FILE = "stamp.json"
+
+    def __init__(self, chunk_rows: int = CHUNK_ROWS, merge_rows: int = MERGE_ROWS):
+        self.chunk_rows = chunk_rows
+        self.merge_rows = merge_rows
+
+    @staticmethod
+    def stamp(segments_path: Path) -> str:
+        """Identity of a segments file version (size and modification time)"""
+        stat = segments_path.stat()
+        return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+    def is_built(self, segments_path: Path, out_dir: Path) -> bool:
+        """Whether `out_dir` holds the graph of the current version of the segments file"""
+        stamp_path = out_dir / self.STAMP_FILE
+        if not stamp_path.exists():
+            return False
+        return json.loads(stamp_path.read_text()).get("segments") == self.stamp(segments_path)
+
+    def build(self, segments_path: Path, out_dir: Path) -> Dict[str, Any]:
+        """
+        Build the graph arrays of a segments file into `out_dir`.
+
+        The arrays are written to a temporary directory first and moved in
+        place when complete, so a half-built graph is never opened.
+
+        Returns:
+            Report with nodes, edges, spilled runs, bytes written and seconds
+        """
+        start = time.perf_counter()
+        stamp = self.stamp(segments_path)
+        work = out_dir.with_name(out_dir.name + ".tmp")
+        shutil.rmtree(work, ignore_errors=True)
+        runs_dir = work / "runs"
+        runs_dir.mkdir(parents=True)
+
+        # 1. Sorted runs of segment rows and node keys
+        runs = 0
+        for rows in self._read_rows(segments_path):
+            rows.sort(order="lo")
+            np.save(runs_dir / f"edges_{runs:05d}.npy", rows)
+            np.save(runs_dir / f"nodes_{runs:05d}.npy", np.unique(np.concatenate([rows["lo"], rows["hi"]])))
+            runs += 1
+        edge_runs = sorted(runs_dir.glob("edges_*.npy"))
+        node_runs = sorted(runs_dir.glob("nodes_*.npy"))
+
+        # 2. Unique node keys (node id = rank) and unique node pairs, as raw spill files
+        n = self._spill(self._unique_keys(node_runs), runs_dir / "node_keys.bin")
+        m = self._spill(self._unique_pairs(edge_runs), runs_dir / "pairs.bin")
+        node_keys = np.memmap(runs_dir / "node_keys.bin", dtype=np.int64, mode="r", shape=(n,))
+        pairs = np.memmap(runs_dir / "pairs.bin", dtype=self.EDGE_ROW, mode="r", shape=(m,))
+
+        # 3. Node and edge arrays, one block at a time
+        arrays = {
+            "node_coords": open_memmap(work / "node_coords.npy", mode="w+", dtype=np.float64, shape=(n, 2)),
+            "edge_u": open_memmap(work / "edge_u.npy", mode="w+", dtype=np.int32, shape=(m,)),
+            "edge_v": open_memmap(work / "edge_v.npy", mode="w+", dtype=np.int32, shape=(m,)),
+            "edge_weight": open_memmap(work / "edge_weight.npy", mode="w+", dtype=np.float64, shape=(m,)),
+            "edge_tags": open_memmap(work / "edge_tags.npy", mode="w+", dtype=np.uint8, shape=(m,)),
+            "geom_offsets": open_memmap(work / "geom_offsets.npy", mode="w+", dtype=np.int64, shape=(m + 1,)),
+            "geom_coords": open_memmap(work / "geom_coords.npy", mode="w+", dtype=np.float64, shape=(2 * m, 2)),
+            "geom_along": open_memmap(work / "geom_along.npy", mode="w+", dtype=np.float64, shape=(2 * m,)),
+            "indptr": open_memmap(work / "indptr.npy", mode="w+", dtype=np.int64, shape=(n + 1,)),
+            "indices": open_memmap(work / "indices.npy", mode="w+", dtype=np.int32, shape=(2 * m,)),
+            "csr_edge": open_memmap(work / "csr_edge.npy", mode="w+", dtype=np.int32, shape=(2 * m,)),
+        }
+        for lo in range(0, n, self.merge_rows):
+            arrays["node_coords"][lo:lo + self.merge_rows] = unpack_coords(node_keys[lo:lo + self.merge_rows])
+
+        indptr = arrays["indptr"]
+        indptr[:] = 0
+        for lo in range(0, m, self.merge_rows):
+            hi = min(lo + self.merge_rows, m)
+            block = pairs[lo:hi]
+            u = np.searchsorted(node_keys, block["lo"]).astype(np.int32)
+            v = np.searchsorted(node_keys, block["hi"]).astype(np.int32)
+            coords = unpack_coords(np.column_stack([block["lo"], block["hi"]]).ravel()).reshape(-1, 2, 2)
+            weights = haversine_points(coords[:, 0], coords[:, 1])
+            arrays["edge_u"][lo:hi], arrays["edge_v"][lo:hi] = u, v
+            arrays["edge_weight"][lo:hi] = weights
+            arrays["edge_tags"][lo:hi] = block["tags"]
+            arrays["geom_offsets"][lo:hi] = 2 * np.arange(lo, hi)
+            arrays["geom_coords"][2 * lo:2 * hi] = coords.reshape(-1, 2)
+            arrays["geom_along"][2 * lo:2 * hi] = np.column_stack([np.zeros(hi - lo), weights]).ravel()
+            # Degrees, counted into indptr[1:] and summed up below
+            np.add.at(indptr, u.astype(np.int64) + 1, 1)
+            np.add.at(indptr, v.astype(np.int64) + 1, 1)
+        arrays["geom_offsets"][m] = 2 * m
+        total = 0
+        for lo in range(0, n + 1, self.merge_rows):
+            part = np.cumsum(indptr[lo:lo + self.merge_rows]) + total
+            indptr[lo:lo + self.merge_rows] = part
+            total = int(part[-1])
+
+        # 4. CSR rows: both directions of every edge, placed at a per-row cursor
+        cursor = np.memmap(runs_dir / "cursor.bin", dtype=np.int64, mode="w+", shape=(max(n, 1),))
+        for lo in range(0, n, self.merge_rows):
+            cursor[lo:lo + self.merge_rows] = indptr[lo:min(lo + self.merge_rows, n)]
+        for lo in range(0, m, self.merge_rows):
+            hi = min(lo + self.merge_rows, m)
+            edge_ids = np.arange(lo, hi, dtype=np.int32)
+            u, v = np.asarray(arrays["edge_u"][lo:hi]), np.asarray(arrays["edge_v"][lo:hi])
+            rows, cols = np.concatenate([u, v]), np.concatenate([v, u])
+            order = np.argsort(rows, kind="stable")
+            rows, cols, edge_ids = rows[order], cols[order], np.concatenate([edge_ids, edge_ids])[order]
+            # Rank of every entry within its row in this block
+            first = np.r_[0, np.flatnonzero(np.diff(rows)) + 1]
+            counts = np.diff(np.r_[first, len(rows)])
+            rank = np.arange(len(rows)) - np.repeat(first, counts)
+            at = cursor[rows] + rank
+            arrays["indices"][at] = cols
+            arrays["csr_edge"][at] = edge_ids
+            cursor[rows[first]] += counts
+
+        nbytes = 0
+        for array in arrays.values():
+            array.flush()
+            nbytes += array.nbytes
+        del arrays, cursor, node_keys, pairs
+        shutil.rmtree(runs_dir)
+        (work / self.STAMP_FILE).write_text(json.dumps({"segments": stamp, "nodes": n, "edges": m}))
+        shutil.rmtree(out_dir, ignore_errors=True)
+        work.rename(out_dir)
+
+        report = {
+            "nodes": n,
+            "edges": m,
+            "runs": runs,
+            "bytes": int(nbytes),
+            "seconds": round(time.perf_counter() - start, 3)
+        }
+        logger.info(f"Built external graph of {segments_path.parent.name}: {report}")
+        return report
+
+    def _read_rows(self, segments_path: Path) -> Iterator[np.ndarray]:
+        """(lo, hi, line, tags) rows of the segments file, CHUNK_ROWS lines at a time (self-loops left out)"""
+        with open(segments_path) as f:
+            line = 0
+            while True:
+                lines = list(itertools.islice(f, self.chunk_rows))
+                if not lines:
+                    return
+                parts = [text.strip().split(",") for text in lines]
+                coords = np.array([part[:4] for part in parts], dtype=np.float64).reshape(-1, 2)
+                keys = pack_coords(coords).reshape(-1, 2)
+                rows = np.empty(len(keys), dtype=self.EDGE_ROW)
+                rows["lo"], rows["hi"] = keys.min(axis=1), keys.max(axis=1)
+                rows["line"] = np.arange(line, line + len(keys))
+                # Lines without a code: slow-method or older files
+                rows["tags"] = [int(part[4]) if len(part) > 4 else UNKNOWN for part in parts]
+                line += len(keys)
+                yield rows[rows["lo"] != rows["hi"]]
+
+    def _merge(self, runs: List[Path], field: Optional[str] = None) -> Iterator[np.ndarray]:
+        """
+        K-way merge of run files sorted by a key (the values, or one field of the rows).
+
+        Every run is memory-mapped and read MERGE_ROWS / k rows at a time.
+        Buffered rows with a key below the smallest last buffered key of the
+        runs still being read are released: nothing later in any run sorts
+        before them, and every row with a released key is in the block.
+        """
+        maps = [np.load(path, mmap_mode="r") for path in runs]
+        step = max(self.merge_rows // max(len(maps), 1), 1)
+        pos = [0] * len(maps)
+        pending = [np.asarray(array[:0]) for array in maps[:1]]
+
+        def key(rows: np.ndarray) -> np.ndarray:
+            return rows if field is None else rows[field]
+
+        while True:
+            parts = list(pending)
+            bounds = []
+            for i, array in enumerate(maps):
+                if pos[i] < len(array):
+                    part = np.asarray(array[pos[i]:pos[i] + step])
+                    pos[i] += len(part)
+                    parts.append(part)
+                    if pos[i] < len(array):
+                        bounds.append(key(part)[-1])
+            if not parts or not sum(len(part) for part in parts):
+                return
+            block = np.concatenate(parts)
+            block = block[np.argsort(key(block), kind="stable")]
+            if not bounds:
+                yield block
+                return
+            released = np.searchsorted(key(block), min(bounds), side="left")
+            pending = [block[released:]]
+            if released:
+                yield block[:released]
+
+    def _unique_keys(self, runs: List[Path]) -> Iterator[np.ndarray]:
+        for block in self._merge(runs):
+            yield np.unique(block)
+
+    def _unique_pairs(self, runs: List[Path]) -> Iterator[np.ndarray]:
+        """One row per node pair, the one of its last line (blocks hold whole `lo` groups)"""
+        for block in self._merge(runs, "lo"):
+            block = np.sort(block, order=["lo", "hi", "line"])
+            last = np.ones(len(block), dtype=bool)
+            last[:-1] = (block["lo"][1:] != block["lo"][:-1]) | (block["hi"][1:] != block["hi"][:-1])
+            yield block[last]
+
+    @staticmethod
+    def _spill(blocks: Iterator[np.ndarray], path: Path) -> int:
+        """Append blocks to a raw file; returns the number of rows written"""
+        count = 0
+        with open(path, "wb") as f:
+            for block in blocks:
+                block.tofile(f)
+                count += len(block)
+        return count
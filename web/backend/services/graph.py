@@ -2,130 +2,524 @@
 Graph service - handles graph creation and manipulation
 Port of skeleton/graphmaker.py to web backend
 """
+import time
+
 import networkx as nx
-from math import acos, degrees
-from typing import List, Tuple
-import haversine
+import numpy as np
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from models import PointModel
 from core.utils import get_logger
+from services.edge_index import EdgeIndex
+from geometry import haversine_points, pack_coords, path_lengths, unpack_coords  # skeleton/geometry.py
 
 logger = get_logger("graph_service")
 
 
 class GraphService:
-    """Service for graph operations"""
+    """
+    Service for graph operations.
+    
+    Graph nodes are int64 coordinate keys (geometry.pack_coords): coordinates
+    are quantized to microdegrees when segments enter the graph, so the same
+    point always gets the same node however its floats were rounded upstream,
+    and node lookups hash one int instead of a tuple of two floats.
+    """
+    
+    MIN_COMPONENT_KM = 0.5  # Trail islands shorter than this (in total) are dropped by prune_graph
+    MAX_SPUR_KM = 0.05  # Dead ends shorter than this are trimmed by prune_graph
     
     @staticmethod
-    def make_graph(segments: List[Tuple[PointModel, PointModel]]) -> nx.Graph:
+    def make_graph(
+        segments: List[Tuple[PointModel, PointModel]],
+        tags: Optional[np.ndarray] = None
+    ) -> nx.Graph:
         """
         Create a graph from segments.
         
         Args:
             segments: List of tuples (start_point, end_point)
+            tags: Optional tag code per segment (see services/trail_tags.py),
+                  stored as the ``tags`` edge attribute
             
         Returns:
-            NetworkX graph with points as nodes and segments as weighted edges
+            NetworkX graph with coordinate keys as nodes and segments as weighted edges
         """
         graph = nx.Graph()
         
-        for start_point, end_point in segments:
-            # Create hashable tuples for graph nodes
-            start_node = (start_point.lat, start_point.lon)
-            end_node = (end_point.lat, end_point.lon)
-            
-            # Calculate edge weight using haversine distance
-            weight = haversine.haversine(
-                (start_point.lat, start_point.lon),
-                (end_point.lat, end_point.lon)
+        # Quantize both ends of every segment to coordinate keys
+        coords = np.array(
+            [(a.lat, a.lon, b.lat, b.lon) for a, b in segments], dtype=np.float64
+        ).reshape(-1, 2)
+        keys = pack_coords(coords)
+        starts = keys[0::2].tolist()
+        ends = keys[1::2].tolist()
+        
+        # Calculate all edge weights (between the quantized points) in one vectorized haversine call
+        points = unpack_coords(keys)
+        weights = haversine_points(points[0::2], points[1::2]).tolist() if segments else []
+        
+        if tags is None:
+            graph.add_weighted_edges_from(
+                zip(starts, ends, weights), weight="weight"
+            )
+        else:
+            graph.add_edges_from(
+                (a, b, {"weight": w, "tags": int(code)})
+                for a, b, w, code in zip(starts, ends, weights, tags)
             )
-            
-            graph.add_edge(start_node, end_node, weight=weight)
         
         logger.info(f"Created graph with {graph.number_of_nodes()} nodes and {graph.number_of_edges()} edges")
         return graph
     
     @staticmethod
-    def simplify_graph(graph: nx.Graph, epsilon: float = 5.0) -> nx.Graph:
+    def simplify_graph(graph: nx.Graph, keep: Optional[Set[int]] = None) -> nx.Graph:
         """
-        Simplify the graph by removing collinear nodes.
+        Simplify the graph by contracting every chain of degree-2 nodes into one edge.
         
-        Eliminates nodes with degree 2 that are nearly collinear with their neighbors.
-        This reduces graph complexity while maintaining path accuracy.
+        Walks each maximal chain between two junctions (nodes whose degree is not 2)
+        once. The contracted edge keeps the summed length of the original edges as
+        its weight and the full list of coordinates as a ``geometry`` array, so the
+        routing graph only holds junctions while exports keep the trail shape.
+        
+        A simple graph cannot hold two chains between the same junctions, nor a
+        closed loop, so those are split at interior nodes (promoted to junctions)
+        instead of being dropped: every trail stays available for snapping.
+        
+        Chains also end where the ``tags`` edge attribute changes, so every
+        contracted edge keeps the single tag code of the trail it stands for.
         
         Args:
             graph: NetworkX graph to simplify
-            epsilon: Maximum angle deviation from 180° to consider collinear (degrees)
+            keep: Nodes that stay junctions whatever their degree (the ends of
+                  a partial graph, see update_graph)
             
         Returns:
-            Simplified graph
+            New simplified graph (the input graph is left untouched)
         """
-        # Find all nodes with exactly 2 connections
-        nodes_degree_2 = [node for node in graph.nodes if graph.degree(node) == 2]
-        removed_count = 0
-        
-        for node in nodes_degree_2:
-            # Get the two neighbors
-            neighbors = list(graph.adj[node])
-            if len(neighbors) != 2:
-                continue
-                
-            g1, g3 = neighbors
+        adj = graph.adj
+        keep = keep or set()
+        # Nodes with a self-loop also count as junctions so chains never walk into them,
+        # and so do nodes where the trail's tags change
+        junctions = [
+            node for node in graph.nodes
+            if len(adj[node]) != 2 or node in adj[node] or node in keep
+            or len({data.get("tags", 0) for data in adj[node].values()}) > 1
+        ]
+        junction_set = set(junctions)
+        
+        edges: Dict[Tuple[int, int], Tuple[List[int], List[float], int]] = {}
+        visited: Set[int] = set()
+        split_chains = 0
+        
+        def keep_node(node: int) -> None:
+            """Promote an interior chain node to a junction"""
+            if node not in junction_set:
+                junction_set.add(node)
+                junctions.append(node)
+        
+        def add_chain(chain: List, steps: List[float], tags: int) -> None:
+            """Store a chain as one edge, splitting it where a simple graph needs it"""
+            nonlocal split_chains
+            first, last = chain[0], chain[-1]
+            if first == last:
+                # Closed loop: keep it as three edges so its trail is not lost
+                if len(chain) < 4:
+                    return
+                split_chains += 1
+                i, j = max(1, len(chain) // 3), max(2, 2 * len(chain) // 3)
+                for lo, hi in ((0, i), (i, j), (j, len(chain) - 1)):
+                    keep_node(chain[hi])
+                    add_chain(chain[lo:hi + 1], steps[lo:hi], tags)
+                return
             
-            # Calculate angle between the three points
-            try:
-                angle = GraphService._angle_of(g1, node, g3)
-                
-                # If angle is close to 180° (nearly straight line), remove the middle node
-                if abs(180 - angle) < epsilon:
-                    graph.remove_edge(g1, node)
-                    graph.remove_edge(node, g3)
-                    graph.remove_node(node)
-                    
-                    # Connect the two neighbors directly
-                    weight = haversine.haversine(g1, g3)
-                    graph.add_edge(g1, g3, weight=weight)
-                    removed_count += 1
-                    
-            except (ValueError, ZeroDivisionError):
-                # Skip nodes that cause calculation errors
+            key = (first, last) if first < last else (last, first)
+            if key in edges:
+                # Parallel chain between the same junctions: split whichever has interior nodes
+                split_chains += 1
+                if len(chain) == 2:
+                    edges[key], (chain, steps, tags) = (chain, steps, tags), edges[key]
+                mid = len(chain) // 2
+                keep_node(chain[mid])
+                add_chain(chain[:mid + 1], steps[:mid], tags)
+                add_chain(chain[mid:], steps[mid:], tags)
+                return
+            edges[key] = (chain, steps, tags)
+        
+        def walk(first: int, second: int) -> None:
+            """Follow a chain from junction `first` through `second` to the next junction"""
+            chain = [first, second]
+            steps = [adj[first][second].get("weight", 0.0)]
+            prev, node = first, second
+            while node not in junction_set:
+                visited.add(node)
+                a, b = adj[node]
+                nxt = b if a == prev else a
+                steps.append(adj[node][nxt].get("weight", 0.0))
+                chain.append(nxt)
+                prev, node = node, nxt
+            add_chain(chain, steps, adj[first][second].get("tags", 0))
+        
+        for junction in list(junctions):
+            for neighbor in adj[junction]:
+                # Chains are reachable from both ends: skip walked ones, and walk
+                # direct junction-to-junction edges from their smaller end only
+                if neighbor in visited or (neighbor in junction_set and neighbor < junction):
+                    continue
+                walk(junction, neighbor)
+        
+        # Pure cycles have no junction at all: anchor each on one of its nodes
+        for node in graph.nodes:
+            if node not in junction_set and node not in visited:
+                keep_node(node)
+                walk(node, next(iter(adj[node])))
+        
+        simplified = nx.Graph()
+        simplified.add_nodes_from(junctions)
+        simplified.add_edges_from(
+            (u, v, {
+                "weight": sum(steps),
+                "geometry": unpack_coords(chain if chain[0] == u else chain[::-1]),
+                "tags": tags
+            })
+            for (u, v), (chain, steps, tags) in edges.items()
+        )
+        
+        logger.info(f"Simplified graph: contracted {graph.number_of_nodes() - len(junctions)} "
+                    f"degree-2 nodes, split {split_chains} loops/parallel chains")
+        logger.info(f"Final graph: {simplified.number_of_nodes()} nodes, {simplified.number_of_edges()} edges")
+        return simplified
+    
+    @staticmethod
+    def prune_graph(
+        graph: nx.Graph,
+        keep_points: Optional[List[Tuple[float, float]]] = None,
+        min_component_km: float = MIN_COMPONENT_KM,
+        max_spur_km: float = MAX_SPUR_KM,
+        region: Optional[Set[int]] = None,
+        removed: Optional[nx.Graph] = None
+    ) -> Tuple[nx.Graph, Dict[str, Any]]:
+        """
+        Drop tiny trail islands and short dead-end spurs from a simplified graph.
+        
+        Components whose trails add up to less than `min_component_km` are
+        removed (after simplification a component's node count says little
+        about its size). Then dead ends are trimmed repeatedly: a leaf edge goes
+        when it, plus whatever was already trimmed beyond its leaf, is shorter
+        than `max_spur_km`, so a short fork of spurs goes as a whole while a
+        long dead-end trail stays. Edges that one of `keep_points` (monuments)
+        snaps onto are never trimmed. Junctions left with two edges are merged
+        back into a single edge, as simplify_graph would have done.
+        
+        The graph is pruned in place (copying a large graph costs about as much
+        as pruning it); pass a copy to keep the original. With `region`, only
+        the components and dead ends reached from those nodes are looked at
+        (the rest of the graph was pruned before, see update_graph).
+        
+        Args:
+            graph: Graph from simplify_graph
+            keep_points: (lat, lon) points whose snapped edges must stay
+            min_component_km: Smallest total trail length of a kept component
+            max_spur_km: Longest dead end that is trimmed
+            region: Nodes to prune around (default: the whole graph)
+            removed: Graph that collects the removed edges with their attributes
+        
+        Returns:
+            (graph, report) where the report holds node and edge counts
+            before and after, removed components and spurs, and the time taken
+        """
+        start_time = time.perf_counter()
+        pruned = graph
+        report: Dict[str, Any] = {
+            "nodes_before": graph.number_of_nodes(),
+            "edges_before": graph.number_of_edges()
+        }
+        
+        # Edges monuments snap onto, found on the unpruned graph (within a region:
+        # the nearest of its edges, for the monuments around it)
+        protected: Set[frozenset] = set()
+        edge_list = []
+        if keep_points:
+            edge_list = list(graph.edges if region is None else graph.edges(n for n in region if n in graph))
+        if edge_list:
+            parts = [GraphService.edge_geometry(graph, u, v) for u, v in edge_list]
+            if region is not None:
+                stacked = np.concatenate(parts)
+                lo, hi = stacked.min(axis=0), stacked.max(axis=0)
+                keep_points = [p for p in keep_points if lo[0] <= p[0] <= hi[0] and lo[1] <= p[1] <= hi[1]]
+            piece_edge = np.repeat(np.arange(len(parts)), [len(p) - 1 for p in parts])
+            index = EdgeIndex(
+                np.concatenate([p[:-1] for p in parts]),
+                np.concatenate([p[1:] for p in parts]),
+                piece_edge,
+                np.zeros(len(piece_edge)),
+                np.zeros(len(piece_edge))
+            )
+            for snap in index.snap_many(keep_points):
+                if snap is not None:
+                    protected.add(frozenset(edge_list[snap.edge]))
+        
+        def drop_edges(edges) -> None:
+            """Remove edges, keeping them in `removed`"""
+            edges = list(edges)
+            if removed is not None:
+                removed.add_edges_from((u, v, dict(pruned[u][v])) for u, v in edges)
+            pruned.remove_edges_from(edges)
+        
+        components_removed = 0
+        adj = pruned.adj
+        
+        def component_length(component: Set[int], limit: float = np.inf) -> float:
+            """Total trail length of a component, growing it from its nodes until `limit` is reached"""
+            stack, length = list(component), 0.0
+            while stack and length < limit:
+                node = stack.pop()
+                for neighbor, data in adj[node].items():
+                    length += data.get("weight", 0.0) / 2  # Every edge is seen from both ends
+                    if neighbor not in component:
+                        component.add(neighbor)
+                        stack.append(neighbor)
+            return length
+        
+        if region is None:
+            components = [(c, component_length(c)) for c in nx.connected_components(pruned)]
+        else:
+            # Only the components around the region, and only until they are known to be large enough
+            components, seen = [], set()
+            for node in region:
+                if node in pruned and node not in seen:
+                    component = {node}
+                    components.append((component, component_length(component, min_component_km)))
+                    seen |= component
+        for component, length in components:
+            if length < min_component_km:
+                drop_edges(pruned.edges(component))
+                pruned.remove_nodes_from(component)
+                components_removed += 1
+        
+        # Trimmed length hanging beyond each node, carried over to the edge that becomes its spur
+        trimmed: Dict[int, float] = {}
+        touched: Set[int] = set()
+        spurs_removed = 0
+        leaves = [node for node in (pruned.nodes if region is None else region)
+                  if node in pruned and pruned.degree(node) == 1]
+        while leaves:
+            leaf = leaves.pop()
+            if leaf not in pruned or pruned.degree(leaf) != 1:
+                continue
+            junction, data = next(iter(pruned.adj[leaf].items()))
+            if pruned.degree(junction) == 1:
+                continue  # Lone edge: a component, kept by the size threshold
+            spur = trimmed.get(leaf, 0.0) + data.get("weight", 0.0)
+            if spur >= max_spur_km or frozenset((leaf, junction)) in protected:
                 continue
+            drop_edges([(leaf, junction)])
+            pruned.remove_node(leaf)
+            spurs_removed += 1
+            trimmed[junction] = max(trimmed.get(junction, 0.0), spur)
+            touched.add(junction)
+            if pruned.degree(junction) == 1:
+                leaves.append(junction)
         
-        logger.info(f"Simplified graph: removed {removed_count} collinear nodes")
-        logger.info(f"Final graph: {graph.number_of_nodes()} nodes, {graph.number_of_edges()} edges")
-        return graph
+        # Re-contract junctions the trimming left with two edges of the same trail
+        merged = 0
+        for node in touched:
+            if node not in pruned or pruned.degree(node) != 2:
+                continue
+            a, b = pruned.adj[node]
+            data_a, data_b = pruned.adj[node][a], pruned.adj[node][b]
+            if a == b or pruned.has_edge(a, b) or data_a.get("tags", 0) != data_b.get("tags", 0):
+                continue
+            geometry = np.concatenate([
+                GraphService.edge_geometry(pruned, a, node),
+                GraphService.edge_geometry(pruned, node, b)[1:]
+            ])
+            attrs = {"weight": data_a.get("weight", 0.0) + data_b.get("weight", 0.0), "geometry": geometry}
+            if "tags" in data_a:
+                attrs["tags"] = data_a["tags"]
+            if frozenset((a, node)) in protected or frozenset((node, b)) in protected:
+                protected.add(frozenset((a, b)))
+            pruned.remove_node(node)
+            pruned.add_edge(a, b, **attrs)
+            merged += 1
+        
+        report.update({
+            "nodes_after": pruned.number_of_nodes(),
+            "edges_after": pruned.number_of_edges(),
+            "components_removed": components_removed,
+            "spurs_removed": spurs_removed,
+            "junctions_merged": merged,
+            "protected_edges": len(protected),
+            "seconds": round(time.perf_counter() - start_time, 3)
+        })
+        logger.info(f"Pruned graph: {report['nodes_before']} → {report['nodes_after']} nodes, "
+                    f"{report['edges_before']} → {report['edges_after']} edges "
+                    f"({components_removed} components, {spurs_removed} spurs removed) in {report['seconds']}s")
+        return pruned, report
     
     @staticmethod
-    def _angle_of(p1: Tuple[float, float], p2: Tuple[float, float], p3: Tuple[float, float]) -> float:
+    def update_graph(
+        graph: nx.Graph,
+        removed: nx.Graph,
+        added: List[Tuple[int, int, int]],
+        deleted: List[Tuple[int, int]],
+        keep_points: Optional[List[Tuple[float, float]]] = None,
+        min_component_km: float = MIN_COMPONENT_KM,
+        max_spur_km: float = MAX_SPUR_KM
+    ) -> Dict[str, Any]:
         """
-        Calculate the angle at p2 formed by p1-p2-p3 using haversine distances.
+        Apply added and deleted segments to a simplified, pruned graph in place.
+        
+        Only the trails around the changed segments are rebuilt. Every edge
+        whose trail passes through a changed segment end is expanded back into
+        its segments (from its geometry), and so are the neighbouring edges
+        simplification must see to come out as on the whole graph: chains that
+        continue through a node left with two edges, edges that another trail
+        now meets at an interior point, edges that a new chain would run
+        parallel to, and pruned edges touching the patch (`removed`, as
+        collected by prune_graph, so that a trail island joined to the network
+        comes back). The patch is then simplified with its border nodes kept
+        as junctions, put back, and pruned around its nodes.
         
         Args:
-            p1, p2, p3: Points as (lat, lon) tuples
-            
+            graph: Graph from prune_graph, updated in place
+            removed: Edges pruned from it, updated in place
+            added: (u, v, tags) segments between coordinate keys
+            deleted: (u, v) segments between coordinate keys
+            keep_points: (lat, lon) points whose snapped edges must stay
+            min_component_km: Smallest total trail length of a kept component
+            max_spur_km: Longest dead end that is trimmed
+        
         Returns:
-            Angle in degrees
+            Report with the expanded edges, the size of the patch, node and
+            edge counts after the update and the time taken
         """
-        # Calculate distances between points
-        d1 = haversine.haversine(p1, p2)
-        d2 = haversine.haversine(p2, p3)
-        d3 = haversine.haversine(p1, p3)
+        start_time = time.perf_counter()
+        sources = (graph, removed)
         
-        # Avoid division by zero
-        if d1 == 0 or d2 == 0:
-            return 180.0
+        # Coordinate keys along every edge, sorted, to find the edges whose trail passes through a node
+        # (orientation does not matter here: stored geometries are used as they are)
+        refs, geometries = [], []
+        for src, source in enumerate(sources):
+            for u, v, geometry in source.edges(data="geometry"):
+                refs.append((src, u, v))
+                geometries.append(unpack_coords([u, v]) if geometry is None else geometry)
+        if refs:
+            point_keys = pack_coords(np.concatenate(geometries))
+            point_ref = np.repeat(np.arange(len(refs)), [len(g) for g in geometries])
+            order = np.argsort(point_keys, kind="stable")
+            point_keys, point_ref = point_keys[order], point_ref[order]
+        else:
+            point_keys, point_ref = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
         
-        # Use law of cosines to find angle
-        # cos(angle) = (d1² + d2² - d3²) / (2 * d1 * d2)
-        cos_angle = (d1**2 + d2**2 - d3**2) / (2 * d1 * d2)
+        patch = nx.Graph()
+        expanded: Set[int] = set()
         
-        # Clamp to [-1, 1] to avoid numerical errors in acos
-        cos_angle = max(-1.0, min(1.0, cos_angle))
+        def through(nodes) -> Dict[int, Set[int]]:
+            """Unexpanded edges whose trail passes through (or ends at) any of the nodes, with the nodes hit"""
+            nodes = list(nodes)
+            lo = np.searchsorted(point_keys, nodes, side="left").tolist()
+            hi = np.searchsorted(point_keys, nodes, side="right").tolist()
+            hits: Dict[int, Set[int]] = {}
+            for node, a, b in zip(nodes, lo, hi):
+                for ref in point_ref[a:b].tolist():
+                    if ref not in expanded:
+                        hits.setdefault(ref, set()).add(node)
+            return hits
         
-        return degrees(acos(cos_angle))
+        def expand(ref: int) -> None:
+            """Move an edge into the patch as the segments it was contracted from"""
+            src, u, v = refs[ref]
+            tags = sources[src][u][v].get("tags", 0)
+            chain = pack_coords(geometries[ref]).tolist()
+            steps = path_lengths(geometries[ref]).tolist()
+            patch.add_edges_from(
+                (a, b, {"weight": w, "tags": tags}) for a, b, w in zip(chain, chain[1:], steps)
+            )
+            sources[src].remove_edge(u, v)
+            expanded.add(ref)
+        
+        dirty = {n for u, v, _ in added for n in (u, v)} | {n for u, v in deleted for n in (u, v)}
+        for ref in through(dirty):
+            expand(ref)
+        
+        patch.remove_edges_from([(u, v) for u, v in deleted if patch.has_edge(u, v)])
+        added = [(u, v, code) for u, v, code in added if u != v]
+        if added:
+            ends = unpack_coords([n for u, v, _ in added for n in (u, v)])
+            weights = haversine_points(ends[0::2], ends[1::2]).tolist()
+            patch.add_edges_from(
+                (u, v, {"weight": w, "tags": int(code)}) for (u, v, code), w in zip(added, weights)
+            )
+        patch.remove_nodes_from([n for n in list(patch.nodes) if patch.degree(n) == 0])
+        
+        ref_index: Dict[Tuple[int, int], int] = {}
+        while True:
+            grown = True
+            while grown:
+                grown = False
+                for ref, nodes in through(list(patch.nodes)).items():
+                    src, u, v = refs[ref]
+                    if (
+                        src == 1
+                        or any(n != u and n != v for n in nodes)
+                        or any(patch.degree(n) + graph.degree(n) == 2 for n in nodes)
+                    ):
+                        expand(ref)
+                        grown = True
+            
+            border = {n for n in patch.nodes if n in graph and graph.degree(n) > 0}
+            simple = GraphService.simplify_graph(patch, keep=border)
+            clashes = [(u, v) for u, v in simple.edges if graph.has_edge(u, v)]
+            if not clashes:
+                break
+            if not ref_index:
+                ref_index = {(min(u, v), max(u, v)): i for i, (src, u, v) in enumerate(refs) if src == 0}
+            for u, v in clashes:
+                expand(ref_index[(min(u, v), max(u, v))])
+        
+        graph.add_edges_from(simple.edges(data=True))
+        # Old junctions now inside a chain, and ends of deleted segments, are left without edges
+        for source in sources:
+            source.remove_nodes_from([n for n in dirty | set(patch.nodes) if n in source and source.degree(n) == 0])
+        _, prune_report = GraphService.prune_graph(
+            graph, keep_points, min_component_km, max_spur_km,
+            region=set(simple.nodes), removed=removed
+        )
+        
+        report = {
+            "segments_added": len(added),
+            "segments_deleted": len(deleted),
+            "edges_expanded": len(expanded),
+            "patch_segments": patch.number_of_edges(),
+            "patch_edges": simple.number_of_edges(),
+            "components_removed": prune_report["components_removed"],
+            "spurs_removed": prune_report["spurs_removed"],
+            "nodes_after": graph.number_of_nodes(),
+            "edges_after": graph.number_of_edges(),
+            "seconds": round(time.perf_counter() - start_time, 3)
+        }
+        logger.info(f"Updated graph: +{len(added)}/-{len(deleted)} segments, re-simplified "
+                    f"{len(expanded)} edges ({report['patch_segments']} segments) in {report['seconds']}s")
+        return report
     
     @staticmethod
-    def find_closest_node(graph: nx.Graph, point: PointModel) -> PointModel | None:
+    def edge_geometry(graph: nx.Graph, u: int, v: int) -> np.ndarray:
+        """
+        Get the full (lat, lon) polyline of edge u-v, oriented from u to v.
+        
+        Edges that were never contracted have no stored geometry and are a
+        straight line between their endpoints.
+        """
+        geometry = graph[u][v].get("geometry")
+        if geometry is None:
+            return unpack_coords([u, v])
+        if pack_coords(geometry[0])[0] != u:
+            return geometry[::-1]
+        return geometry
+    
+    @staticmethod
+    def find_closest_node(graph: nx.Graph, point: PointModel) -> Optional[int]:
         """
         Find the closest graph node to a given point.
         
@@ -134,18 +528,15 @@ class GraphService:
             point: Target point
             
         Returns:
-            Closest node as (lat, lon) tuple or None if graph is empty
+            Closest node (coordinate key) or None if graph is empty
         """
-        min_dist = float("inf")
-        closest_node = None
-        
-        target = (point.lat, point.lon)
+        if graph.number_of_nodes() == 0:
+            return None
         
-        for node in graph.nodes:
-            dist = haversine.haversine(target, node)
-            if dist < min_dist:
-                min_dist = dist
-                closest_node = node
+        nodes = list(graph.nodes)
+        distances = haversine_points(unpack_coords(nodes), (point.lat, point.lon))
+        best = int(np.argmin(distances))
+        closest_node, min_dist = nodes[best], float(distances[best])
         
         logger.debug(f"Found closest node at distance {min_dist:.3f} km")
         return closest_node
@@ -153,16 +544,16 @@ class GraphService:
     @staticmethod
     def shortest_path(
         graph: nx.Graph, 
-        start: PointModel, 
-        end: PointModel,
-    ) -> Tuple[float, List[PointModel]]:
+        start: int, 
+        end: int,
+    ) -> Tuple[float, List[int]]:
         """
         Find shortest path between two nodes using Dijkstra's algorithm.
         
         Args:
             graph: NetworkX graph
-            start: Start node (lat, lon)
-            end: End node (lat, lon)
+            start: Start node (coordinate key)
+            end: End node (coordinate key)
             
         Returns:
             Tuple of (total_distance, path_nodes)
@@ -0,0 +1,297 @@
+"""
+Graph cache - keeps built trail graphs in memory between jobs
+A graph is rebuilt only when its segments file changes
+"""
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import networkx as nx
+import numpy as np
+
+from models import BoxModel, PointModel
+from core.utils import get_logger
+from core.config import STATIC_DIR
+from services.external_graph import ExternalGraphBuilder
+from services.graph import GraphService
+from services.monument_service import MonumentService
+from services.segment_service import SegmentService
+from services.spt_cache import ShortestPathTreeCache
+from services.tile_store import TileStore
+from services.trail_graph import TrailGraph
+from services.trail_tags import PROFILES
+from geometry import pack_coords  # skeleton/geometry.py
+
+logger = get_logger("graph_cache")
+
+
+class GraphCache:
+    """
+    In-memory LRU cache of TrailGraphs keyed by search box.
+
+    Entries are keyed on the box and on the size and modification time of its
+    segments file, so re-downloaded segments produce a fresh graph. Everything
+    derived from a graph (edge index, component labels, ...) is computed once
+    on the TrailGraph and shared by every job that reuses it, and searches
+    from repeated start nodes are served by a shared ShortestPathTreeCache.
+    The weights of every tag profile are precomputed when a graph is built,
+    and its nodes are renumbered along a Hilbert curve so that searches walk
+    memory roughly in map order. Before that, tiny trail islands and short
+    dead-end spurs are pruned (GraphService.prune_graph), keeping the spurs
+    that monuments of the box snap onto.
+
+    The pruned graph of each cached box is kept too, with the edges pruning
+    removed and the segments it was built from. When the segments file of a
+    box changes by a few segments (an area refresh that touched a few ways),
+    only those are applied to it (GraphService.update_graph) instead of
+    simplifying and pruning the whole box again (or, should that fail, the
+    box is built from scratch); when its content did not change at all, the
+    cached TrailGraph and its trees are kept as they are. An updated graph
+    keeps the node ids of the cached one, and with them the cached trees and
+    stored monument trees of every component the update did not touch; its
+    arrays, edge index and profile weights are built again (linear work,
+    unlike the searches the kept trees save).
+
+    `get_tiled_graph` serves a box from the fixed tiles covering it instead
+    (see TileStore), stitched once per set of tiles and cached alongside.
+
+    Segments files above OUT_OF_CORE_BYTES are built out of core instead
+    (ExternalGraphBuilder): sorted runs merged on disk into memory-mapped CSR
+    arrays next to the file, reused while the file is unchanged. Such graphs
+    are not simplified, pruned or renumbered.
+    """
+
+    MAX_GRAPHS = 8  # Graphs kept in memory (least recently used are dropped)
+    NODE_ORDER = "hilbert"  # See TrailGraph.node_order
+    NODE_KEYS = "e6"  # Coordinate quantization of graph nodes (geometry.pack_coords: microdegrees)
+    MAX_UPDATE_FRACTION = 0.05  # Changed segments (of the new file) above which a graph is rebuilt from scratch
+    SEGMENT_ROW = np.dtype([("lo", np.int64), ("hi", np.int64), ("tags", np.int64)])
+    OUT_OF_CORE_BYTES = 200_000_000  # Segments files above this size (~5M segments) are built out of core
+
+    def __init__(
+        self,
+        segment_service: SegmentService,
+        max_graphs: int = MAX_GRAPHS,
+        monument_service: Optional[MonumentService] = None,
+        tile_store: Optional[TileStore] = None
+    ):
+        self.segment_service = segment_service
+        self.monument_service = monument_service
+        self.tile_store = tile_store or TileStore(segment_service.overpass)
+        self.graph_service = GraphService()
+        self.external_builder = ExternalGraphBuilder()
+        self.max_graphs = max_graphs
+        self._graphs: "OrderedDict[Tuple, TrailGraph]" = OrderedDict()
+        # Per segments file: (segment rows, pruned graph, pruned-away edges) of its cached graph
+        self._sources: Dict[str, Tuple[np.ndarray, nx.Graph, nx.Graph]] = {}
+        self._lock = threading.Lock()
+        self.tree_cache = ShortestPathTreeCache()
+
+    def segments_path(self, box: BoxModel, filename: str) -> Path:
+        """Segments file of a box (its directory also holds the box's trees and exports)"""
+        return Path(STATIC_DIR) / self.segment_service.get_directory_name(box) / filename
+
+    def _monument_points(self, box: BoxModel) -> List[Tuple[float, float]]:
+        """(lat, lon) of the monuments of every type in a box, whose trails pruning must keep"""
+        if self.monument_service is None:
+            return []
+        points = []
+        for monument_type in self.monument_service.get_monument_types():
+            for monument in self.monument_service.get_monuments_by_type_and_area(
+                monument_type["id"],
+                box.bottom_left.lat,
+                box.bottom_left.lon,
+                box.top_right.lat,
+                box.top_right.lon
+            ):
+                points.append((monument.location.lat, monument.location.lon))
+        return points
+
+    def get_graph(self, box: BoxModel, filename: str = "segments.txt") -> TrailGraph:
+        """
+        Get the trail graph for a box, downloading segments and building it if needed.
+
+        Raises:
+            Exception: If no segments exist in the box
+        """
+        path = self.segments_path(box, filename)
+        if not path.exists():
+            logger.info("Segments file not found, downloading and processing...")
+            self.segment_service.download_segments(box, filename)
+        if not path.exists():
+            raise Exception("No segments found in the specified area")
+
+        stat = path.stat()
+        key = (str(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            graph = self._graphs.get(key)
+            if graph is not None:
+                self._graphs.move_to_end(key)
+                logger.info(f"Using cached trail graph for {path.parent.name}")
+                return graph
+
+        if stat.st_size > self.OUT_OF_CORE_BYTES:
+            return self._external_graph(key, path)
+
+        segments, tags = self.segment_service.load_tagged_segments(box, filename)
+        if not segments:
+            raise Exception("No segments found in the specified area")
+
+        rows = self._segment_rows(segments, tags)
+        with self._lock:
+            # Taken out while updating: a concurrent request for the box builds its own graph
+            source = self._sources.pop(key[0], None)
+            previous = next((g for k, g in self._graphs.items() if k[0] == key[0]), None)
+
+        graph = None
+        updated: Optional[TrailGraph] = None  # Cached graph the new one is an update of
+        if source is not None:
+            old_rows, graph, removed = source
+            added = np.setdiff1d(rows, old_rows)
+            deleted = np.setdiff1d(old_rows, rows)
+            if not len(added) and not len(deleted) and previous is not None:
+                # Rewritten with the same content: the graph and its trees stay valid
+                logger.info(f"Segments of {path.parent.name} unchanged, keeping the cached trail graph")
+                return self._insert(key, previous, (rows, graph, removed))
+            if len(added) + len(deleted) <= self.MAX_UPDATE_FRACTION * len(rows):
+                logger.info(f"Updating graph of {path.parent.name}: "
+                            f"{len(added)} segments added, {len(deleted)} removed")
+                try:
+                    self.graph_service.update_graph(
+                        graph, removed,
+                        added.tolist(),
+                        deleted[["lo", "hi"]].tolist(),
+                        self._monument_points(box)
+                    )
+                    updated = previous
+                except Exception as e:
+                    # The graph may be half updated: build the box from scratch
+                    logger.warning(f"Updating graph of {path.parent.name} failed ({e}), rebuilding it")
+                    graph = None
+            else:
+                graph = None
+
+        if graph is None:
+            logger.info(f"Building graph from {len(segments)} segments")
+            graph = self.graph_service.make_graph(segments, tags)
+            graph = self.graph_service.simplify_graph(graph)
+            removed = nx.Graph()
+            graph, _ = self.graph_service.prune_graph(graph, self._monument_points(box), removed=removed)
+
+        trail_graph = TrailGraph.from_networkx(graph, node_order=self.NODE_ORDER, previous=updated)
+        trail_graph.tree_cache = self.tree_cache
+        # Node ids depend on pruning and order too: trees stored for other settings are stale
+        trail_graph.segments_key = (
+            f"{stat.st_size}-{stat.st_mtime_ns}-{self.NODE_KEYS}-{self.NODE_ORDER}"
+            f"-pruned{GraphService.MIN_COMPONENT_KM}-{GraphService.MAX_SPUR_KM}"
+        )
+        for name in PROFILES:
+            trail_graph.profile(name)
+        if updated is not None:
+            self._carry_trees(updated, trail_graph)
+        return self._insert(key, trail_graph, (rows, graph, removed))
+
+    def _carry_trees(self, previous: TrailGraph, trail_graph: TrailGraph) -> None:
+        """
+        Keep the cached trees of the components an update left alone (node
+        ids are kept by from_networkx), for the graph and each profile, and
+        let MonumentTreeStore reuse their monument trees (`update_of`).
+        """
+        keep = trail_graph.unchanged_nodes(previous)
+        trail_graph.update_of = (previous.segments_key, previous.n_nodes, keep)
+        carried = 0
+        for name in PROFILES:
+            carried += self.tree_cache.carry(
+                previous.profile(name).version, trail_graph.profile(name).version, keep, trail_graph.n_nodes
+            )
+        logger.info(f"Update left {int(keep.sum())} of {previous.n_nodes} nodes unchanged, "
+                    f"kept {carried} cached trees")
+
+    def _external_graph(self, key: Tuple, path: Path) -> TrailGraph:
+        """Graph of a large segments file, built out of core (or reopened) and memory-mapped"""
+        out_dir = path.with_name(f"{path.stem}_csr")
+        if self.external_builder.is_built(path, out_dir):
+            logger.info(f"Opening out-of-core graph of {path.parent.name}")
+        else:
+            logger.info(f"Building out-of-core graph of {path.parent.name} ({key[1]:,} bytes of segments)")
+            self.external_builder.build(path, out_dir)
+        trail_graph = TrailGraph.open(out_dir)
+        trail_graph.tree_cache = self.tree_cache
+        trail_graph.segments_key = f"{key[1]}-{key[2]}-{self.NODE_KEYS}-external"
+        for name in PROFILES:
+            trail_graph.profile(name)
+        return self._insert(key, trail_graph)
+
+    def get_tiled_graph(self, box: BoxModel) -> TrailGraph:
+        """
+        Get the trail graph of the fixed tiles covering a box (routes may leave the box).
+
+        Raises:
+            ValueError: If the box covers too many tiles
+        """
+        graph_tiles = self.tile_store.covering_tiles(box)
+        tiles_key = self.tile_store.tiles_key(graph_tiles)
+        name = f"tiles:{graph_tiles[0].tile}-{graph_tiles[-1].tile}"
+        key = (name, tiles_key)
+        with self._lock:
+            graph = self._graphs.get(key)
+            if graph is not None:
+                self._graphs.move_to_end(key)
+                logger.info(f"Using cached tiled graph for {name}")
+                return graph
+
+        trail_graph = TrailGraph.stitch([(t.graph, t.boundary) for t in graph_tiles])
+        trail_graph.tree_cache = self.tree_cache
+        trail_graph.segments_key = f"{tiles_key}-{self.NODE_KEYS}-{TileStore.NODE_ORDER}"
+        for profile in PROFILES:
+            trail_graph.profile(profile)
+        return self._insert(key, trail_graph)
+
+    def _insert(
+        self,
+        key: Tuple,
+        trail_graph: TrailGraph,
+        source: Optional[Tuple[np.ndarray, nx.Graph, nx.Graph]] = None
+    ) -> TrailGraph:
+        """Cache a graph (and what it was built from) for its segments file"""
+        with self._lock:
+            # Drop stale versions of the same box before inserting the new one
+            for old in [k for k in self._graphs if k[0] == key[0]]:
+                stale = self._graphs.pop(old)
+                if stale is not trail_graph:
+                    self._drop_trees(stale)
+            self._graphs[key] = trail_graph
+            if source is not None:
+                self._sources[key[0]] = source
+            while len(self._graphs) > self.max_graphs:
+                evicted_key, evicted = self._graphs.popitem(last=False)
+                self._sources.pop(evicted_key[0], None)
+                self._drop_trees(evicted)
+        return trail_graph
+
+    @classmethod
+    def _segment_rows(cls, segments: List[Tuple[PointModel, PointModel]], tags: np.ndarray) -> np.ndarray:
+        """
+        Segments as sorted (lo, hi, tags) rows of coordinate keys, one per node pair
+        (the last tag wins, as in make_graph), to diff two versions of a file.
+        """
+        keys = pack_coords([(p.lat, p.lon) for segment in segments for p in segment]).reshape(-1, 2)
+        rows = np.empty(len(keys), dtype=cls.SEGMENT_ROW)
+        rows["lo"], rows["hi"], rows["tags"] = keys.min(axis=1), keys.max(axis=1), tags
+        rows = rows[rows["lo"] != rows["hi"]][::-1]
+        _, last = np.unique(rows[["lo", "hi"]], return_index=True)
+        return rows[last]
+
+    def clear(self) -> None:
+        """Drop every cached graph"""
+        with self._lock:
+            for graph in self._graphs.values():
+                self._drop_trees(graph)
+            self._graphs.clear()
+            self._sources.clear()
+
+    def _drop_trees(self, graph: TrailGraph) -> None:
+        """Forget the cached trees of a graph and of its profile views"""
+        for version in graph.versions:
+            self.tree_cache.drop_graph(version)
@@ -0,0 +1,177 @@
+"""
+Isochrone service - trails reachable within a walking distance
+"""
+import numpy as np
+from math import cos, floor, ceil, radians
+from typing import Any, Dict, List, Optional, Tuple
+
+from models import PointModel, BoxModel
+from core.utils import get_logger
+from services.edge_index import EdgeSnap
+from services.trail_graph import TrailGraph
+from geometry import concave_hull, encode_polyline, simplify_polyline  # skeleton/geometry.py
+
+logger = get_logger("isochrone_service")
+
+
+class IsochroneService:
+    """
+    Service for reachability queries: every trail stretch within a walking
+    distance of a start point, from one bounded Dijkstra search.
+    """
+
+    BOX_GRID = 0.01  # Degrees; search boxes are snapped outwards to this grid so nearby queries share a graph
+    SIMPLIFY_TOLERANCE_M = 5.0  # Geometry tolerance of the returned lines
+    HULL_EDGE_FRACTION = 0.1  # Hull triangles longer than this share of the distance are cut away...
+    MIN_HULL_EDGE_KM = 0.2  # ...but never below this length
+
+    @classmethod
+    def box_around(cls, point: PointModel, km: float) -> BoxModel:
+        """Bounding box holding everything within `km` (straight line) of a point"""
+        dlat = km / 111.2
+        dlon = km / (111.2 * max(cos(radians(point.lat)), 1e-6))
+        grid = cls.BOX_GRID
+
+        def snap(value: float, up: bool) -> float:
+            return round((ceil if up else floor)(value / grid) * grid, 6)
+
+        return BoxModel(
+            bottom_left=PointModel(lat=snap(point.lat - dlat, False), lon=snap(point.lon - dlon, False)),
+            top_right=PointModel(lat=snap(point.lat + dlat, True), lon=snap(point.lon + dlon, True))
+        )
+
+    @staticmethod
+    def reachable_pieces(
+        graph: TrailGraph,
+        dist: np.ndarray,
+        source: EdgeSnap,
+        km: float
+    ) -> List[Tuple[int, float, float]]:
+        """
+        Stretches (edge, t_from, t_to) of every edge reachable within `km`.
+
+        An edge is walked in from each end with whatever distance is left
+        there; when both stretches meet the whole edge is reachable. The
+        source edge can also be walked directly from the snapped point.
+        """
+        w = graph.edge_weight
+        safe_w = np.maximum(w, 1e-12)
+        from_u = np.clip((km - dist[graph.edge_u]) / safe_w, 0.0, 1.0)
+        from_v = np.clip((km - dist[graph.edge_v]) / safe_w, 0.0, 1.0)
+        from_u[~np.isfinite(dist[graph.edge_u])] = 0.0
+        from_v[~np.isfinite(dist[graph.edge_v])] = 0.0
+
+        whole = from_u + from_v >= 1.0
+        partial = ~whole
+        partial[source.edge] = False
+        pieces = [(int(e), 0.0, 1.0) for e in np.flatnonzero(whole)]
+        for e in np.flatnonzero(partial & (from_u > 0)):
+            pieces.append((int(e), 0.0, float(from_u[e])))
+        for e in np.flatnonzero(partial & (from_v > 0)):
+            pieces.append((int(e), 1.0 - float(from_v[e]), 1.0))
+
+        if not whole[source.edge]:
+            # Merge the stretches from both ends with the one around the snapped point
+            e = source.edge
+            reach = km / safe_w[e]
+            intervals = sorted([
+                (0.0, float(from_u[e])),
+                (1.0 - float(from_v[e]), 1.0),
+                (max(0.0, source.t - reach), min(1.0, source.t + reach))
+            ])
+            merged = [list(intervals[0])]
+            for lo, hi in intervals[1:]:
+                if lo <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], hi)
+                else:
+                    merged.append([lo, hi])
+            pieces += [(e, lo, hi) for lo, hi in merged if hi > lo]
+        return pieces
+
+    def isochrone(
+        self,
+        graph: TrailGraph,
+        start: PointModel,
+        km: float,
+        output_format: str = "polyline",
+        hull_edge_km: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Find every trail stretch within `km` walking distance of a start point.
+
+        Args:
+            graph: Array-backed trail network
+            start: Start point (snapped onto the nearest edge)
+            km: Walking distance
+            output_format: "polyline" for Google encoded polylines, or "geojson"
+            hull_edge_km: Longest hull triangle edge (defaults to a share of km)
+
+        Returns:
+            Dictionary matching IsochroneResponse
+        """
+        source = graph.snap(start.lat, start.lon)
+        if source is None:
+            raise ValueError("Trail graph has no edges")
+
+        dist, _ = graph.search(source, limit=km)
+        pieces = self.reachable_pieces(graph, dist, source, km)
+
+        lines = []
+        length = 0.0
+        tolerance_km = self.SIMPLIFY_TOLERANCE_M / 1000.0
+        for e, t0, t1 in pieces:
+            if t0 == 0.0 and t1 == 1.0:
+                line = graph.geom_coords[graph.geom_offsets[e]:graph.geom_offsets[e + 1]]
+            else:
+                line = graph.edge_polyline(e, t0, t1)
+            lines.append(simplify_polyline(line, tolerance_km))
+            length += float(graph.edge_weight[e]) * (t1 - t0)
+
+        if hull_edge_km is None:
+            hull_edge_km = max(km * self.HULL_EDGE_FRACTION, self.MIN_HULL_EDGE_KM)
+        hull_points = np.concatenate(lines) if lines else np.zeros((0, 2))
+        hull = {
+            "type": "MultiPolygon",
+            "coordinates": [
+                [np.round(ring[:, ::-1], 5).tolist() for ring in polygon]
+                for polygon in concave_hull(hull_points, hull_edge_km)
+            ]
+        }
+        logger.info(f"Isochrone of {km} km: {len(pieces)} trail stretches, {length:.1f} km of trail, "
+                    f"{len(hull['coordinates'])} hull polygons")
+
+        result: Dict[str, Any] = {
+            "start": start,
+            "snapped_start": PointModel(lat=source.lat, lon=source.lon),
+            "snap_distance_km": source.distance_km,
+            "max_distance_km": km,
+            "format": output_format,
+            "edge_count": len(pieces),
+            "length_km": length
+        }
+        if output_format == "polyline":
+            result["polylines"] = [encode_polyline(line) for line in lines]
+            result["hull"] = hull
+        elif output_format == "geojson":
+            result["geojson"] = {
+                "type": "FeatureCollection",
+                "features": [
+                    {
+                        "type": "Feature",
+                        "properties": {"kind": "reachable", "length_km": length},
+                        "geometry": {
+                            "type": "MultiLineString",
+                            # GeoJSON positions are [lon, lat]
+                            "coordinates": [np.round(line[:, ::-1], 5).tolist() for line in lines]
+                        }
+                    },
+                    {
+                        "type": "Feature",
+                        "properties": {"kind": "hull", "max_edge_km": hull_edge_km},
+                        "geometry": hull
+                    }
+                ]
+            }
+        else:
+            raise ValueError(f"Unknown isochrone format: {output_format}")
+        return result
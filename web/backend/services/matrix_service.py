@@ -0,0 +1,209 @@
+"""
+Matrix service - many-to-many trail distances on a cached trail graph
+"""
+import base64
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from models import PointModel
+from core.utils import get_logger
+from services.edge_index import EdgeSnap
+from services.trail_graph import TrailGraph
+
+logger = get_logger("matrix_service")
+
+# Graph of the current pool worker, on its plain lengths (set once per worker by _init_worker)
+_worker_graph: Optional[TrailGraph] = None
+
+
+def _init_worker(graph: TrailGraph) -> None:
+    global _worker_graph
+    _worker_graph = graph.with_weights(graph.edge_length) if graph.masked else graph
+
+
+def _distance_rows(
+    graph: TrailGraph,
+    sources: List[EdgeSnap],
+    targets: List[EdgeSnap],
+    limit: float
+) -> np.ndarray:
+    """
+    Matrix rows for a batch of origins: one bounded multi-source search.
+
+    On weighted views (profiles, masks) the search follows costs, but rows
+    hold the walking length of the cheapest paths and the bound applies to
+    that length, so the search itself is not bounded.
+    """
+    if graph.masked:
+        dist, pred = graph.search_many(sources, return_predecessors=True)
+        rows = graph.lengths_to_many(dist, graph.path_lengths(dist, pred, sources), sources, targets)
+        rows[rows > limit] = np.inf
+        return rows.astype(np.float32)
+    dist = graph.search_many(sources, limit)
+    rows = graph.distances_to_many(dist, sources, targets)
+    # Partial target edges can push a distance past the bound
+    rows[rows > limit] = np.inf
+    return rows.astype(np.float32)
+
+
+def _worker_rows(
+    sources: List[EdgeSnap],
+    targets: List[EdgeSnap],
+    limit: float,
+    weights: Optional[np.ndarray]
+) -> np.ndarray:
+    # Weighted views share every array but the weights: only those are sent
+    graph = _worker_graph if weights is None else _worker_graph.with_weights(weights)
+    return _distance_rows(graph, sources, targets, limit)
+
+
+def _encode(array: np.ndarray) -> str:
+    """Base64 of the little-endian bytes of an array"""
+    return base64.b64encode(array.astype(array.dtype.newbyteorder("<")).tobytes()).decode("ascii")
+
+
+class MatrixService:
+    """
+    Service for trail distance matrices between origins and destinations.
+
+    Every origin and destination is snapped onto the nearest trail edge. Origins
+    are searched in batches (one Dijkstra call per batch, bounded by the maximum
+    distance), and batches are spread over a process pool for large requests.
+
+    scipy's Dijkstra holds the GIL, so batches run in processes, not threads.
+    Each graph keeps one long-lived pool whose workers received the graph once;
+    its profile and masked views reuse that pool and only send their weights.
+    """
+
+    BATCH_SIZE = 32  # Origins per Dijkstra call (bounds the (batch, n) distance array)
+    # Two batches: on a warm pool a batch costs 5-10% of its search in transfers
+    # (test_matrix_pool_speed.py), so a second worker pays off from there
+    PARALLEL_MIN_ORIGINS = 2 * BATCH_SIZE
+    MAX_WORKERS = max(1, min(8, (os.cpu_count() or 1) - 1))
+    MAX_POOLS = 2  # Graphs with live worker pools (every worker holds a copy of its graph)
+    SPARSE_MAX_DENSITY = 0.5  # "auto" picks sparse when at most this share of pairs is reachable
+
+    # Shared by every instance (routers and RouteService):
+    # id(edge_length) -> (edge_length, pool), as views share the lengths array of their graph
+    _pools: "OrderedDict[int, Tuple[np.ndarray, ProcessPoolExecutor]]" = OrderedDict()
+    _lock = threading.Lock()
+
+    def _pool(self, graph: TrailGraph, workers: int) -> ProcessPoolExecutor:
+        """Worker pool of a graph and its views, started on first use"""
+        key = id(graph.edge_length)
+        with self._lock:
+            entry = self._pools.get(key)
+            if entry is not None:
+                self._pools.move_to_end(key)
+                return entry[1]
+            pool = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(graph,))
+            # Holding the array keeps its id from being reused while the pool lives
+            self._pools[key] = (graph.edge_length, pool)
+            while len(self._pools) > self.MAX_POOLS:
+                _, (_, evicted) = self._pools.popitem(last=False)
+                evicted.shutdown(wait=False)  # Running requests finish their batches
+        logger.info(f"Started {workers} matrix worker processes for a graph of {graph.n_edges} edges")
+        return pool
+
+    def shutdown(self) -> None:
+        """Stop every worker pool"""
+        with self._lock:
+            pools = [pool for _, pool in self._pools.values()]
+            self._pools.clear()
+        for pool in pools:
+            pool.shutdown(wait=True)
+
+    def distance_matrix(
+        self,
+        graph: TrailGraph,
+        origins: List[PointModel],
+        destinations: List[PointModel],
+        max_distance_km: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Compute trail distances from every origin to every destination.
+
+        Returns:
+            Dictionary with the (origins, destinations) float32 `matrix` in km
+            (inf where unreachable or beyond max_distance_km) and the snap
+            distances of both point sets
+        """
+        origin_snaps = [graph.snap(p.lat, p.lon) for p in origins]
+        target_snaps = [graph.snap(p.lat, p.lon) for p in destinations]
+        if any(s is None for s in origin_snaps):
+            raise ValueError("Trail graph has no edges")
+
+        matrix = self.snap_matrix(graph, origin_snaps, target_snaps, max_distance_km)
+        return {
+            "matrix": matrix,
+            "origin_snap_km": [round(s.distance_km, 4) for s in origin_snaps],
+            "destination_snap_km": [round(s.distance_km, 4) for s in target_snaps]
+        }
+
+    def snap_matrix(
+        self,
+        graph: TrailGraph,
+        origin_snaps: List[EdgeSnap],
+        target_snaps: List[EdgeSnap],
+        max_distance_km: Optional[float] = None
+    ) -> np.ndarray:
+        """
+        Distance matrix between already snapped points (float32 km, inf = unreachable).
+
+        On weighted views the paths are the cheapest ones, and the values
+        (and max_distance_km) are their walking lengths, not their costs.
+        """
+        limit = np.inf if max_distance_km is None else float(max_distance_km)
+        batches = [origin_snaps[i:i + self.BATCH_SIZE] for i in range(0, len(origin_snaps), self.BATCH_SIZE)]
+        workers = min(self.MAX_WORKERS, len(batches))
+
+        if len(origin_snaps) >= self.PARALLEL_MIN_ORIGINS and workers > 1:
+            logger.info(f"Distance matrix {len(origin_snaps)}x{len(target_snaps)}: "
+                        f"{len(batches)} batches on {workers} processes")
+            weights = graph.edge_weight if graph.masked else None
+            rows = list(self._pool(graph, self.MAX_WORKERS).map(
+                _worker_rows, batches,
+                [target_snaps] * len(batches), [limit] * len(batches), [weights] * len(batches)
+            ))
+        else:
+            logger.info(f"Distance matrix {len(origin_snaps)}x{len(target_snaps)}: {len(batches)} batches")
+            rows = [_distance_rows(graph, batch, target_snaps, limit) for batch in batches]
+
+        matrix = np.vstack(rows) if rows else np.zeros((0, len(target_snaps)), dtype=np.float32)
+        logger.info(f"Distance matrix done: {int(np.isfinite(matrix).sum())} of {matrix.size} pairs reachable")
+        return matrix
+
+    def encode_matrix(self, matrix: np.ndarray, matrix_format: str = "auto") -> Dict[str, Any]:
+        """
+        Encode a distance matrix compactly for JSON.
+
+        dense: `data` is the row-major float32 matrix (inf = unreachable).
+        sparse: only reachable pairs, as `rows`/`cols` (int32) and `data` (float32).
+        All arrays are base64 of little-endian bytes.
+        """
+        finite = np.isfinite(matrix)
+        if matrix_format == "auto":
+            density = finite.mean() if matrix.size else 0.0
+            matrix_format = "sparse" if density <= self.SPARSE_MAX_DENSITY else "dense"
+
+        encoded: Dict[str, Any] = {
+            "format": matrix_format,
+            "shape": list(matrix.shape),
+            "dtype": "float32",
+            "nnz": int(finite.sum())
+        }
+        if matrix_format == "dense":
+            encoded["data"] = _encode(matrix.astype(np.float32))
+        elif matrix_format == "sparse":
+            rows, cols = np.nonzero(finite)
+            encoded["rows"] = _encode(rows.astype(np.int32))
+            encoded["cols"] = _encode(cols.astype(np.int32))
+            encoded["data"] = _encode(matrix[rows, cols].astype(np.float32))
+        else:
+            raise ValueError(f"Unknown matrix format: {matrix_format}")
+        return encoded
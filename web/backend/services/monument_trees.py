@@ -0,0 +1,323 @@
+"""
+Monument trees - precomputed shortest-path trees rooted at every monument of a box
+Stored as memory-mapped float32 distance / int32 predecessor arrays
+"""
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from models import BoxModel, MonumentResponse, PointModel
+from core.utils import get_logger
+from core.config import STATIC_DIR
+from services.edge_index import EdgeSnap
+from services.trail_graph import TrailGraph
+
+logger = get_logger("monument_trees")
+
+
+class MonumentTrees:
+    """
+    Shortest-path trees from each monument of one type in one box.
+
+    Row i of `dist` / `pred` is the search from monument i (a virtual node on
+    its snapped edge, index n). Trails are undirected, so the distance from
+    any start to monument i is looked up in row i from the start's snapped
+    edge, and the route is the tree path from the start back to the monument.
+    """
+
+    def __init__(
+        self,
+        monuments: List[MonumentResponse],
+        snaps: List[EdgeSnap],
+        dist: np.ndarray,
+        pred: np.ndarray
+    ):
+        self.monuments = monuments
+        self.snaps = snaps
+        self.dist = dist
+        self.pred = pred
+        self._index = {self.monument_key(m): i for i, m in enumerate(monuments)}
+
+    @staticmethod
+    def monument_key(monument: MonumentResponse) -> Tuple[str, float, float]:
+        return monument.name, monument.location.lat, monument.location.lon
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.dist.nbytes + self.pred.nbytes)
+
+    def index_of(self, monument: MonumentResponse) -> Optional[int]:
+        """Row of a monument, or None if it was not precomputed"""
+        return self._index.get(self.monument_key(monument))
+
+    def route(
+        self,
+        graph: TrailGraph,
+        i: int,
+        start: EdgeSnap
+    ) -> Tuple[float, List[Tuple[int, float, float]]]:
+        """
+        Distance and route pieces from a snapped start to monument i.
+
+        Returns:
+            (distance_km, pieces) with pieces oriented from the start to the
+            monument; distance is inf (and pieces empty) when unreachable
+        """
+        dist = self.dist[i]
+        distance, via = graph.distance_to(dist, self.snaps[i], start)
+        if not np.isfinite(distance):
+            return distance, []
+        pieces = graph.route_pieces(self.pred[i], self.snaps[i], start, via)
+        return distance, [(e, t1, t0) for e, t0, t1 in reversed(pieces)]
+
+
+class MonumentTreeStore:
+    """
+    Builds, stores and loads MonumentTrees under static/<box>/trees/.
+
+    Each set is tied to the segments file the graph was built from (its size
+    and modification time), so stale trees are never used after a re-download.
+    A set built for the graph an updated graph replaces (TrailGraph.update_of)
+    is brought up to date instead: trees of monuments in components the update
+    did not touch are copied, only the others are searched again.
+    """
+
+    BATCH_SIZE = 32  # Monuments per multi-source search while building
+
+    def __init__(self):
+        # Per meta file: (segments_key, nodes, trees) of the graph the trees were loaded for
+        self._loaded: Dict[str, Tuple[str, int, MonumentTrees]] = {}
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()
+
+    @staticmethod
+    def _paths(box: BoxModel, monument_type: str) -> Tuple[Path, Path, Path]:
+        dir_name = f"{box.bottom_left.lat}_{box.bottom_left.lon}_{box.top_right.lat}_{box.top_right.lon}"
+        base = Path(STATIC_DIR) / dir_name / "trees"
+        stem = re.sub(r"[^\w-]", "_", monument_type)
+        return base / f"{stem}.json", base / f"{stem}.dist.npy", base / f"{stem}.pred.npy"
+
+    def build(
+        self,
+        graph: TrailGraph,
+        box: BoxModel,
+        monument_type: str,
+        monuments: List[MonumentResponse]
+    ) -> Dict[str, Any]:
+        """
+        Precompute and store the trees of every monument, replacing older ones.
+
+        Returns:
+            Memory report: monuments, nodes, bytes and build time
+        """
+        start_time = time.perf_counter()
+        meta_path, dist_path, pred_path = self._paths(box, monument_type)
+        meta_path.parent.mkdir(parents=True, exist_ok=True)
+
+        snaps = [graph.snap(m.location.lat, m.location.lon) for m in monuments]
+        if any(s is None for s in snaps):
+            raise ValueError("Trail graph has no edges")
+        shape = (len(monuments), graph.n_nodes + 1)
+        dist_out = np.lib.format.open_memmap(dist_path, mode="w+", dtype=np.float32, shape=shape)
+        pred_out = np.lib.format.open_memmap(pred_path, mode="w+", dtype=np.int32, shape=shape)
+
+        self._search_rows(graph, snaps, list(range(len(snaps))), dist_out, pred_out)
+        dist_out.flush()
+        pred_out.flush()
+        del dist_out, pred_out
+
+        report = self._write_meta(meta_path, graph, monument_type, monuments, snaps, start_time)
+        logger.info(f"Precomputed {len(monuments)} {monument_type} trees over {graph.n_nodes} nodes: "
+                    f"{report['bytes'] / 1e6:.1f} MB in {report['build_seconds']}s")
+        return report
+
+    def _search_rows(
+        self,
+        graph: TrailGraph,
+        snaps: List[EdgeSnap],
+        rows: List[int],
+        dist_out: np.ndarray,
+        pred_out: np.ndarray
+    ) -> None:
+        """Fill `rows` of the output arrays with the searches from their monuments' snaps"""
+        n = graph.n_nodes
+        for lo in range(0, len(rows), self.BATCH_SIZE):
+            batch = rows[lo:lo + self.BATCH_SIZE]
+            dist, pred = graph.search_many([snaps[i] for i in batch], return_predecessors=True)
+            # Each search_many row has one column per virtual source; keep the own one as column n
+            for k, i in enumerate(batch):
+                dist_out[i, :n] = dist[k, :n]
+                dist_out[i, n] = 0.0
+                row = pred[k, :n]
+                pred_out[i, :n] = np.where(row >= n, n, row)
+                pred_out[i, n] = -9999
+
+    def _write_meta(
+        self,
+        meta_path: Path,
+        graph: TrailGraph,
+        monument_type: str,
+        monuments: List[MonumentResponse],
+        snaps: List[EdgeSnap],
+        start_time: float
+    ) -> Dict[str, Any]:
+        """Write the meta file of a tree set (last, once its arrays are in place) and return its report"""
+        report = {
+            "box": meta_path.parent.parent.name,
+            "monument_type": monument_type,
+            "monuments": len(monuments),
+            "nodes": graph.n_nodes,
+            "bytes": len(monuments) * (graph.n_nodes + 1) * 8,
+            "build_seconds": round(time.perf_counter() - start_time, 3)
+        }
+        meta = {
+            **report,
+            "segments_key": graph.segments_key,
+            "items": [
+                {
+                    "name": m.name,
+                    "lat": m.location.lat,
+                    "lon": m.location.lon,
+                    "edge": s.edge,
+                    "t": s.t,
+                    "distance_km": s.distance_km,
+                    "snap_lat": s.lat,
+                    "snap_lon": s.lon
+                }
+                for m, s in zip(monuments, snaps)
+            ]
+        }
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+
+        with self._lock:
+            self._loaded.pop(str(meta_path), None)
+        return report
+
+    def _update(self, graph: TrailGraph, box: BoxModel, monument_type: str) -> bool:
+        """
+        Bring the trees built for the graph `graph` updates (graph.update_of)
+        up to date. A monument that snaps to the same point of a component the
+        update did not touch keeps its tree (padded with the added nodes, out of
+        its reach); the others are searched again.
+
+        Returns:
+            False if the stored set is not for that graph (or no longer there)
+        """
+        start_time = time.perf_counter()
+        meta_path, dist_path, pred_path = self._paths(box, monument_type)
+        old_key, old_n, keep = graph.update_of
+        with self._update_lock:
+            if not meta_path.exists():
+                return False
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if (meta.get("segments_key"), meta.get("nodes")) == (graph.segments_key, graph.n_nodes):
+                return True  # Updated by another request meanwhile
+            if (meta.get("segments_key"), meta.get("nodes")) != (old_key, old_n):
+                return False
+
+            items = meta["items"]
+            monuments = [
+                MonumentResponse(name=item["name"], location=PointModel(lat=item["lat"], lon=item["lon"]))
+                for item in items
+            ]
+            snaps = [graph.snap(m.location.lat, m.location.lon) for m in monuments]
+            if any(s is None for s in snaps):
+                return False
+            reuse = [
+                i for i, (item, s) in enumerate(zip(items, snaps))
+                if self._same_snap(graph, s, item, old_n, keep)
+            ]
+            search = sorted(set(range(len(items))) - set(reuse))
+
+            n = graph.n_nodes
+            shape = (len(monuments), n + 1)
+            suffix = f".{os.getpid()}.{threading.get_ident()}.tmp.npy"
+            dist_tmp = dist_path.with_name(dist_path.name + suffix)
+            pred_tmp = pred_path.with_name(pred_path.name + suffix)
+            dist_out = np.lib.format.open_memmap(dist_tmp, mode="w+", dtype=np.float32, shape=shape)
+            pred_out = np.lib.format.open_memmap(pred_tmp, mode="w+", dtype=np.int32, shape=shape)
+            if reuse:
+                old_dist = np.load(dist_path, mmap_mode="r")
+                old_pred = np.load(pred_path, mmap_mode="r")
+                dist_out[reuse, :old_n] = old_dist[reuse, :old_n]
+                dist_out[reuse, old_n:n] = np.inf
+                dist_out[reuse, n] = 0.0
+                rows = old_pred[reuse, :old_n]
+                pred_out[reuse, :old_n] = np.where(rows == old_n, n, rows)  # The virtual node moved to n
+                pred_out[reuse, old_n:] = -9999
+                del old_dist, old_pred
+            self._search_rows(graph, snaps, search, dist_out, pred_out)
+            dist_out.flush()
+            pred_out.flush()
+            del dist_out, pred_out
+            dist_tmp.replace(dist_path)
+            pred_tmp.replace(pred_path)
+            report = self._write_meta(meta_path, graph, monument_type, monuments, snaps, start_time)
+        logger.info(f"Updated {monument_type} trees in {meta_path.parent}: kept {len(reuse)}, "
+                    f"searched {len(search)} in {report['build_seconds']}s")
+        return True
+
+    @staticmethod
+    def _same_snap(graph: TrailGraph, snap: EdgeSnap, item: Dict[str, Any], old_n: int, keep: np.ndarray) -> bool:
+        """Whether a monument snaps where it did, onto an edge of a component the update left alone"""
+        u, v = int(graph.edge_u[snap.edge]), int(graph.edge_v[snap.edge])
+        return (
+            u < old_n and v < old_n and bool(keep[u])
+            and (snap.lat, snap.lon, snap.t) == (item["snap_lat"], item["snap_lon"], item["t"])
+        )
+
+    def load(self, graph: TrailGraph, box: BoxModel, monument_type: str) -> Optional[MonumentTrees]:
+        """Memory-map the trees of a box and type, or None if absent or built for other segments"""
+        if graph.segments_key is None:
+            return None  # Masked view or graph built outside the cache
+        meta_path, dist_path, pred_path = self._paths(box, monument_type)
+        key = str(meta_path)
+        with self._lock:
+            cached = self._loaded.get(key)
+        # Tiled, out-of-core and refreshed graphs of the box have other node ids: check every hit
+        trees = None
+        if cached is not None and cached[:2] == (graph.segments_key, graph.n_nodes):
+            trees = cached[2]
+        if trees is None:
+            if not meta_path.exists():
+                return None
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get("segments_key") != graph.segments_key or meta.get("nodes") != graph.n_nodes:
+                if graph.update_of is None or not self._update(graph, box, monument_type):
+                    logger.info(f"Ignoring stale {monument_type} trees in {meta_path.parent}")
+                    return None
+                with open(meta_path) as f:
+                    meta = json.load(f)
+            trees = MonumentTrees(
+                [
+                    MonumentResponse(name=item["name"], location=PointModel(lat=item["lat"], lon=item["lon"]))
+                    for item in meta["items"]
+                ],
+                [
+                    EdgeSnap(item["edge"], item["t"], item["distance_km"], item["snap_lat"], item["snap_lon"])
+                    for item in meta["items"]
+                ],
+                np.load(dist_path, mmap_mode="r"),
+                np.load(pred_path, mmap_mode="r")
+            )
+            with self._lock:
+                self._loaded[key] = (graph.segments_key, graph.n_nodes, trees)
+        return trees
+
+    def memory_report(self) -> List[Dict[str, Any]]:
+        """Size of every stored tree set, per box and monument type"""
+        report = []
+        for meta_path in sorted(Path(STATIC_DIR).glob("*/trees/*.json")):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            report.append({k: meta[k] for k in ("box", "monument_type", "monuments", "nodes", "bytes", "build_seconds")})
+        return report
@@ -3,6 +3,7 @@ Overpass API service - Fast trail data download
 Much faster than page-by-page GPX downloads from OSM
 """
 import requests
+import hashlib
 import json
 import pickle
 from pathlib import Path
@@ -12,6 +13,7 @@ from datetime import datetime, timedelta
 from models import PointModel, BoxModel
 from core.utils import get_logger
 from core.config import STATIC_DIR
+from services.trail_tags import encode_tags
 
 logger = get_logger("overpass_service")
 
@@ -22,6 +24,11 @@ class OverpassService:
     Downloads all trail data in a single request instead of page-by-page
     
     10-50x faster than OSM trackpoints API!
+    
+    Ways are cached one record per way id with a hash of their content, so a
+    refresh of an expired area tells which ways were added, removed or
+    changed (`download_ways`); a refresh that changed nothing lets callers
+    keep everything they built from the area.
     """
     
     # Multiple Overpass API mirrors for reliability
@@ -40,7 +47,8 @@ class OverpassService:
     def _get_cache_path(self, box: BoxModel) -> Path:
         """Get cache file path for bounding box"""
         box_hash = f"{box.bottom_left.lat}_{box.bottom_left.lon}_{box.top_right.lat}_{box.top_right.lon}"
-        return self.cache_dir / f"{box_hash}.pkl"
+        # Per-way records: older segment-list caches are simply not picked up
+        return self.cache_dir / f"{box_hash}_ways.pkl"
     
     def _is_cache_valid(self, cache_path: Path) -> bool:
         """Check if cached data is still valid"""
@@ -58,9 +66,22 @@ class OverpassService:
         logger.info(f" Using cached data (age: {age.days} days)")
         return True
     
-    def download_trails(self, box: BoxModel) -> List[Tuple[PointModel, PointModel]]:
+    def download_trails(self, box: BoxModel) -> List[Tuple[PointModel, PointModel, int]]:
         """
-        Download hiking/walking trails from Overpass API
+        Download hiking/walking trails from Overpass API as segments
+        
+        Returns:
+            List of trail segments as (start_point, end_point, tag_code) tuples
+            (see services/trail_tags.py)
+        """
+        return self.ways_to_segments(self.download_ways(box)[0])
+    
+    def download_ways(
+        self,
+        box: BoxModel
+    ) -> Tuple[Dict[int, Tuple[str, int, List[Tuple[float, float]]]], Optional[Dict[str, Any]]]:
+        """
+        Download the hiking/walking trail ways of a box from Overpass API
         
         Much faster than OSM trackpoints API:
         - Single request vs hundreds of pages
@@ -71,7 +92,9 @@ class OverpassService:
             box: Bounding box
             
         Returns:
-            List of trail segments as (start_point, end_point) tuples
+            (ways, changes): ways as {way_id: (content_hash, tag_code, [(lat, lon), ...])},
+            and, when an expired cache was refreshed, what changed since (see
+            `diff_ways`); changes is None for cached data or a first download
         """
         cache_path = self._get_cache_path(box)
         
@@ -79,7 +102,13 @@ class OverpassService:
         if self._is_cache_valid(cache_path):
             logger.info(f"📂 Loading trails from cache: {cache_path}")
             with open(cache_path, 'rb') as f:
-                return pickle.load(f)
+                return pickle.load(f), None
+        
+        # Expired cache: compared with the refresh by way id and content hash
+        old_ways = None
+        if cache_path.exists():
+            with open(cache_path, 'rb') as f:
+                old_ways = pickle.load(f)
         
         # Validate bounding box size
         box_width = abs(box.top_right.lon - box.bottom_left.lon)
@@ -113,15 +142,21 @@ class OverpassService:
                 logger.info(f"✅ Downloaded {len(data.get('elements', []))} OSM elements")
                 
                 # Convert to trail segments
-                segments = self._extract_segments(data)
-                logger.info(f"✅ Extracted {len(segments)} trail segments")
+                ways = self._extract_ways(data)
+                logger.info(f"✅ Extracted {len(ways)} ways")
+                
+                changes = None
+                if old_ways is not None:
+                    changes = self.diff_ways(old_ways, ways)
+                    logger.info(f"🔄 Refresh: {len(changes['added'])} ways added, {len(changes['removed'])} removed, "
+                                f"{len(changes['changed'])} changed, {changes['unchanged']} unchanged")
                 
                 # Cache the results
                 with open(cache_path, 'wb') as f:
-                    pickle.dump(segments, f)
+                    pickle.dump(ways, f)
                 logger.info(f"💾 Cached trails to: {cache_path}")
                 
-                return segments
+                return ways, changes
                 
             except requests.Timeout as e:
                 last_error = e
@@ -149,7 +184,8 @@ class OverpassService:
         - highway=path (hiking paths)
         - highway=footway (walking paths)
         - highway=track (rural tracks)
-        - route=hiking (marked hiking routes)
+        - route=hiking/foot relations containing those ways (marked trails),
+          output without geometry: only their member way ids are used
         """
         bbox_str = f"{box.bottom_left.lat},{box.bottom_left.lon},{box.top_right.lat},{box.top_right.lon}"
         
@@ -160,39 +196,82 @@ class OverpassService:
           way["highway"="path"]({bbox_str});
           way["highway"="footway"]({bbox_str});
           way["highway"="track"]["tracktype"~"grade[1-3]"]({bbox_str});
-        );
-        out geom;
+        )->.trails;
+        .trails out geom;
+        rel(bw.trails)["route"~"^(hiking|foot)$"];
+        out skel;
         """
         
         return query
     
-    def _extract_segments(self, data: Dict[str, Any]) -> List[Tuple[PointModel, PointModel]]:
+    def _extract_segments(self, data: Dict[str, Any]) -> List[Tuple[PointModel, PointModel, int]]:
         """
         Extract trail segments from Overpass API response
         
-        Converts OSM ways to point-to-point segments
+        Converts OSM ways to point-to-point segments, each with the tag code
+        of its way (highway, tracktype, and whether a hiking route uses it)
         """
-        segments = []
+        return self.ways_to_segments(self._extract_ways(data))
+    
+    def _extract_ways(self, data: Dict[str, Any]) -> Dict[int, Tuple[str, int, List[Tuple[float, float]]]]:
+        """
+        Extract ways from Overpass API response
+        
+        Returns:
+            {way_id: (content_hash, tag_code, [(lat, lon), ...])}; the hash
+            covers the tag code and the geometry, all a way contributes
+        """
+        ways = {}
+        
+        marked_ways = {
+            member['ref']
+            for element in data.get('elements', []) if element['type'] == 'relation'
+            for member in element.get('members', []) if member['type'] == 'way'
+        }
         
         for element in data.get('elements', []):
             if element['type'] == 'way' and 'geometry' in element:
-                # Get nodes from geometry
-                nodes = element['geometry']
-                
-                # Create segments between consecutive nodes
-                for i in range(len(nodes) - 1):
-                    start = PointModel(
-                        lat=nodes[i]['lat'],
-                        lon=nodes[i]['lon']
-                    )
-                    end = PointModel(
-                        lat=nodes[i + 1]['lat'],
-                        lon=nodes[i + 1]['lon']
-                    )
-                    segments.append((start, end))
+                code = encode_tags(element.get('tags', {}), element['id'] in marked_ways)
+                coords = [(node['lat'], node['lon']) for node in element['geometry']]
+                content_hash = hashlib.sha1(repr((code, coords)).encode()).hexdigest()
+                ways[element['id']] = (content_hash, code, coords)
         
+        return ways
+    
+    @staticmethod
+    def ways_to_segments(
+        ways: Dict[int, Tuple[str, int, List[Tuple[float, float]]]]
+    ) -> List[Tuple[PointModel, PointModel, int]]:
+        """Segments between consecutive nodes of every way, with the way's tag code"""
+        segments = []
+        for _, code, coords in ways.values():
+            points = [PointModel(lat=lat, lon=lon) for lat, lon in coords]
+            segments.extend((start, end, code) for start, end in zip(points, points[1:]))
         return segments
     
+    @staticmethod
+    def diff_ways(
+        old: Dict[int, Tuple[str, int, List[Tuple[float, float]]]],
+        new: Dict[int, Tuple[str, int, List[Tuple[float, float]]]]
+    ) -> Dict[str, Any]:
+        """
+        Compare two downloads of an area by way id and content hash
+        
+        Returns:
+            Dict with the added, removed and changed way ids, the number of
+            unchanged ways and whether anything changed at all (`any`)
+        """
+        changed = [way_id for way_id in new.keys() & old.keys() if new[way_id][0] != old[way_id][0]]
+        added = sorted(new.keys() - old.keys())
+        removed = sorted(old.keys() - new.keys())
+        return {
+            "added": added,
+            "removed": removed,
+            "changed": sorted(changed),
+            "unchanged": len(new.keys() & old.keys()) - len(changed),
+            "any": bool(added or removed or changed)
+        }
+    
     def clear_cache(self, box: Optional[BoxModel] = None):
         """Clear cached data for a specific box or all caches"""
         if box:
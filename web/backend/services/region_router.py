@@ -0,0 +1,285 @@
+"""
+Region router - routes across the whole region on tile graphs plus an overlay of tile boundary nodes
+Only the tiles of the two route ends are searched; the overlay is stored in static/tiles/overlay.npz
+"""
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from models import BoxModel, PointModel
+from core.utils import get_logger
+from core.config import DefaultBox
+from services.edge_index import EdgeSnap
+from services.tile_store import GraphTile, TileStore
+from geometry import encode_polyline, pack_coords  # skeleton/geometry.py
+
+logger = get_logger("region_router")
+
+
+class RegionRouter:
+    """
+    Two-level routing over the tiles of a TileStore.
+
+    The overlay graph has one node per tile boundary node (by coordinate key,
+    so the copies held by neighbouring tiles are one node) and one edge per
+    tile shortcut: the shortest distance between two boundary nodes inside
+    that tile. Any route leaves a tile through a boundary node, so a route
+    between two points is their tile-local distance to the boundary nodes of
+    their own tiles plus an overlay search in between; only the start and end
+    tiles are searched. The geometry is unpacked afterwards by re-running each
+    overlay hop inside its tile.
+
+    The overlay of the whole region is a few boundary nodes per kilometre of
+    tile border, small enough to keep in memory.
+    """
+
+    OVERLAY_FILE = "overlay.npz"
+
+    def __init__(self, tile_store: Optional[TileStore] = None):
+        self.tile_store = tile_store or TileStore()
+        self.overlay_path = self.tile_store.tiles_dir / self.OVERLAY_FILE
+        self._overlay: Optional[Dict[str, np.ndarray]] = None
+        self._overlay_stamp: Optional[int] = None
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Overlay
+    # ------------------------------------------------------------------
+
+    def build_overlay(self, box: Optional[BoxModel] = None) -> Dict[str, Any]:
+        """
+        Build the overlay of every tile covering a box (the whole region by default).
+
+        Tiles not stored yet are downloaded and built first. The overlay is
+        stored as CSR arrays: node keys, adjacency, shortcut lengths and the
+        tile each shortcut runs in.
+
+        Returns:
+            Report with the number of tiles, overlay nodes and edges, bytes and seconds
+        """
+        start = time.perf_counter()
+        box = box or BoxModel(
+            bottom_left=PointModel(lat=DefaultBox.BOTTOM_LEFT_LAT, lon=DefaultBox.BOTTOM_LEFT_LON),
+            top_right=PointModel(lat=DefaultBox.TOP_RIGHT_LAT, lon=DefaultBox.TOP_RIGHT_LON)
+        )
+        tiles = self.tile_store.tiles_for_box(box)
+        us, vs, dists, owners = [], [], [], []
+        for i, tile in enumerate(tiles):
+            graph_tile = self.tile_store.get_tile(tile)
+            keys = pack_coords(graph_tile.graph.node_coords)
+            us.append(keys[graph_tile.shortcut_u])
+            vs.append(keys[graph_tile.shortcut_v])
+            dists.append(graph_tile.shortcut_dist)
+            owners.append(np.full(len(graph_tile.shortcut_u), i, dtype=np.int32))
+        u, v = np.concatenate(us + [np.zeros(0, dtype=np.int64)]), np.concatenate(vs + [np.zeros(0, dtype=np.int64)])
+        dist, owner = np.concatenate(dists + [np.zeros(0)]), np.concatenate(owners + [np.zeros(0, dtype=np.int32)])
+
+        node_keys, ends = np.unique(np.concatenate([u, v]), return_inverse=True)
+        rows = np.concatenate([ends[:len(u)], ends[len(u):]])
+        cols = np.concatenate([ends[len(u):], ends[:len(u)]])
+        dist, owner = np.tile(dist, 2), np.tile(owner, 2)
+
+        # Shortest shortcut per node pair (two tiles may join the same boundary nodes)
+        order = np.lexsort((dist, cols, rows))
+        rows, cols, dist, owner = rows[order], cols[order], dist[order], owner[order]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        rows, cols, dist, owner = rows[first], cols[first], dist[first], owner[first]
+
+        overlay = {
+            "keys": node_keys,
+            "indptr": np.searchsorted(rows, np.arange(len(node_keys) + 1)).astype(np.int64),
+            "indices": cols.astype(np.int32),
+            "weights": dist,
+            "edge_tile": owner,
+            "tiles": np.array(tiles, dtype=np.int64).reshape(-1, 2)
+        }
+        # Written under a temporary name first: a half-written overlay is never loaded
+        tmp = self.overlay_path.with_suffix(".tmp.npz")
+        np.savez(tmp, **overlay)
+        tmp.replace(self.overlay_path)
+
+        report = {
+            "tiles": len(tiles),
+            "nodes": len(node_keys),
+            "edges": len(cols) // 2,
+            "bytes": int(sum(a.nbytes for a in overlay.values())),
+            "seconds": round(time.perf_counter() - start, 3)
+        }
+        logger.info(f"Built region overlay: {report}")
+        return report
+
+    def overlay(self) -> Dict[str, np.ndarray]:
+        """Stored overlay arrays, reloaded when the overlay file changes"""
+        if not self.overlay_path.exists():
+            raise ValueError("No region overlay built yet")
+        stamp = self.overlay_path.stat().st_mtime_ns
+        with self._lock:
+            if self._overlay is None or self._overlay_stamp != stamp:
+                with np.load(self.overlay_path) as data:
+                    self._overlay = {name: data[name] for name in data.files}
+                self._overlay_stamp = stamp
+            return self._overlay
+
+    # ------------------------------------------------------------------
+    # Routing
+    # ------------------------------------------------------------------
+
+    def _snap(self, point: PointModel) -> Tuple[GraphTile, EdgeSnap]:
+        tile = tuple(self.tile_store.tiles_of([(point.lat, point.lon)])[0].tolist())
+        graph_tile = self.tile_store.get_tile(tile)
+        snap = graph_tile.graph.snap(point.lat, point.lon) if graph_tile.graph.n_edges else None
+        if snap is None:
+            raise ValueError(f"No trail in tile {tile} around ({point.lat}, {point.lon})")
+        return graph_tile, snap
+
+    def route(self, start: PointModel, end: PointModel, geometry: bool = True) -> Dict[str, Any]:
+        """
+        Shortest trail route between two points anywhere in the overlay region.
+
+        Args:
+            start: Start point (snapped onto the nearest trail of its tile)
+            end: End point (snapped onto the nearest trail of its tile)
+            geometry: Also return the route as an encoded polyline
+
+        Returns:
+            Dict with distance_km, snapped points, tiles searched / loaded and seconds
+
+        Raises:
+            ValueError: If there is no overlay, no trail near a point or no route
+        """
+        started = time.perf_counter()
+        overlay = self.overlay()
+        keys = overlay["keys"]
+        start_tile, source = self._snap(start)
+        end_tile, target = self._snap(end)
+        loaded = {start_tile.tile, end_tile.tile}
+
+        dist_s, pred_s = start_tile.graph.search_many([source], return_predecessors=True)
+        dist_t, pred_t = end_tile.graph.search_many([target], return_predecessors=True)
+        dist_s, pred_s, dist_t, pred_t = dist_s[0], pred_s[0], dist_t[0], pred_t[0]
+
+        best, direct_via = np.inf, None
+        if start_tile.tile == end_tile.tile:
+            best, direct_via = start_tile.graph.distance_to(dist_s, source, target)
+
+        # Boundary nodes of both end tiles that take part in the overlay
+        s_nodes, s_rows = self._overlay_nodes(start_tile, keys)
+        t_nodes, t_rows = self._overlay_nodes(end_tile, keys)
+        s_dist, t_dist = dist_s[s_nodes], dist_t[t_nodes]
+        s_ok, t_ok = np.isfinite(s_dist), np.isfinite(t_dist)
+        s_rows, s_dist, t_rows, t_dist = s_rows[s_ok], s_dist[s_ok], t_rows[t_ok], t_dist[t_ok]
+
+        hops = None
+        if len(s_rows) and len(t_rows):
+            # Virtual source node N joined to the start tile's boundary nodes
+            n = len(keys)
+            matrix = csr_matrix(
+                (
+                    np.concatenate([overlay["weights"], s_dist]),
+                    np.concatenate([overlay["indices"], s_rows]),
+                    np.append(overlay["indptr"], overlay["indptr"][-1] + len(s_rows))
+                ),
+                shape=(n + 1, n + 1)
+            )
+            dist, pred = dijkstra(
+                matrix, directed=True, indices=n, return_predecessors=True,
+                limit=best if np.isfinite(best) else np.inf
+            )
+            via = dist[t_rows] + t_dist
+            i = int(np.argmin(via))
+            if via[i] < best:
+                best = float(via[i])
+                hops = [int(t_rows[i])]
+                while pred[hops[-1]] != n:
+                    hops.append(int(pred[hops[-1]]))
+                hops.reverse()
+
+        if not np.isfinite(best):
+            raise ValueError("No trail route between the points in the overlay region")
+
+        result = {
+            "distance_km": round(float(best), 3),
+            "start": PointModel(lat=source.lat, lon=source.lon),
+            "end": PointModel(lat=target.lat, lon=target.lon),
+            "tiles_searched": len(loaded)
+        }
+        if geometry:
+            if hops is None:
+                polyline = start_tile.graph.pieces_polyline(
+                    start_tile.graph.route_pieces(pred_s, source, target, direct_via)
+                )
+            else:
+                polyline = self._unpack(overlay, hops, start_tile, source, pred_s, end_tile, target, pred_t, loaded)
+            result["polyline"] = encode_polyline(polyline)
+        result["tiles_loaded"] = len(loaded)
+        result["seconds"] = round(time.perf_counter() - started, 4)
+        return result
+
+    @staticmethod
+    def _overlay_nodes(graph_tile: GraphTile, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Boundary nodes of a tile found in the overlay: (tile node ids, overlay rows)"""
+        boundary_keys = pack_coords(graph_tile.graph.node_coords[graph_tile.boundary])
+        rows = np.minimum(np.searchsorted(keys, boundary_keys), max(len(keys) - 1, 0))
+        found = keys[rows] == boundary_keys if len(keys) else np.zeros(len(rows), dtype=bool)
+        return graph_tile.boundary[found], rows[found]
+
+    @staticmethod
+    def _local_node(graph_tile: GraphTile, key: int) -> int:
+        boundary_keys = pack_coords(graph_tile.graph.node_coords[graph_tile.boundary])
+        return int(graph_tile.boundary[np.flatnonzero(boundary_keys == key)[0]])
+
+    def _unpack(
+        self,
+        overlay: Dict[str, np.ndarray],
+        hops: List[int],
+        start_tile: GraphTile,
+        source: EdgeSnap,
+        pred_s: np.ndarray,
+        end_tile: GraphTile,
+        target: EdgeSnap,
+        pred_t: np.ndarray,
+        loaded: set
+    ) -> np.ndarray:
+        """Polyline of a route through overlay nodes `hops`, each hop re-searched inside its tile"""
+        keys, indptr, indices = overlay["keys"], overlay["indptr"], overlay["indices"]
+
+        graph = start_tile.graph
+        nodes = graph.node_path(pred_s, self._local_node(start_tile, int(keys[hops[0]])))
+        first = nodes[0]
+        pieces = [(source.edge, source.t, 0.0 if first == graph.edge_u[source.edge] else 1.0)]
+        parts = [self._nodes_polyline(graph, nodes, pieces)]
+
+        for a, b in zip(hops[:-1], hops[1:]):
+            lo, hi = indptr[a], indptr[a + 1]
+            row, col = overlay["tiles"][overlay["edge_tile"][lo + np.flatnonzero(indices[lo:hi] == b)[0]]]
+            graph_tile = self.tile_store.get_tile((int(row), int(col)))
+            loaded.add(graph_tile.tile)
+            u = self._local_node(graph_tile, int(keys[a]))
+            _, pred = graph_tile.graph.node_tree(u)
+            nodes = graph_tile.graph.node_path(pred, self._local_node(graph_tile, int(keys[b])))
+            parts.append(self._nodes_polyline(graph_tile.graph, nodes, []))
+
+        graph = end_tile.graph
+        nodes = graph.node_path(pred_t, self._local_node(end_tile, int(keys[hops[-1]])))[::-1]
+        last = nodes[-1]
+        pieces = [(target.edge, 0.0 if last == graph.edge_u[target.edge] else 1.0, target.t)]
+        parts.append(self._nodes_polyline(graph, nodes, [], pieces))
+
+        parts = [part for part in parts if len(part)]
+        # Consecutive parts share their junction point; keep it once
+        return np.concatenate([parts[0]] + [part[1:] for part in parts[1:]])
+
+    @staticmethod
+    def _nodes_polyline(graph, nodes: List[int], before: list, after: Optional[list] = None) -> np.ndarray:
+        """Polyline of `before` pieces, the edges through `nodes` and `after` pieces"""
+        pieces = list(before)
+        for a, b in zip(nodes[:-1], nodes[1:]):
+            e = graph.edge_between(a, b)
+            pieces.append((e, 0.0, 1.0) if graph.edge_u[e] == a else (e, 1.0, 0.0))
+        pieces += after or []
+        return graph.pieces_polyline(pieces) if pieces else np.zeros((0, 2))
@@ -0,0 +1,352 @@
+"""
+Route pipeline - the stages of a route job with memoized, content-addressed outputs
+A stage is skipped when the output for its inputs and parameters already exists
+"""
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from models import BoxModel, MonumentResponse, PointModel
+from core.utils import get_logger
+from core.config import STATIC_DIR
+from services.edge_masks import EdgeMaskService
+from services.graph import GraphService
+from services.graph_cache import GraphCache
+from services.monument_service import MonumentService
+from services.monument_trees import MonumentTreeStore
+from services.route_service import RouteCalculationResult, RouteService
+from services.segment_service import SegmentService
+from services.tile_store import TileStore
+from services.trail_graph import TrailGraph
+
+logger = get_logger("route_pipeline")
+
+HIT, MISS, SKIPPED = "hit", "miss", "skipped"
+
+
+class StageStore:
+    """
+    Outputs of pipeline stages on disk, one pickle per stage and key.
+
+    Keys are hashes of everything a stage output depends on: the digests of
+    its inputs (outputs of earlier stages) and its own parameters, so equal
+    keys always name equal outputs and nothing is ever invalidated in place.
+    """
+
+    STORE_DIR = "stages"
+
+    def __init__(self, base_dir: Optional[Path] = None):
+        self.base_dir = Path(base_dir) if base_dir is not None else Path(STATIC_DIR) / self.STORE_DIR
+
+    @staticmethod
+    def key(stage: str, **inputs: Any) -> str:
+        """Content address of a stage output"""
+        text = json.dumps({"stage": stage, **inputs}, sort_keys=True, default=str)
+        return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+    def _path(self, stage: str, key: str) -> Path:
+        return self.base_dir / stage / f"{key}.pkl"
+
+    def get(self, stage: str, key: str) -> Optional[Any]:
+        path = self._path(stage, key)
+        if not path.exists():
+            return None
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable {stage} output {key}: {e}")
+            return None
+
+    def put(self, stage: str, key: str, value: Any) -> None:
+        path = self._path(stage, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Written under a temporary name first: a half-written output is never read
+        tmp = path.with_name(f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp.replace(path)
+
+
+class RoutePipeline:
+    """
+    A route job as stages: segments, monuments, graph, routes, export.
+
+    Every stage output is addressed by a hash of its inputs and parameters
+    (StageStore.key) and reused when it exists:
+
+    - segments: the segments file of the box, keyed on the box and on the
+      segment settings (SegmentService.settings_key), so changing n_clusters
+      re-downloads instead of serving a file built with other settings. Its
+      digest is the hash of the file content (tiled jobs: TileStore.tiles_key).
+    - monuments: the monuments of the type in the box, keyed on the monument
+      database file.
+    - graph: the routing graph, keyed on the segments digest, the graph
+      settings, the profile and the masks. Built graphs are kept by
+      GraphCache; the graph is not loaded at all when the routes are reused.
+    - routes: the calculated RouteCalculationResult, keyed on the graph, the
+      start, the monuments digest and the options of the mode.
+    - export: routes_<key>.png and .kml in the box directory, keyed on the routes.
+
+    `run` reports per stage whether it was a hit, a miss, or skipped (not
+    needed because every later stage was a hit).
+
+    Stages run as a small dependency graph on threads: segments and monuments
+    need only the box and are fetched concurrently; the graph waits for both
+    (the routes key needs the monuments); the start and monuments are snapped
+    as soon as the graph exists, while the monument trees are loaded; the PNG
+    and KML exports are rendered concurrently (RouteService.export_routes).
+    """
+
+    STAGES = ("segments", "monuments", "graph", "routes", "export")
+    STAGE_PROGRESS = {"segments": 0.3, "monuments": 0.4, "graph": 0.5, "routes": 0.9, "export": 0.95}
+    EXPORT_NAME_CHARS = 16  # Characters of the export key in file names
+    MAX_WORKERS = 2  # Stage threads per job (segments and monuments at once)
+    MAX_GRAPH_KEYS = 64  # Graph stage keys remembered (least recently used are dropped)
+
+    def __init__(
+        self,
+        segment_service: SegmentService,
+        graph_cache: GraphCache,
+        monument_service: MonumentService,
+        route_service: RouteService,
+        monument_trees: MonumentTreeStore,
+        edge_masks: EdgeMaskService,
+        store: Optional[StageStore] = None
+    ):
+        self.segment_service = segment_service
+        self.graph_cache = graph_cache
+        self.monument_service = monument_service
+        self.route_service = route_service
+        self.monument_trees = monument_trees
+        self.edge_masks = edge_masks
+        self.store = store or StageStore()
+        # Graph stage key -> version of the TrailGraph it produced (served again from GraphCache on a hit)
+        self._graph_versions: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Stages
+    # ------------------------------------------------------------------
+
+    def _segments(self, box: BoxModel, tiled: bool) -> Tuple[str, str]:
+        """(digest of the segments, hit or miss)"""
+        if tiled:
+            tile_store = self.graph_cache.tile_store
+            tiles = tile_store.tiles_for_box(box)
+            status = HIT if all(tile_store.is_stored(tile) for tile in tiles) else MISS
+            return tile_store.tiles_key(tile_store.covering_tiles(box)), status
+
+        filename = "segments.txt"
+        path = self.graph_cache.segments_path(box, filename)
+        key = self.store.key(
+            "segments", box=path.parent.name, filename=filename, settings=self.segment_service.settings_key()
+        )
+        record = self.store.get("segments", key)
+        if record is not None and path.exists():
+            stat = path.stat()
+            if (stat.st_size, stat.st_mtime_ns) == (record["size"], record["mtime_ns"]):
+                return record["digest"], HIT
+
+        logger.info(f"Segments of {path.parent.name} missing or built with other settings, downloading")
+        self.segment_service.download_segments(box, filename)
+        if not path.exists():
+            raise Exception("No segments found in the specified area")
+        stat = path.stat()
+        digest = hashlib.sha256(path.read_bytes()).hexdigest()[:32]
+        self.store.put("segments", key, {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "digest": digest})
+        return digest, MISS
+
+    def _graph_key(
+        self,
+        segments: str,
+        box: BoxModel,
+        tiled: bool,
+        profile: str,
+        avoid_masks: Optional[List[str]],
+        avoid_polygons: Optional[List[List[PointModel]]]
+    ) -> str:
+        if tiled:
+            settings = f"{GraphCache.NODE_KEYS}-{TileStore.NODE_ORDER}"
+        else:
+            settings = (
+                f"{GraphCache.NODE_KEYS}-{GraphCache.NODE_ORDER}"
+                f"-pruned{GraphService.MIN_COMPONENT_KM}-{GraphService.MAX_SPUR_KM}"
+            )
+        return self.store.key(
+            "graph",
+            segments=segments,
+            settings=settings,
+            profile=profile,
+            masks=self.edge_masks.definitions(box, avoid_masks or []),
+            polygons=[[(p.lat, p.lon) for p in polygon] for polygon in avoid_polygons or []]
+        )
+
+    def _graph(
+        self,
+        key: str,
+        box: BoxModel,
+        tiled: bool,
+        profile: str,
+        avoid_masks: Optional[List[str]],
+        avoid_polygons: Optional[List[List[PointModel]]]
+    ) -> Tuple[TrailGraph, str]:
+        """(routing graph, hit or miss): a hit when GraphCache still holds the graph of this key"""
+        if tiled:
+            trail_graph = self.graph_cache.get_tiled_graph(box).profile(profile)
+        else:
+            trail_graph = self.graph_cache.get_graph(box, "segments.txt").profile(profile)
+        trail_graph = self.edge_masks.apply(trail_graph, box, avoid_masks, avoid_polygons)
+        with self._lock:
+            status = HIT if self._graph_versions.get(key) == trail_graph.version else MISS
+            self._graph_versions[key] = trail_graph.version
+            self._graph_versions.move_to_end(key)
+            while len(self._graph_versions) > self.MAX_GRAPH_KEYS:
+                self._graph_versions.popitem(last=False)
+        return trail_graph, status
+
+    def _monuments(self, box: BoxModel, monument_type: str) -> Tuple[List[MonumentResponse], str, str]:
+        """(monuments, digest, hit or miss)"""
+        db_path = Path(self.monument_service.storage.db_path)
+        stat = db_path.stat() if db_path.exists() else None
+        key = self.store.key(
+            "monuments",
+            box=self.segment_service.get_directory_name(box),
+            monument_type=monument_type,
+            database=(str(db_path.resolve()), stat.st_size, stat.st_mtime_ns) if stat else None
+        )
+        monuments = self.store.get("monuments", key)
+        if monuments is not None:
+            return monuments, key, HIT
+
+        monuments = self.monument_service.get_monuments_by_type_and_area(
+            monument_type=monument_type,
+            bottom_left_lat=box.bottom_left.lat,
+            bottom_left_lon=box.bottom_left.lon,
+            top_right_lat=box.top_right.lat,
+            top_right_lon=box.top_right.lon
+        )
+        self.store.put("monuments", key, monuments)
+        return monuments, key, MISS
+
+    # ------------------------------------------------------------------
+    # Job
+    # ------------------------------------------------------------------
+
+    def run(
+        self,
+        job_id: str,
+        start_point: PointModel,
+        monument_type: str,
+        search_box: BoxModel,
+        simplify_tolerance_m: Optional[float] = None,
+        simplify_zoom: Optional[int] = None,
+        optimization_mode: Optional[str] = "shortest",
+        return_to_start: bool = False,
+        max_distance_km: Optional[float] = None,
+        alternatives: int = 0,
+        avoid_masks: Optional[List[str]] = None,
+        avoid_polygons: Optional[List[List[PointModel]]] = None,
+        profile: str = "shortest",
+        tiled: bool = False,
+        progress: Optional[Callable[[float], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        Run a route job, reusing every stage output that already exists.
+
+        Returns:
+            Result of RouteService.calculate_and_export plus `stages`, the hit,
+            miss or skipped status of every stage
+
+        Raises:
+            Exception: If the box has no segments or no monuments of the type
+        """
+        stages: Dict[str, str] = {}
+
+        def done(stage: str, status: str) -> None:
+            stages[stage] = status
+            logger.info(f"Job {job_id}: stage {stage} {status}")
+            if progress is not None:
+                # Concurrent stages finish in any order: report the furthest one
+                progress(max(self.STAGE_PROGRESS[name] for name in stages))
+
+        with ThreadPoolExecutor(max_workers=self.MAX_WORKERS) as pool:
+            # Segments and monuments need only the box
+            fetches = {
+                pool.submit(self._segments, search_box, tiled): "segments",
+                pool.submit(self._monuments, search_box, monument_type): "monuments"
+            }
+            outputs: Dict[str, Tuple] = {}
+            for future in as_completed(fetches):
+                stage = fetches[future]
+                outputs[stage] = future.result()
+                done(stage, outputs[stage][-1])
+            segments = outputs["segments"][0]
+            monuments, monuments_digest = outputs["monuments"][:2]
+            if not monuments:
+                raise Exception(f"No monuments of type {monument_type} found in the area")
+
+            graph_key = self._graph_key(segments, search_box, tiled, profile, avoid_masks, avoid_polygons)
+            route_options = {
+                "simplify_tolerance_m": simplify_tolerance_m,
+                "simplify_zoom": simplify_zoom,
+                "optimization_mode": optimization_mode,
+                "return_to_start": return_to_start,
+                "max_distance_km": max_distance_km,
+                "alternatives": alternatives
+            }
+            routes_key = self.store.key(
+                "routes",
+                graph=graph_key,
+                start=(start_point.lat, start_point.lon),
+                monuments=monuments_digest,
+                simplify=(self.route_service.simplify_method, self.route_service.simplify_tolerance_m),
+                **route_options
+            )
+
+            result: Optional[RouteCalculationResult] = self.store.get("routes", routes_key)
+            if result is None:
+                trail_graph, status = self._graph(
+                    graph_key, search_box, tiled, profile, avoid_masks, avoid_polygons
+                )
+                done("graph", status)
+                # Snapping needs only the graph: it runs while the monument trees are loaded
+                snapping = pool.submit(self.route_service.snap_points, trail_graph, start_point, monuments)
+                trees = self.monument_trees.load(trail_graph, search_box, monument_type)
+                logger.info(f"Job {job_id}: Calculating routes to {len(monuments)} monuments")
+                result = self.route_service.calculate_routes(
+                    trail_graph, start_point, monuments, trees=trees, snaps=snapping.result(), **route_options
+                )
+                self.store.put("routes", routes_key, result)
+                done("routes", MISS)
+            else:
+                done("graph", SKIPPED)
+                done("routes", HIT)
+
+        # The routes key covers the simplification the PNG is drawn with
+        export_name = self.store.key("export", routes=routes_key)[:self.EXPORT_NAME_CHARS]
+        box_dir = self.graph_cache.segments_path(search_box, "segments.txt").parent
+        paths = {ext: box_dir / f"routes_{export_name}.{ext}" for ext in ("png", "kml")}
+        if all(path.exists() for path in paths.values()):
+            files = {}
+            for ext, path in paths.items():
+                files[f"{ext}_file"] = str(path)
+                files[f"{ext}_url"] = f"/static/{path.relative_to(STATIC_DIR)}"
+            done("export", HIT)
+        else:
+            # PNG and KML are rendered concurrently
+            files = self.route_service.export_routes(
+                search_box, result, export_name, simplify_tolerance_m, simplify_zoom
+            )
+            done("export", MISS)
+
+        result_data = result.to_dict()
+        result_data.update(files)
+        result_data["stages"] = {stage: stages[stage] for stage in self.STAGES}
+        return result_data
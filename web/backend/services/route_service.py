@@ -3,17 +3,26 @@ Route service - handles route calculation and export
 Port of skeleton/routes.py to web backend
 """
 import networkx as nx
+import numpy as np
+from math import cos, radians
 from staticmap import StaticMap, CircleMarker, Line
 import simplekml
-from haversine import haversine
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Tuple, Dict, Any, Optional
 
 from models import PointModel, BoxModel, MonumentResponse
 from core.utils import get_logger
 from core.config import STATIC_DIR
+from services.edge_index import EdgeSnap
+from services.alternative_service import AlternativeRouteService
 from services.graph import GraphService
+from services.matrix_service import MatrixService
+from services.monument_trees import MonumentTrees
+from services.tour_service import TourService
+from services.trail_graph import TrailGraph
+from geometry import pack_coords, simplify_polyline, unpack_coords  # skeleton/geometry.py
 
 logger = get_logger("route_service")
 
@@ -27,19 +36,42 @@ class RouteCalculationResult:
         self.monuments = monuments
         self.reachable_monuments: List[MonumentResponse] = []
         self.unreachable_monuments: List[MonumentResponse] = []
+        # Parallel to reachable_monuments: route length and simplified (lat, lon) polyline
+        self.distances: List[float] = []
+        self.geometries: List[np.ndarray] = []
+        self.snap_distances: List[float] = []
+        # Connected component summary of the trail graph (see RouteService.find_routes)
+        self.components: Dict[str, Any] = {}
+        # Parallel to reachable_monuments: alternative routes (distance_km, sharing, geometry)
+        self.alternatives: List[List[Dict[str, Any]]] = []
+        # Set for tours: visiting order, total length and continuous geometry
+        self.tour: Optional[Dict[str, Any]] = None
+    
+    def add_route(
+        self,
+        monument: MonumentResponse,
+        distance: float,
+        geometry: np.ndarray,
+        snap_distance: float = 0.0,
+        alternatives: Optional[List[Dict[str, Any]]] = None
+    ) -> None:
+        """Record a reachable monument with its route and its distance off the trail"""
+        self.reachable_monuments.append(monument)
+        self.distances.append(distance)
+        self.geometries.append(geometry)
+        self.snap_distances.append(snap_distance)
+        self.alternatives.append(alternatives or [])
     
     def get_distance(self, monument: MonumentResponse) -> Optional[float]:
         """Get distance to a monument in km"""
-        try:
-            start_node = (self.start.lat, self.start.lon)
-            end_node = (monument.location.lat, monument.location.lon)
-            return nx.shortest_path_length(self.graph, start_node, end_node, weight="weight")
-        except (nx.NetworkXNoPath, nx.NodeNotFound):
-            return None
+        for reachable, distance in zip(self.reachable_monuments, self.distances):
+            if reachable is monument:
+                return distance
+        return None
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary for JSON serialization"""
-        return {
+        data = {
             "start": {"lat": self.start.lat, "lon": self.start.lon},
             "total_monuments": len(self.monuments),
             "reachable_monuments": len(self.reachable_monuments),
@@ -48,9 +80,19 @@ class RouteCalculationResult:
                 {
                     "monument": m.name,
                     "location": {"lat": m.location.lat, "lon": m.location.lon},
-                    "distance_km": self.get_distance(m)
+                    "distance_km": distance,
+                    "snap_distance_km": snap_distance,
+                    # [[lat, lon], ...] rounded to ~1 m to keep the payload small
+                    "geometry": np.round(geometry, 5).tolist(),
+                    "alternatives": [
+                        {**alt, "geometry": np.round(alt["geometry"], 5).tolist()}
+                        for alt in alternatives
+                    ]
                 }
-                for m in self.reachable_monuments
+                for m, distance, geometry, snap_distance, alternatives in zip(
+                    self.reachable_monuments, self.distances, self.geometries, self.snap_distances,
+                    self.alternatives
+                )
             ],
             "unreachable": [
                 {
@@ -58,29 +100,178 @@ class RouteCalculationResult:
                     "location": {"lat": m.location.lat, "lon": m.location.lon}
                 }
                 for m in self.unreachable_monuments
-            ]
+            ],
+            "components": self.components
         }
+        if self.tour is not None:
+            data["tour"] = {**self.tour, "geometry": np.round(self.tour["geometry"], 5).tolist()}
+        return data
 
 
 class RouteService:
     """Service for route calculation and export"""
     
-    def __init__(self):
+    # Polyline simplification applied to every route before it leaves the service
+    SIMPLIFY_METHOD = "douglas_peucker"  # or "visvalingam"
+    SIMPLIFY_TOLERANCE_M = 5.0  # Max deviation from the real trail, in metres
+    REPORTED_COMPONENTS = 10  # Largest connected component sizes listed in results
+    TOUR_TIME_BUDGET_S = 2.0  # Local search budget when ordering a monument tour
+    MAX_ALTERNATIVES = 5  # Alternative routes per monument at most
+    
+    def __init__(
+        self,
+        simplify_method: str = SIMPLIFY_METHOD,
+        simplify_tolerance_m: float = SIMPLIFY_TOLERANCE_M
+    ):
         self.graph_service = GraphService()
+        self.matrix_service = MatrixService()
+        self.alternative_service = AlternativeRouteService()
+        self.simplify_method = simplify_method
+        self.simplify_tolerance_m = simplify_tolerance_m
+    
+    @staticmethod
+    def tolerance_for_zoom(zoom: int, lat: float) -> float:
+        """
+        Get a simplification tolerance (metres) that is invisible at a map zoom level.
+        
+        Uses half the size of a Web Mercator pixel at the given latitude, so the
+        simplified line never moves by more than half a pixel on screen.
+        """
+        metres_per_pixel = 156543.03392 * cos(radians(lat)) / (2 ** zoom)
+        return metres_per_pixel / 2
+    
+    def simplify_route(
+        self,
+        coords: np.ndarray,
+        tolerance_m: Optional[float] = None,
+        zoom: Optional[int] = None
+    ) -> np.ndarray:
+        """
+        Simplify a route polyline for output.
+        
+        Args:
+            coords: (n, 2) array of (lat, lon) points along the route
+            tolerance_m: Tolerance in metres (defaults to the service setting)
+            zoom: Map zoom level; when given, overrides tolerance_m with a
+                  tolerance that is visually lossless at that zoom
+            
+        Returns:
+            Simplified (m, 2) array, m <= n, with the same endpoints
+        """
+        if zoom is not None and len(coords):
+            tolerance_m = self.tolerance_for_zoom(zoom, float(coords[:, 0].mean()))
+        elif tolerance_m is None:
+            tolerance_m = self.simplify_tolerance_m
+        return simplify_polyline(coords, tolerance_m / 1000.0, self.simplify_method)
+    
+    @staticmethod
+    def snap_points(
+        graph: TrailGraph,
+        start: PointModel,
+        monuments: List[MonumentResponse]
+    ) -> Tuple[Optional[EdgeSnap], List[Optional[EdgeSnap]]]:
+        """Snap the start and every monument onto the trail graph (None if it has no edges)"""
+        snaps = graph.edge_index.snap_many(
+            [(start.lat, start.lon)] + [(m.location.lat, m.location.lon) for m in monuments]
+        )
+        return snaps[0], snaps[1:]
+    
+    def _snap_on_start_component(
+        self,
+        graph: TrailGraph,
+        start: PointModel,
+        monuments: List[MonumentResponse],
+        result: RouteCalculationResult,
+        snaps: Optional[Tuple[Optional[EdgeSnap], List[Optional[EdgeSnap]]]] = None
+    ) -> Optional[Tuple[EdgeSnap, List[Tuple[MonumentResponse, EdgeSnap]]]]:
+        """
+        Snap the start and the monuments onto the trail graph.
+        
+        Monuments on another connected component than the start can never be
+        reached: they are rejected from the cached labels without any search.
+        
+        Args:
+            snaps: Result of snap_points for these points, if already computed
+        
+        Returns:
+            (start_snap, [(monument, snap), ...]) for the monuments sharing the
+            start's component, or None if the start cannot be snapped
+        """
+        start_snap, monument_snaps = snaps if snaps is not None else self.snap_points(graph, start, monuments)
+        if start_snap is None:
+            logger.error("Could not find start node: trail graph has no edges")
+            result.unreachable_monuments = monuments.copy()
+            return None
+        
+        logger.info(f"Start snapped {start_snap.distance_km * 1000:.0f} m onto edge {start_snap.edge}")
+        
+        start_component = graph.snap_component(start_snap)
+        sizes = graph.component_sizes
+        result.components = {
+            "count": int(len(sizes)),
+            "start_component_nodes": int(sizes[start_component]),
+            "largest": np.sort(sizes)[::-1][:self.REPORTED_COMPONENTS].tolist()
+        }
+        
+        targets = []
+        for monument, end_snap in zip(monuments, monument_snaps):
+            if graph.snap_component(end_snap) != start_component:
+                result.unreachable_monuments.append(monument)
+            else:
+                targets.append((monument, end_snap))
+        
+        logger.info(f"{len(monuments) - len(targets)} monuments rejected as off the start component "
+                   f"({sizes[start_component]} of {graph.n_nodes} nodes)")
+        return start_snap, targets
+    
+    @staticmethod
+    def _add_pieces(
+        result: RouteCalculationResult,
+        graph: TrailGraph,
+        pieces: List[Tuple[int, float, float]]
+    ) -> None:
+        """Add route pieces, with their trail geometry, to the result graph"""
+        for e, t0, t1 in pieces:
+            polyline = graph.edge_polyline(e, t0, t1)
+            ends = pack_coords(polyline[[0, -1]]).tolist()
+            result.graph.add_edge(
+                ends[0], ends[1],
+                weight=float(graph.edge_weight[e] * abs(t1 - t0)),
+                geometry=polyline
+            )
     
     def find_routes(
         self, 
-        graph: nx.Graph, 
+        graph: TrailGraph, 
         start: PointModel, 
-        monuments: List[MonumentResponse]
+        monuments: List[MonumentResponse],
+        simplify_tolerance_m: Optional[float] = None,
+        simplify_zoom: Optional[int] = None,
+        trees: Optional[MonumentTrees] = None,
+        alternatives: int = 0,
+        snaps: Optional[Tuple[Optional[EdgeSnap], List[Optional[EdgeSnap]]]] = None
     ) -> RouteCalculationResult:
         """
         Find shortest routes from start point to all monuments.
         
+        The start and every monument are snapped onto the nearest trail edge
+        (not the nearest node) and routed as virtual nodes on that edge. A
+        single Dijkstra search from the start serves all monuments; monuments on
+        another connected component are marked unreachable before searching.
+        With precomputed monument trees, each monument that has one is answered
+        from its tree, and the search only runs if some monument has none.
+        Alternatives come from the trees of the start and of the monument (see
+        AlternativeRouteService), one extra search per monument without trees.
+        
         Args:
-            graph: NetworkX graph of trail network
+            graph: Array-backed trail network
             start: Starting point
             monuments: List of monument destinations
+            simplify_tolerance_m: Route simplification tolerance in metres
+            simplify_zoom: Map zoom level to derive the tolerance from
+            trees: Precomputed monument trees of this graph, if any
+            alternatives: Alternative routes wanted per monument (at most MAX_ALTERNATIVES)
+            snaps: Start and monument snaps (snap_points), if already computed
             
         Returns:
             RouteCalculationResult with all routes
@@ -89,50 +280,258 @@ class RouteService:
         
         result = RouteCalculationResult(start, monuments)
         
-        # Find closest graph node to start point
-        try:
-            start_node = self.graph_service.find_closest_node(graph, start)
-        except Exception as e:
-            logger.error(f"Could not find start node: {e}")
-            result.unreachable_monuments = monuments.copy()
+        snapped = self._snap_on_start_component(graph, start, monuments, result, snaps)
+        if snapped is None:
             return result
+        start_snap, targets = snapped
+        
+        alternatives = min(alternatives, self.MAX_ALTERNATIVES)
+        rows = [trees.index_of(monument) if trees is not None else None for monument, _ in targets]
+        if any(row is None for row in rows) or (alternatives and targets):
+            dist, pred = graph.search(start_snap)
+        else:
+            dist, pred = None, None
+            if targets:
+                logger.info(f"Answering {len(targets)} monuments from precomputed trees")
+        
+        full_points = 0
+        kept_points = 0
         
         # Calculate route to each monument
-        for monument in monuments:
+        for (monument, end_snap), row in zip(targets, rows):
             try:
-                # Find closest graph node to monument
-                end_node = self.graph_service.find_closest_node(graph, monument.location)
+                if row is not None:
+                    distance, pieces = trees.route(graph, row, start_snap)
+                else:
+                    distance, via = graph.distance_to(dist, start_snap, end_snap)
+                    pieces = None
                 
-                # Calculate shortest path
-                distance, path = self.graph_service.shortest_path(graph, start_node, end_node)
+                if not np.isfinite(distance):
+                    logger.warning(f"No path to monument {monument.name}")
+                    result.unreachable_monuments.append(monument)
+                    continue
                 
-                # Add path edges to result graph
-                for i in range(len(path) - 1):
-                    node1 = path[i]
-                    node2 = path[i + 1]
-                    weight = haversine(node1, node2)
-                    result.graph.add_edge(node1, node2, weight=weight)
+                # Add route pieces (with their trail geometry) to result graph
+                if pieces is None:
+                    pieces = graph.route_pieces(pred, start_snap, end_snap, via)
+                cost = distance
+                if graph.masked:
+                    distance = graph.pieces_length(pieces)
+                self._add_pieces(result, graph, pieces)
                 
-                result.reachable_monuments.append(monument)
+                geometry = graph.pieces_polyline(pieces)
+                simplified = self.simplify_route(geometry, simplify_tolerance_m, simplify_zoom)
+                full_points += len(geometry)
+                kept_points += len(simplified)
+                
+                alts = []
+                if alternatives:
+                    if row is not None:
+                        end_tree = (trees.dist[row], trees.pred[row])
+                    else:
+                        end_tree = graph.search(end_snap)
+                    for alt in self.alternative_service.alternatives(
+                        graph, start_snap, end_snap, (dist, pred), end_tree, pieces, cost, alternatives
+                    ):
+                        self._add_pieces(result, graph, alt["pieces"])
+                        alt_geometry = graph.pieces_polyline(alt["pieces"])
+                        alts.append({
+                            "distance_km": alt["distance_km"],
+                            "sharing": alt["sharing"],
+                            "geometry": self.simplify_route(alt_geometry, simplify_tolerance_m, simplify_zoom)
+                        })
+                
+                result.add_route(monument, distance, simplified, end_snap.distance_km, alts)
                 logger.debug(f"Route to {monument.name}: {distance:.2f} km")
                 
-            except (nx.NetworkXNoPath, nx.NodeNotFound) as e:
-                logger.warning(f"No path to monument {monument.name}: {e}")
-                result.unreachable_monuments.append(monument)
             except Exception as e:
                 logger.error(f"Error calculating route to {monument.name}: {e}", exc_info=True)
                 result.unreachable_monuments.append(monument)
         
         logger.info(f"Routes calculated: {len(result.reachable_monuments)} reachable, "
                    f"{len(result.unreachable_monuments)} unreachable")
+        logger.info(f"Route geometry simplified ({self.simplify_method}): "
+                   f"{full_points} → {kept_points} points")
         
         return result
     
+    def find_tour(
+        self,
+        graph: TrailGraph,
+        start: PointModel,
+        monuments: List[MonumentResponse],
+        return_to_start: bool = False,
+        simplify_tolerance_m: Optional[float] = None,
+        simplify_zoom: Optional[int] = None,
+        snaps: Optional[Tuple[Optional[EdgeSnap], List[Optional[EdgeSnap]]]] = None
+    ) -> RouteCalculationResult:
+        """
+        Find one continuous route from the start through every reachable monument.
+        
+        Builds the start/monument distance matrix on the trail graph, orders the
+        monuments with TourService (nearest neighbour + 2-opt/Or-opt within
+        TOUR_TIME_BUDGET_S) and traces the legs between consecutive stops.
+        Each monument's route in the result is the leg that arrives at it.
+        
+        Args:
+            graph: Array-backed trail network
+            start: Starting point
+            monuments: List of monuments to visit
+            return_to_start: Close the tour with a leg back to the start
+            simplify_tolerance_m: Route simplification tolerance in metres
+            simplify_zoom: Map zoom level to derive the tolerance from
+            snaps: Start and monument snaps (snap_points), if already computed
+            
+        Returns:
+            RouteCalculationResult with the legs in visiting order and `tour` set
+        """
+        logger.info(f"Calculating tour from {start} through {len(monuments)} monuments")
+        
+        result = RouteCalculationResult(start, monuments)
+        snapped = self._snap_on_start_component(graph, start, monuments, result, snaps)
+        if snapped is None or not snapped[1]:
+            return result
+        start_snap, targets = snapped
+        
+        snaps = [start_snap] + [snap for _, snap in targets]
+        matrix = self.matrix_service.snap_matrix(graph, snaps, snaps).astype(np.float64)
+        order = TourService.solve(matrix, closed=return_to_start, time_budget_s=self.TOUR_TIME_BUDGET_S)
+        return self.trace_tour(
+            graph, result, start_snap, [targets[i - 1] for i in order],
+            return_to_start, simplify_tolerance_m, simplify_zoom
+        )
+    
+    def trace_tour(
+        self,
+        graph: TrailGraph,
+        result: RouteCalculationResult,
+        start_snap: EdgeSnap,
+        stops: List[Tuple[MonumentResponse, EdgeSnap]],
+        return_to_start: bool,
+        simplify_tolerance_m: Optional[float] = None,
+        simplify_zoom: Optional[int] = None
+    ) -> RouteCalculationResult:
+        """
+        Trace the legs of a tour visiting `stops` in order and record them in `result`.
+        
+        Leg searches are batched: one multi-source search per MatrixService.BATCH_SIZE legs.
+        """
+        legs = [start_snap] + [snap for _, snap in stops] + ([start_snap] if return_to_start else [])
+        batch_size = self.matrix_service.BATCH_SIZE
+        
+        polylines = []
+        total = 0.0
+        for lo in range(0, len(legs) - 1, batch_size):
+            sources = legs[lo:min(lo + batch_size, len(legs) - 1)]
+            dist, pred = graph.search_many(sources, return_predecessors=True)
+            for k, source in enumerate(sources):
+                target = legs[lo + k + 1]
+                distance, via = graph.distance_to(dist[k], source, target)
+                pieces = graph.route_pieces(pred[k], source, target, via)
+                if graph.masked:
+                    distance = graph.pieces_length(pieces)
+                self._add_pieces(result, graph, pieces)
+                geometry = graph.pieces_polyline(pieces)
+                polylines.append(geometry)
+                total += distance
+                
+                i = lo + k
+                if i < len(stops):
+                    monument = stops[i][0]
+                    simplified = self.simplify_route(geometry, simplify_tolerance_m, simplify_zoom)
+                    result.add_route(monument, distance, simplified, target.distance_km)
+        
+        geometry = np.concatenate([polylines[0]] + [p[1:] for p in polylines[1:]])
+        result.tour = {
+            "order": [monument.name for monument, _ in stops],
+            "distance_km": total,
+            "return_to_start": return_to_start,
+            "geometry": self.simplify_route(geometry, simplify_tolerance_m, simplify_zoom)
+        }
+        
+        logger.info(f"Tour calculated: {len(stops)} monuments, {total:.2f} km, "
+                    f"{len(result.unreachable_monuments)} unreachable")
+        return result
+    
+    def find_orienteering_route(
+        self,
+        graph: TrailGraph,
+        start: PointModel,
+        monuments: List[MonumentResponse],
+        max_distance_km: float,
+        simplify_tolerance_m: Optional[float] = None,
+        simplify_zoom: Optional[int] = None,
+        snaps: Optional[Tuple[Optional[EdgeSnap], List[Optional[EdgeSnap]]]] = None
+    ) -> RouteCalculationResult:
+        """
+        Find a round trip from the start visiting as many monuments as possible
+        within a total walking distance.
+        
+        A monument farther than half the budget can never be part of a round
+        trip, so one search from the start bounded at max_distance_km / 2 (the
+        find_routes search, with a limit) selects the candidates. Their distance
+        matrix then feeds TourService.orienteering, and the chosen stops are
+        traced like a closed tour.
+        
+        Args:
+            graph: Array-backed trail network
+            start: Starting (and finishing) point
+            monuments: List of monuments to choose from
+            max_distance_km: Walking budget for the whole round trip
+            simplify_tolerance_m: Route simplification tolerance in metres
+            simplify_zoom: Map zoom level to derive the tolerance from
+            snaps: Start and monument snaps (snap_points), if already computed
+            
+        Returns:
+            RouteCalculationResult with the legs in visiting order and `tour` set;
+            monuments that did not fit the budget are listed in tour["skipped"]
+        """
+        logger.info(f"Calculating round trip of at most {max_distance_km} km from {start} "
+                    f"among {len(monuments)} monuments")
+        
+        result = RouteCalculationResult(start, monuments)
+        snapped = self._snap_on_start_component(graph, start, monuments, result, snaps)
+        if snapped is None:
+            return result
+        start_snap, targets = snapped
+        
+        dist, _ = graph.search(start_snap, limit=max_distance_km / 2)
+        candidates = [
+            (monument, snap) for monument, snap in targets
+            if graph.distance_to(dist, start_snap, snap)[0] <= max_distance_km / 2
+        ]
+        logger.info(f"{len(candidates)} monuments within {max_distance_km / 2:.2f} km of the start")
+        
+        stops: List[Tuple[MonumentResponse, EdgeSnap]] = []
+        if candidates:
+            snaps = [start_snap] + [snap for _, snap in candidates]
+            matrix = self.matrix_service.snap_matrix(graph, snaps, snaps, max_distance_km).astype(np.float64)
+            order = TourService.orienteering(matrix, max_distance_km, time_budget_s=self.TOUR_TIME_BUDGET_S)
+            stops = [candidates[i - 1] for i in order]
+        
+        if stops:
+            self.trace_tour(
+                graph, result, start_snap, stops, True, simplify_tolerance_m, simplify_zoom
+            )
+        else:
+            result.tour = {
+                "order": [],
+                "distance_km": 0.0,
+                "return_to_start": True,
+                "geometry": np.array([[start_snap.lat, start_snap.lon]])
+            }
+        chosen = {id(monument) for monument, _ in stops}
+        result.tour["max_distance_km"] = max_distance_km
+        result.tour["skipped"] = [monument.name for monument, _ in targets if id(monument) not in chosen]
+        return result
+    
     def export_png_routes(
         self, 
         box: BoxModel, 
         result: RouteCalculationResult, 
-        filename: str
+        filename: str,
+        simplify_tolerance_m: Optional[float] = None,
+        simplify_zoom: Optional[int] = None
     ) -> str:
         """
         Export routes to PNG image.
@@ -141,6 +540,8 @@ class RouteService:
             box: Bounding box for directory naming
             result: Route calculation result
             filename: Output filename
+            simplify_tolerance_m: Route simplification tolerance in metres
+            simplify_zoom: Map zoom level to derive the tolerance from
             
         Returns:
             Path to exported PNG file
@@ -151,20 +552,24 @@ class RouteService:
             # Create static map
             map_obj = StaticMap(1200, 1200)
             
-            # Add route edges
-            for edge in result.graph.edges:
-                node1, node2 = edge
+            # Add route edges following the (simplified) trail geometry. Edges are drawn
+            # once each rather than per route, since routes share their first stretch
+            for node1, node2 in result.graph.edges:
+                geometry = self.simplify_route(
+                    self.graph_service.edge_geometry(result.graph, node1, node2),
+                    simplify_tolerance_m, simplify_zoom
+                )
                 map_obj.add_line(
                     Line(
-                        [(node1[1], node1[0]), (node2[1], node2[0])],
+                        [(lon, lat) for lat, lon in geometry.tolist()],
                         "blue",
                         3
                     )
                 )
             
             # Add trail intersections
-            for node in result.graph.nodes:
-                map_obj.add_marker(CircleMarker((node[1], node[0]), "black", 4))
+            for lat, lon in unpack_coords(list(result.graph.nodes)).tolist():
+                map_obj.add_marker(CircleMarker((lon, lat), "black", 4))
             
             # Add monuments (red for reachable, gray for unreachable)
             for monument in result.reachable_monuments:
@@ -228,27 +633,55 @@ class RouteService:
                 coords=[(result.start.lon, result.start.lat)]
             )
             
-            # Add route lines
-            for edge in result.graph.edges:
-                node1, node2 = edge
+            if result.tour is not None:
+                # A tour is one continuous line; monuments are numbered in visiting order
                 lin = kml.newlinestring(
-                    name="Camí",
-                    description="Camí entre dos punts",
-                    coords=[(node1[1], node1[0]), (node2[1], node2[0])]
+                    name="Ruta",
+                    description=f"Distància: {result.tour['distance_km']:.2f} km",
+                    coords=[(lon, lat) for lat, lon in result.tour["geometry"].tolist()]
                 )
                 lin.style.linestyle.color = "ff0000ff"  # Red in KML (AABBGGRR)
                 lin.style.linestyle.width = 4
-            
-            # Add reachable monuments with distances
-            for monument in result.reachable_monuments:
-                distance = result.get_distance(monument)
-                distance_str = f"{distance:.2f}" if distance else "N/A"
                 
-                kml.newpoint(
-                    name=monument.name,
-                    coords=[(monument.location.lon, monument.location.lat)],
-                    description=f"Distància: {distance_str} km"
-                )
+                walked = 0.0
+                for i, (monument, distance) in enumerate(
+                    zip(result.reachable_monuments, result.distances), start=1
+                ):
+                    walked += distance
+                    kml.newpoint(
+                        name=f"{i}. {monument.name}",
+                        coords=[(monument.location.lon, monument.location.lat)],
+                        description=f"Distància: {walked:.2f} km"
+                    )
+            else:
+                # Add one simplified route line and one point per reachable monument
+                for monument, distance, geometry, alternatives in zip(
+                    result.reachable_monuments, result.distances, result.geometries, result.alternatives
+                ):
+                    distance_str = f"{distance:.2f}" if distance is not None else "N/A"
+                    
+                    lin = kml.newlinestring(
+                        name=f"Camí a {monument.name}",
+                        description=f"Distància: {distance_str} km",
+                        coords=[(lon, lat) for lat, lon in geometry.tolist()]
+                    )
+                    lin.style.linestyle.color = "ff0000ff"  # Red in KML (AABBGGRR)
+                    lin.style.linestyle.width = 4
+                    
+                    for j, alt in enumerate(alternatives, start=1):
+                        alt_lin = kml.newlinestring(
+                            name=f"Alternativa {j} a {monument.name}",
+                            description=f"Distància: {alt['distance_km']:.2f} km",
+                            coords=[(lon, lat) for lat, lon in alt["geometry"].tolist()]
+                        )
+                        alt_lin.style.linestyle.color = "ff00a5ff"  # Orange
+                        alt_lin.style.linestyle.width = 3
+                    
+                    kml.newpoint(
+                        name=monument.name,
+                        coords=[(monument.location.lon, monument.location.lat)],
+                        description=f"Distància: {distance_str} km"
+                    )
             
             # Add unreachable monuments with special icon
             for monument in result.unreachable_monuments:
@@ -276,13 +709,97 @@ class RouteService:
             logger.error(f"Error exporting KML: {e}", exc_info=True)
             raise
     
+    def calculate_routes(
+        self,
+        graph: TrailGraph,
+        start: PointModel,
+        monuments: List[MonumentResponse],
+        simplify_tolerance_m: Optional[float] = None,
+        simplify_zoom: Optional[int] = None,
+        optimization_mode: Optional[str] = "shortest",
+        return_to_start: bool = False,
+        max_distance_km: Optional[float] = None,
+        trees: Optional[MonumentTrees] = None,
+        alternatives: int = 0,
+        snaps: Optional[Tuple[Optional[EdgeSnap], List[Optional[EdgeSnap]]]] = None
+    ) -> RouteCalculationResult:
+        """
+        Calculate the routes of an optimization mode (see calculate_and_export).
+        
+        Raises:
+            ValueError: If the balanced mode has no max_distance_km
+        """
+        if optimization_mode == "most_monuments":
+            return self.find_tour(
+                graph, start, monuments,
+                return_to_start=return_to_start,
+                simplify_tolerance_m=simplify_tolerance_m,
+                simplify_zoom=simplify_zoom,
+                snaps=snaps
+            )
+        if optimization_mode == "balanced":
+            if max_distance_km is None:
+                raise ValueError("The balanced optimization mode needs max_distance_km")
+            return self.find_orienteering_route(
+                graph, start, monuments, max_distance_km,
+                simplify_tolerance_m=simplify_tolerance_m,
+                simplify_zoom=simplify_zoom,
+                snaps=snaps
+            )
+        return self.find_routes(
+            graph, start, monuments,
+            simplify_tolerance_m=simplify_tolerance_m,
+            simplify_zoom=simplify_zoom,
+            trees=trees,
+            alternatives=alternatives,
+            snaps=snaps
+        )
+    
+    def export_routes(
+        self,
+        box: BoxModel,
+        result: RouteCalculationResult,
+        name: str,
+        simplify_tolerance_m: Optional[float] = None,
+        simplify_zoom: Optional[int] = None
+    ) -> Dict[str, str]:
+        """
+        Export routes to routes_<name>.png and routes_<name>.kml in the box directory.
+        
+        Both only read the result: the PNG (map tile downloads and rendering)
+        and the KML are written concurrently. The PNG draws the trails with the
+        same simplification as the routes (simplify_tolerance_m, simplify_zoom).
+        
+        Returns:
+            File paths (png_file, kml_file) and their static URLs (png_url, kml_url)
+        """
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            png = pool.submit(
+                self.export_png_routes, box, result, f"routes_{name}.png", simplify_tolerance_m, simplify_zoom
+            )
+            kml = pool.submit(self.export_kml_routes, box, result, f"routes_{name}.kml")
+            png_path, kml_path = png.result(), kml.result()
+        return {
+            "png_file": png_path,
+            "kml_file": kml_path,
+            "png_url": f"/static/{Path(png_path).relative_to(STATIC_DIR)}",
+            "kml_url": f"/static/{Path(kml_path).relative_to(STATIC_DIR)}"
+        }
+    
     def calculate_and_export(
         self,
-        graph: nx.Graph,
+        graph: TrailGraph,
         start: PointModel,
         monuments: List[MonumentResponse],
         box: BoxModel,
-        job_id: str
+        job_id: str,
+        simplify_tolerance_m: Optional[float] = None,
+        simplify_zoom: Optional[int] = None,
+        optimization_mode: Optional[str] = "shortest",
+        return_to_start: bool = False,
+        max_distance_km: Optional[float] = None,
+        trees: Optional[MonumentTrees] = None,
+        alternatives: int = 0
     ) -> Dict[str, Any]:
         """
         Calculate routes and export to PNG and KML.
@@ -295,6 +812,16 @@ class RouteService:
             monuments: List of monuments
             box: Bounding box
             job_id: Job identifier for filenames
+            simplify_tolerance_m: Route simplification tolerance in metres
+            simplify_zoom: Map zoom level to derive the tolerance from
+            optimization_mode: "shortest" for one route per monument,
+                               "most_monuments" for a single tour through all of them, or
+                               "balanced" for the round trip visiting the most monuments
+                               within max_distance_km
+            return_to_start: Whether a "most_monuments" tour ends back at the start
+            max_distance_km: Walking budget of a "balanced" round trip
+            trees: Precomputed monument trees used by the "shortest" mode
+            alternatives: Alternative routes per monument in the "shortest" mode
             
         Returns:
             Dictionary with result data and file paths
@@ -302,23 +829,20 @@ class RouteService:
         logger.info(f"Starting route calculation job {job_id}")
         
         try:
-            # Calculate routes
-            result = self.find_routes(graph, start, monuments)
-            
-            # Export to PNG
-            png_filename = f"routes_{job_id}.png"
-            png_path = self.export_png_routes(box, result, png_filename)
-            
-            # Export to KML
-            kml_filename = f"routes_{job_id}.kml"
-            kml_path = self.export_kml_routes(box, result, kml_filename)
+            result = self.calculate_routes(
+                graph, start, monuments,
+                simplify_tolerance_m=simplify_tolerance_m,
+                simplify_zoom=simplify_zoom,
+                optimization_mode=optimization_mode,
+                return_to_start=return_to_start,
+                max_distance_km=max_distance_km,
+                trees=trees,
+                alternatives=alternatives
+            )
             
-            # Prepare result
+            # Export to PNG and KML
             result_data = result.to_dict()
-            result_data["png_file"] = png_path
-            result_data["kml_file"] = kml_path
-            result_data["png_url"] = f"/static/{Path(png_path).relative_to(STATIC_DIR)}"
-            result_data["kml_url"] = f"/static/{Path(kml_path).relative_to(STATIC_DIR)}"
+            result_data.update(self.export_routes(box, result, job_id, simplify_tolerance_m, simplify_zoom))
             
             logger.info(f"Route calculation job {job_id} completed successfully")
             return result_data
@@ -5,19 +5,22 @@ Now uses Overpass API for 10-50x faster downloads!
 """
 import requests
 import gpxpy
-from sklearn.cluster import MiniBatchKMeans  # Much faster than KMeans!
 import staticmap
 from haversine import haversine
 import json
 import os
 from datetime import datetime
-from typing import List, Tuple, Set
+from typing import Any, Dict, List, Optional, Tuple, Set
+import numpy as np
 from pathlib import Path
 
 from models import PointModel, BoxModel
 from core.utils import get_logger
 from core.config import STATIC_DIR
+from services.clustering import ClusterCenterStore, ShardedClustering
 from services.overpass_service import OverpassService
+from services.trail_tags import UNKNOWN, merge_tags
+from geometry import pack_coords, unpack_coords  # skeleton/geometry.py
 
 logger = get_logger("segment_service")
 
@@ -30,6 +33,7 @@ class SegmentService:
         self.settings_path = settings_path
         self.load_settings()
         self.overpass = OverpassService()  # NEW: Fast Overpass API service
+        self.clustering = ShardedClustering(store=ClusterCenterStore())
     
     def load_settings(self):
         """Load settings from JSON file"""
@@ -48,6 +52,7 @@ class SegmentService:
                 self.time_delta = 300
                 self.distance_delta = 0.1
                 self.n_clusters = 500
+                self.max_download_pages = 50
                 return
             
             with open(settings_file, "r") as f:
@@ -68,7 +73,14 @@ class SegmentService:
             self.n_clusters = 500
             self.max_download_pages = 50  
     
-    def _get_directory_name(self, box: BoxModel) -> str:
+    def settings_key(self) -> str:
+        """Identity of the settings a segments file is built with (download, clustering and joining)"""
+        return (
+            f"{self.n_clusters}-{self.time_delta}-{self.distance_delta}-{self.max_download_pages}"
+            f"-tiles{ShardedClustering.TILE_DEGREES}-{ShardedClustering.POINTS_PER_CLUSTER}"
+        )
+    
+    def get_directory_name(self, box: BoxModel) -> str:
         """Get directory name for a bounding box"""
         return f"{box.bottom_left.lat}_{box.bottom_left.lon}_{box.top_right.lat}_{box.top_right.lon}"
     
@@ -87,7 +99,7 @@ class SegmentService:
         count = 0
         
         # Create directory in static files
-        dir_name = self._get_directory_name(box)
+        dir_name = self.get_directory_name(box)
         dir_path = Path(STATIC_DIR) / dir_name
         dir_path.mkdir(parents=True, exist_ok=True)
         
@@ -141,7 +153,10 @@ class SegmentService:
         if count > 500000:
             logger.warning(f"⚠️  Downloaded {count} points - this is a LOT! Consider using a smaller bounding box.")
     
-    def _load_points_fast(self, box: BoxModel) -> List[Tuple[PointModel, PointModel]]:
+    def _load_points_fast(
+        self,
+        box: BoxModel
+    ) -> Tuple[List[Tuple[PointModel, PointModel, int]], Optional[Dict[str, Any]]]:
         """
         Load trail segments using Overpass API (FAST!)
         
@@ -152,15 +167,23 @@ class SegmentService:
         - Returns segments directly (no need for separate clustering)
         
         Returns:
-            List of (start_point, end_point) tuples representing trail segments
+            (segments, changes): (start_point, end_point, tag_code) tuples
+            representing trail segments, and the way changes of a refreshed
+            cache (see OverpassService.download_ways)
         """
         logger.info(f"🚀 Loading segments with Overpass API (fast mode)")
-        return self.overpass.download_trails(box)
+        ways, changes = self.overpass.download_ways(box)
+        return self.overpass.ways_to_segments(ways), changes
+    
+    @staticmethod
+    def _settings_path(file_path: Path) -> Path:
+        """Sidecar recording the settings_key a segments file was built with"""
+        return file_path.with_name(f"{file_path.stem}.settings.json")
     
     def _load_points(self, box: BoxModel, filename: str) -> List[Tuple[float, float, datetime, int, int]]:
         """Load points from file, downloading if necessary (OLD SLOW METHOD - deprecated)"""
         points = []
-        dir_name = self._get_directory_name(box)
+        dir_name = self.get_directory_name(box)
         file_path = Path(STATIC_DIR) / dir_name / filename
         
         if not file_path.exists():
@@ -189,11 +212,25 @@ class SegmentService:
         Returns:
             Number of segments created
         """
-        logger.info(f"🚀 Processing segments for box {self._get_directory_name(box)} (FAST mode)")
+        logger.info(f"🚀 Processing segments for box {self.get_directory_name(box)} (FAST mode)")
+        
+        dir_name = self.get_directory_name(box)
+        file_path = Path(STATIC_DIR) / dir_name / filename
+        settings_path = self._settings_path(file_path)
         
         # Use Overpass API to get segments directly (FAST!)
         try:
-            segments_raw = self._load_points_fast(box)
+            segments_raw, changes = self._load_points_fast(box)
+            
+            # Refreshed trails with no way added, removed or changed: the file built from them
+            # with the same settings would come out the same, so clustering is skipped
+            if (
+                changes is not None and not changes["any"] and file_path.exists()
+                and settings_path.exists() and json.loads(settings_path.read_text()) == {"settings": self.settings_key()}
+            ):
+                logger.info(f"Trails unchanged since the last download, keeping {file_path}")
+                with open(file_path) as f:
+                    return sum(1 for _ in f)
             
             if len(segments_raw) < 2:
                 logger.warning("Not enough segments found in area")
@@ -202,71 +239,43 @@ class SegmentService:
             logger.info(f" Got {len(segments_raw)} raw trail segments from Overpass API")
             
             # Convert to clustered segments for cleaner output
-            # Extract all unique points
-            all_points = []
-            for start, end in segments_raw:
-                all_points.append((start.lat, start.lon))
-                all_points.append((end.lat, end.lon))
-            
-            # Remove duplicates
-            unique_points = list(set(all_points))
+            # Quantize every segment end to a coordinate key (exact dedup of repeated points)
+            point_keys = pack_coords([
+                (p.lat, p.lon) for start, end, _ in segments_raw for p in (start, end)
+            ])
+            unique_keys, point_index = np.unique(point_keys, return_inverse=True)
+            unique_points = unpack_coords(unique_keys)
             
             if len(unique_points) < 2:
                 logger.warning("Not enough unique points")
                 return 0
             
-            # Adaptive clustering: skip for small datasets, use MiniBatchKMeans for large ones
+            # Adaptive clustering: skip for small datasets, cluster large ones tile by tile
             if len(unique_points) < 1000:
                 # Small dataset: no clustering needed (fast!)
                 logger.info(f"✅ Small dataset ({len(unique_points)} points), skipping clustering")
-                point_to_cluster = {point: point for point in unique_points}
+                cluster_keys = unique_keys
             else:
-                # Large dataset: use MiniBatchKMeans (5-10x faster than regular KMeans)
-                # Adaptive cluster count: fewer clusters for larger datasets
-                adaptive_clusters = min(
-                    self.n_clusters,
-                    len(unique_points) // 10,  # 1 cluster per 10 points
-                    2000  # Cap at 2000 clusters max
-                )
-                
-                logger.info(f"⚡ Fast clustering: {len(unique_points)} points → {adaptive_clusters} clusters")
-                
-                # MiniBatchKMeans is much faster for large datasets
-                kmeans = MiniBatchKMeans(
-                    n_clusters=adaptive_clusters,
-                    random_state=0,
-                    batch_size=1000,  # Process in batches for speed
-                    max_iter=100,  # Limit iterations
-                    n_init=3  # Fewer initializations (faster)
-                ).fit(unique_points)
-                
-                centers = kmeans.cluster_centers_
+                # Large dataset: MiniBatchKMeans per spatial tile, clusters following point density
+                logger.info(f"⚡ Fast clustering: {len(unique_points)} points, "
+                            f"up to {self.n_clusters} clusters per tile")
+                centers, labels = self.clustering.cluster(unique_points, self.n_clusters, box)
                 
-                # Create mapping from original points to cluster centers
-                point_to_cluster = {}
-                for point in unique_points:
-                    cluster_idx = kmeans.predict([point])[0]
-                    point_to_cluster[point] = tuple(centers[cluster_idx])
+                # Map every unique point to the key of its cluster center
+                cluster_keys = pack_coords(centers)[labels]
             
-            # Map segments to cluster centers
-            segments: Set[Tuple[Tuple[float, float], Tuple[float, float]]] = set()
+            # Map segments to cluster centers, keeping one tag code per segment
+            ends = cluster_keys[point_index].reshape(-1, 2)
+            segments: Dict[Tuple[int, int], int] = {}
             
-            for start, end in segments_raw:
-                p1 = (start.lat, start.lon)
-                p2 = (end.lat, end.lon)
-                
-                c1 = point_to_cluster.get(p1, p1)
-                c2 = point_to_cluster.get(p2, p2)
-                
+            for (c1, c2), (_, _, code) in zip(ends.tolist(), segments_raw):
                 # Skip if same cluster
                 if c1 == c2:
                     continue
                 
                 # Add segment (ensure consistent ordering)
-                if c1 < c2:
-                    segments.add((c1, c2))
-                else:
-                    segments.add((c2, c1))
+                key = (c1, c2) if c1 < c2 else (c2, c1)
+                segments[key] = merge_tags(segments[key], code) if key in segments else code
             
             logger.info(f"✅ Created {len(segments)} unique clustered segments")
             
@@ -276,15 +285,22 @@ class SegmentService:
             return self._download_segments_slow(box, filename)
         
         # Save segments to file
-        dir_name = self._get_directory_name(box)
-        dir_path = Path(STATIC_DIR) / dir_name
-        dir_path.mkdir(parents=True, exist_ok=True)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        settings_path.write_text(json.dumps({"settings": self.settings_key()}))
         
-        file_path = dir_path / filename
+        coords = unpack_coords([key for pair in segments for key in pair]).reshape(-1, 4).tolist()
+        content = "".join(
+            f"{lat1},{lon1},{lat2},{lon2},{code}\n"
+            for (lat1, lon1, lat2, lon2), code in zip(coords, segments.values())
+        )
+        
+        # Leave an unchanged file alone: its graph, and everything cached for it, stays valid
+        if file_path.exists() and file_path.read_text() == content:
+            logger.info(f"Segments unchanged, keeping {file_path}")
+            return len(segments)
         
         with open(file_path, "w") as f:
-            for (lat1, lon1), (lat2, lon2) in segments:
-                f.write(f"{lat1},{lon1},{lat2},{lon2}\n")
+            f.write(content)
         
         logger.info(f"Saved {len(segments)} segments to {file_path}")
         return len(segments)
@@ -313,24 +329,9 @@ class SegmentService:
             labels = list(range(len(coords)))
             centers = coords
         else:
-            adaptive_clusters = min(
-                self.n_clusters,
-                len(coords) // 10,
-                2000
-            )
-            
-            logger.info(f"⚡ Fast clustering: {len(coords)} points → {adaptive_clusters} clusters")
-            
-            kmeans = MiniBatchKMeans(
-                n_clusters=adaptive_clusters,
-                random_state=0,
-                batch_size=1000,
-                max_iter=100,
-                n_init=3
-            ).fit(coords)
-            
-            centers = kmeans.cluster_centers_
-            labels = kmeans.labels_
+            logger.info(f"⚡ Fast clustering: {len(coords)} points, up to {self.n_clusters} clusters per tile")
+            centers, labels = self.clustering.cluster(np.array(coords), self.n_clusters, box)
+            centers = [tuple(center) for center in centers.tolist()]
         
         # Find segments
         segments: Set[Tuple[Tuple[float, float], Tuple[float, float]]] = set()
@@ -356,11 +357,12 @@ class SegmentService:
                     segments.add(((lat2, lon2), (lat1, lon1)))
         
         # Save segments to file
-        dir_name = self._get_directory_name(box)
+        dir_name = self.get_directory_name(box)
         dir_path = Path(STATIC_DIR) / dir_name
         dir_path.mkdir(parents=True, exist_ok=True)
         
         file_path = dir_path / filename
+        self._settings_path(file_path).unlink(missing_ok=True)  # Not built by the fast method
         
         with open(file_path, "w") as f:
             for (lat1, lon1), (lat2, lon2) in segments:
@@ -371,28 +373,45 @@ class SegmentService:
     
     def load_segments(self, box: BoxModel, filename: str = "segments.txt") -> List[Tuple[PointModel, PointModel]]:
         """Load segments from file"""
+        return self.load_tagged_segments(box, filename)[0]
+    
+    def load_tagged_segments(
+        self,
+        box: BoxModel,
+        filename: str = "segments.txt"
+    ) -> Tuple[List[Tuple[PointModel, PointModel]], np.ndarray]:
+        """
+        Load segments from file with their tag codes.
+        
+        Returns:
+            (segments, codes) where codes is a uint8 array parallel to segments
+            (UNKNOWN for lines without a code: slow-method or older files)
+        """
         segments = []
-        dir_name = self._get_directory_name(box)
+        codes = []
+        dir_name = self.get_directory_name(box)
         file_path = Path(STATIC_DIR) / dir_name / filename
         
         if not file_path.exists():
             logger.warning(f"Segments file not found: {file_path}")
-            return []
+            return [], np.zeros(0, dtype=np.uint8)
         
         try:
             with open(file_path, "r") as f:
                 for line in f:
-                    lat1, lon1, lat2, lon2 = line.strip().split(",")
+                    parts = line.strip().split(",")
+                    lat1, lon1, lat2, lon2 = parts[:4]
                     start = PointModel(lat=float(lat1), lon=float(lon1))
                     end = PointModel(lat=float(lat2), lon=float(lon2))
                     segments.append((start, end))
+                    codes.append(int(parts[4]) if len(parts) > 4 else UNKNOWN)
             
             logger.info(f"Loaded {len(segments)} segments from {file_path}")
-            return segments
+            return segments, np.array(codes, dtype=np.uint8)
             
         except Exception as e:
             logger.error(f"Error loading segments: {e}", exc_info=True)
-            return []
+            return [], np.zeros(0, dtype=np.uint8)
     
     def get_segments(self, box: BoxModel, filename: str = "segments.txt") -> List[Tuple[PointModel, PointModel]]:
         """
@@ -406,7 +425,7 @@ class SegmentService:
             List of segment tuples (start_point, end_point)
         """
         # Check if segments file exists
-        dir_name = self._get_directory_name(box)
+        dir_name = self.get_directory_name(box)
         file_path = Path(STATIC_DIR) / dir_name / filename
         
         if not file_path.exists():
@@ -0,0 +1,123 @@
+"""
+Shortest-path tree cache - reuses searches from frequently used start nodes
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+import numpy as np
+
+from core.utils import get_logger
+
+logger = get_logger("spt_cache")
+
+
+class ShortestPathTreeCache:
+    """
+    LRU cache of full shortest-path trees keyed by (graph version, node id).
+
+    Each entry is the (dist, pred) pair of an unbounded Dijkstra search from a
+    graph node. A snapped start on edge u-v is answered from the trees of u and
+    v (see TrailGraph.search), so every start on that edge, every monument type
+    and every distance limit reuses the same two entries. The cache is bounded
+    by the total size of the stored arrays.
+
+    Two full trees cost about twice one search from the start, so they are
+    only grown for an edge searched before (`repeated`); a first search runs
+    on its own, within its distance limit.
+    """
+
+    MAX_BYTES = 256 * 1024 * 1024  # Memory budget for all cached trees
+    MAX_SEEN = 4096  # Searched edges remembered to spot repeated starts
+
+    def __init__(self, max_bytes: int = MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._trees: "OrderedDict[Tuple[int, int], Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        self._seen: "OrderedDict[Tuple[int, int], None]" = OrderedDict()  # (graph version, edge) searched
+        self._lock = threading.Lock()
+
+    def has(self, graph, node: int) -> bool:
+        """Whether the tree of `node` in `graph` is cached"""
+        with self._lock:
+            return (graph.version, node) in self._trees
+
+    def repeated(self, graph, edge: int) -> bool:
+        """Record a search from `edge` of `graph`; True if it was searched before"""
+        key = (graph.version, edge)
+        with self._lock:
+            if key in self._seen:
+                self._seen.move_to_end(key)
+                return True
+            self._seen[key] = None
+            while len(self._seen) > self.MAX_SEEN:
+                self._seen.popitem(last=False)
+            return False
+
+    def get(self, graph, node: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Tree of `node` in `graph` (a TrailGraph), computing it on a miss"""
+        key = (graph.version, node)
+        with self._lock:
+            tree = self._trees.get(key)
+            if tree is not None:
+                self._trees.move_to_end(key)
+                self.hits += 1
+                return tree
+            self.misses += 1
+
+        tree = graph.node_tree(node)
+        self._put(key, tree)
+        return tree
+
+    def _put(self, key: Tuple[int, int], tree: Tuple[np.ndarray, np.ndarray]) -> None:
+        size = tree[0].nbytes + tree[1].nbytes
+        if size > self.max_bytes:
+            return  # Larger than the whole budget: used without caching
+        with self._lock:
+            if key not in self._trees:
+                self._trees[key] = tree
+                self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (dist, pred) = self._trees.popitem(last=False)
+                self.bytes -= dist.nbytes + pred.nbytes
+
+    def carry(self, old_version: int, new_version: int, keep: np.ndarray, n_nodes: int) -> int:
+        """
+        Reuse the trees of a graph for its updated version (TrailGraph.unchanged_nodes).
+
+        Trees rooted at `keep` nodes are stored again under `new_version`,
+        unreachable from the nodes the update added (up to `n_nodes`).
+
+        Returns:
+            Number of trees carried over
+        """
+        with self._lock:
+            trees = [(node, tree) for (version, node), tree in self._trees.items()
+                     if version == old_version and keep[node]]
+        for node, (dist, pred) in trees:
+            added = n_nodes - len(dist)
+            if added:
+                dist = np.concatenate([dist, np.full(added, np.inf)])
+                pred = np.concatenate([pred, np.full(added, -9999, dtype=pred.dtype)])
+            self._put((new_version, node), (dist, pred))
+        return len(trees)
+
+    def drop_graph(self, version: int) -> None:
+        """Forget every tree of a graph that is no longer cached"""
+        with self._lock:
+            for key in [k for k in self._trees if k[0] == version]:
+                dist, pred = self._trees.pop(key)
+                self.bytes -= dist.nbytes + pred.nbytes
+            for key in [k for k in self._seen if k[0] == version]:
+                del self._seen[key]
+
+    def stats(self) -> Dict[str, int]:
+        """Entry count, memory use and hit/miss counters"""
+        return {
+            "trees": len(self._trees),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses
+        }
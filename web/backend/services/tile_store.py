@@ -0,0 +1,299 @@
+"""
+Tile store - trail graphs of fixed lat/lon tiles, stitched into query graphs
+Each tile is built once from its Overpass ways and stored as arrays in static/tiles/
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from models import BoxModel, PointModel
+from core.utils import get_logger
+from core.config import STATIC_DIR
+from services.graph import GraphService
+from services.overpass_service import OverpassService
+from services.trail_graph import TrailGraph
+from geometry import MICRODEGREES, pack_coords  # skeleton/geometry.py
+
+logger = get_logger("tile_store")
+
+Tile = Tuple[int, int]  # (row, col) of a tile: floor(lat / TILE_DEGREES), floor(lon / TILE_DEGREES)
+
+
+@dataclass(frozen=True)
+class GraphTile:
+    """Trail graph of one tile"""
+    tile: Tile
+    graph: TrailGraph
+    boundary: np.ndarray  # Sorted ids of the nodes that neighbouring tiles may share
+    shortcut_u: np.ndarray  # Boundary node pairs (u < v) with their shortest distance
+    shortcut_v: np.ndarray  # inside the tile, see TileStore.shortcuts
+    shortcut_dist: np.ndarray
+    stamp: int  # Modification time of the stored tile (identifies its content)
+
+
+class TileStore:
+    """
+    Trail graphs of a fixed grid of tiles, with their boundary nodes.
+
+    Every segment belongs to exactly one tile: the tile holding both of its
+    ends or, for a segment crossing a tile border, the tile of its lower
+    coordinate key. The nodes another tile may also hold (the far end of a
+    crossing segment the tile owns, and the near end of one it does not) are
+    its boundary nodes, kept as junctions when the tile is simplified, so
+    that tiles meet at nodes with the same key. Tiles are built without
+    clustering (the exact OSM node
+    coordinates are what makes neighbouring tiles agree) and without pruning
+    (a spur or island at a tile border may continue in the next tile).
+
+    A query box is served by stitching the graphs of the tiles that cover it
+    (TrailGraph.stitch): overlapping boxes share tiles, and routes can leave
+    the box within its covering tiles. Every tile also stores the shortest
+    distances between its boundary nodes, the shortcuts of the region-wide
+    overlay graph (see RegionRouter).
+    """
+
+    TILE_DEGREES = 0.1  # Tile size (~11 km north-south, ~8 km east-west in Catalunya)
+    DOWNLOAD_MARGIN = 0.0001  # Degrees added around a tile when downloading it (nodes are assigned after rounding)
+    MAX_TILES = 64  # Tiles kept in memory (least recently used are dropped)
+    MAX_STITCH_TILES = 64  # Largest number of tiles stitched into one graph
+    NODE_ORDER = "hilbert"  # See TrailGraph.node_order
+    TILES_DIR = "tiles"
+    EXPIRY_DAYS = OverpassService.CACHE_EXPIRY_DAYS  # Stored tiles are rebuilt as often as the Overpass cache
+
+    def __init__(self, overpass: Optional[OverpassService] = None, max_tiles: int = MAX_TILES):
+        self.overpass = overpass or OverpassService()
+        self.max_tiles = max_tiles
+        self.tiles_dir = Path(STATIC_DIR) / self.TILES_DIR
+        self.tiles_dir.mkdir(parents=True, exist_ok=True)
+        self._tiles: "OrderedDict[Tile, GraphTile]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def tiles_of(cls, coords: np.ndarray) -> np.ndarray:
+        """(row, col) tile of every (lat, lon) row, computed on microdegrees so every tile agrees"""
+        micro = np.round(np.asarray(coords, dtype=np.float64).reshape(-1, 2) * MICRODEGREES).astype(np.int64)
+        return np.floor_divide(micro, int(round(cls.TILE_DEGREES * MICRODEGREES)))
+
+    def tiles_for_box(self, box: BoxModel) -> List[Tile]:
+        """Tiles covering a box, row by row"""
+        (row0, col0), (row1, col1) = self.tiles_of([
+            (box.bottom_left.lat, box.bottom_left.lon),
+            (box.top_right.lat, box.top_right.lon)
+        ]).tolist()
+        return [(row, col) for row in range(row0, row1 + 1) for col in range(col0, col1 + 1)]
+
+    def tile_box(self, tile: Tile) -> BoxModel:
+        """Bounding box of a tile"""
+        step = int(round(self.TILE_DEGREES * MICRODEGREES))
+        row, col = tile
+        return BoxModel(
+            bottom_left=PointModel(lat=row * step / MICRODEGREES, lon=col * step / MICRODEGREES),
+            top_right=PointModel(lat=(row + 1) * step / MICRODEGREES, lon=(col + 1) * step / MICRODEGREES)
+        )
+
+    def _tile_path(self, tile: Tile) -> Path:
+        return self.tiles_dir / f"{tile[0]}_{tile[1]}.npz"
+
+    def _is_expired(self, stamp: int) -> bool:
+        """Whether a tile stored at `stamp` (modification time in ns) is older than EXPIRY_DAYS"""
+        return time.time_ns() - stamp > self.EXPIRY_DAYS * 86400 * 10**9
+
+    def is_stored(self, tile: Tile) -> bool:
+        """Whether a tile is stored and not expired (get_tile will not download it)"""
+        path = self._tile_path(tile)
+        return path.exists() and not self._is_expired(path.stat().st_mtime_ns)
+
+    def get_tile(self, tile: Tile) -> GraphTile:
+        """
+        Graph of a tile: from memory, from its stored arrays, or built from Overpass.
+
+        Tiles older than EXPIRY_DAYS are built again, like an expired Overpass
+        cache, unless the refresh changed none of their ways; the new stamp
+        changes the key of the graphs stitched from them.
+        """
+        with self._lock:
+            graph_tile = self._tiles.get(tile)
+            if graph_tile is not None and not self._is_expired(graph_tile.stamp):
+                self._tiles.move_to_end(tile)
+                return graph_tile
+
+        path = self._tile_path(tile)
+        expired = path.exists() and self._is_expired(path.stat().st_mtime_ns)
+        if expired:
+            logger.info(f"Tile {tile} expired, rebuilding it")
+        if not path.exists() or expired:
+            box = self.tile_box(tile)
+            ways, changes = self.overpass.download_ways(BoxModel(
+                bottom_left=PointModel(
+                    lat=box.bottom_left.lat - self.DOWNLOAD_MARGIN, lon=box.bottom_left.lon - self.DOWNLOAD_MARGIN
+                ),
+                top_right=PointModel(
+                    lat=box.top_right.lat + self.DOWNLOAD_MARGIN, lon=box.top_right.lon + self.DOWNLOAD_MARGIN
+                )
+            ))
+            if expired and changes is not None and not changes["any"]:
+                logger.info(f"Ways of tile {tile} unchanged, keeping it")
+                os.utime(path)
+            else:
+                graph, boundary = self.build_tile(tile, self.overpass.ways_to_segments(ways))
+                self._save(path, graph, boundary)
+        graph_tile = self._load(tile, path)
+
+        with self._lock:
+            self._tiles[tile] = graph_tile
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+        return graph_tile
+
+    def build_tile(
+        self,
+        tile: Tile,
+        segments: List[Tuple[PointModel, PointModel, int]]
+    ) -> Tuple[TrailGraph, np.ndarray]:
+        """
+        Build the graph of a tile from the trail segments around it.
+
+        Args:
+            tile: Tile to build
+            segments: (start, end, tag_code) segments of every way touching the tile
+                      (segments of other tiles are left out)
+
+        Returns:
+            (graph, boundary) with the sorted ids of the boundary nodes
+        """
+        coords = np.array(
+            [(p.lat, p.lon) for start, end, _ in segments for p in (start, end)], dtype=np.float64
+        ).reshape(-1, 2)
+        keys = pack_coords(coords).reshape(-1, 2)
+        cells = self.tiles_of(coords).reshape(-1, 2, 2)
+        in_tile = (cells == np.array(tile)).all(axis=2)
+        crossing = (cells[:, 0] != cells[:, 1]).any(axis=1)
+        owner_end = (keys[:, 1] < keys[:, 0]).astype(np.int64)
+        owned = (in_tile.all(axis=1) | (crossing & in_tile[np.arange(len(keys)), owner_end]))
+        owned &= keys[:, 0] != keys[:, 1]
+        outgoing = crossing & owned
+        incoming = crossing & ~owned
+        boundary_keys = np.unique(np.concatenate([keys[outgoing][~in_tile[outgoing]], keys[incoming][in_tile[incoming]]]))
+
+        picked = np.flatnonzero(owned).tolist()
+        graph = GraphService.make_graph(
+            [segments[i][:2] for i in picked],
+            np.array([segments[i][2] for i in picked], dtype=np.uint8)
+        )
+        graph = GraphService.simplify_graph(graph, keep=set(boundary_keys.tolist()))
+        trail_graph = TrailGraph.from_networkx(graph, node_order=self.NODE_ORDER)
+        boundary = np.flatnonzero(np.isin(pack_coords(trail_graph.node_coords), boundary_keys))
+        logger.info(f"Built tile {tile}: {trail_graph.n_nodes} nodes, {trail_graph.n_edges} edges, "
+                    f"{len(boundary)} boundary nodes")
+        return trail_graph, boundary
+
+    @staticmethod
+    def _save(path: Path, graph: TrailGraph, boundary: np.ndarray) -> None:
+        # Written under a temporary name first: a half-written tile is never loaded
+        tmp = path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp,
+            node_coords=graph.node_coords,
+            edge_u=graph.edge_u,
+            edge_v=graph.edge_v,
+            edge_weight=graph.edge_length,
+            edge_tags=graph.edge_tags,
+            geom_offsets=graph.geom_offsets,
+            geom_coords=graph.geom_coords,
+            boundary=boundary,
+            **dict(zip(("shortcut_u", "shortcut_v", "shortcut_dist"), TileStore.shortcuts(graph, boundary)))
+        )
+        tmp.replace(path)
+
+    @staticmethod
+    def shortcuts(graph: TrailGraph, boundary: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Shortest distances inside a tile between its boundary nodes.
+
+        Pairs whose shortest path passes through a third boundary node are
+        left out: the overlay reaches them through that node at the same
+        length. Whether a tree path passes a boundary node is found for every
+        node of every tree at once by pointer jumping up the predecessors.
+
+        Returns:
+            (u, v, dist) arrays with node ids u < v of the tile graph
+        """
+        n, k = graph.n_nodes, len(boundary)
+        if k < 2:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0)
+        matrix = csr_matrix((graph.edge_weight[graph.csr_edge], graph.indices, graph.indptr), shape=(n, n))
+        dist, pred = dijkstra(matrix, directed=True, indices=boundary, return_predecessors=True)
+
+        # Column n is a sentinel that tree roots and unreached nodes point to
+        anc = np.full((k, n + 1), n, dtype=np.int64)
+        anc[:, :n] = np.where(pred < 0, n, pred)
+        is_boundary = np.zeros(n + 1, dtype=bool)
+        is_boundary[boundary] = True
+        # passes[i, v]: a boundary node other than tree root i lies strictly between i and v
+        passes = is_boundary[anc] & (anc != boundary[:, None])
+        while (anc != n).any():
+            passes |= np.take_along_axis(passes, anc, axis=1)
+            anc = np.take_along_axis(anc, anc, axis=1)
+
+        i, j = np.triu_indices(k, 1)
+        keep = np.isfinite(dist[i, boundary[j]]) & ~passes[i, boundary[j]] & ~passes[j, boundary[i]]
+        i, j = i[keep], j[keep]
+        return boundary[i].astype(np.int32), boundary[j].astype(np.int32), dist[i, boundary[j]]
+
+    @staticmethod
+    def _load(tile: Tile, path: Path) -> GraphTile:
+        with np.load(path) as data:
+            graph = TrailGraph(
+                data["node_coords"].reshape(-1, 2),
+                data["edge_u"],
+                data["edge_v"],
+                data["edge_weight"],
+                data["geom_offsets"],
+                data["geom_coords"].reshape(-1, 2),
+                data["edge_tags"]
+            )
+            boundary = data["boundary"]
+            if "shortcut_u" in data:
+                shortcuts = data["shortcut_u"], data["shortcut_v"], data["shortcut_dist"]
+            else:
+                shortcuts = TileStore.shortcuts(graph, boundary)  # Tile stored before shortcuts existed
+        return GraphTile(
+            tile=tile,
+            graph=graph,
+            boundary=boundary,
+            shortcut_u=shortcuts[0],
+            shortcut_v=shortcuts[1],
+            shortcut_dist=shortcuts[2],
+            stamp=path.stat().st_mtime_ns
+        )
+
+    def covering_tiles(self, box: BoxModel) -> List[GraphTile]:
+        """
+        Graphs of the tiles covering a box, to stitch with TrailGraph.stitch.
+
+        Raises:
+            ValueError: If the box needs more than MAX_STITCH_TILES tiles
+        """
+        tiles = self.tiles_for_box(box)
+        if len(tiles) > self.MAX_STITCH_TILES:
+            raise ValueError(f"Box covers {len(tiles)} tiles (at most {self.MAX_STITCH_TILES} can be stitched)")
+        return [self.get_tile(tile) for tile in tiles]
+
+    def tiles_key(self, graph_tiles: List[GraphTile]) -> str:
+        """Identity of a set of tiles and of their content"""
+        stamps = ",".join(f"{t.tile[0]}_{t.tile[1]}@{t.stamp}" for t in graph_tiles)
+        return f"tiles{self.TILE_DEGREES}-" + hashlib.sha1(stamps.encode()).hexdigest()[:16]
+
+    def clear(self) -> None:
+        """Drop every tile kept in memory (stored tiles stay on disk)"""
+        with self._lock:
+            self._tiles.clear()
@@ -0,0 +1,237 @@
+"""
+Tour service - visiting-order heuristics on a distance matrix
+Nearest neighbour construction improved by 2-opt and Or-opt moves, and
+greedy insertion with local search for budget-limited (orienteering) tours
+"""
+import time
+import numpy as np
+from typing import Tuple
+
+from core.utils import get_logger
+
+logger = get_logger("tour_service")
+
+
+class TourService:
+    """
+    Heuristics that order the stops of a walking tour.
+
+    All methods work on a square distance matrix whose index 0 is the start.
+    A route is an index array that begins at 0 and ends at an end node: 0 again
+    for a closed tour, or a padding node at zero distance from every stop for
+    an open one (so the tour may finish anywhere). Moves never touch the first
+    and last entries of a route.
+    """
+
+    MIN_GAIN = 1e-9  # km; smaller improvements are float noise
+    UNREACHABLE = 1e9  # km; stands in for inf so move deltas never become nan
+    MAX_STALLED_ROUNDS = 50  # Orienteering perturbations tried without finding a better tour
+
+    @staticmethod
+    def route_cost(dist: np.ndarray, route: np.ndarray) -> float:
+        """Total length of a route"""
+        return float(dist[route[:-1], route[1:]].sum())
+
+    @staticmethod
+    def padded_matrix(dist: np.ndarray, closed: bool) -> np.ndarray:
+        """
+        Symmetrize the matrix and, for open tours, append the padding end node.
+
+        Trail distances are symmetric up to float noise, which 2-opt relies on
+        when it reverses a stretch of the route.
+        """
+        dist = np.where(np.isfinite(dist), dist, TourService.UNREACHABLE)
+        dist = (dist + dist.T) / 2
+        if closed:
+            return dist
+        padded = np.zeros((len(dist) + 1, len(dist) + 1))
+        padded[:-1, :-1] = dist
+        return padded
+
+    @staticmethod
+    def nearest_neighbour(dist: np.ndarray, stops: np.ndarray, end: int) -> np.ndarray:
+        """Route from 0 through `stops`, always walking to the closest unvisited one"""
+        route = [0]
+        remaining = list(stops)
+        current = 0
+        while remaining:
+            k = int(np.argmin(dist[current, remaining]))
+            current = remaining.pop(k)
+            route.append(current)
+        route.append(end)
+        return np.array(route, dtype=np.int64)
+
+    @staticmethod
+    def two_opt(dist: np.ndarray, route: np.ndarray, deadline: float) -> bool:
+        """
+        Apply improving 2-opt moves (reverse route[i..j]) in place.
+
+        For each i, all j are evaluated in one vectorized step and the best
+        one is applied. Returns whether any move was made.
+        """
+        improved = False
+        n = len(route)
+        for i in range(1, n - 2):
+            if time.perf_counter() > deadline:
+                break
+            a, b = route[i - 1], route[i]
+            c, e = route[i + 1:n - 1], route[i + 2:n]
+            delta = dist[a, c] + dist[b, e] - dist[a, b] - dist[c, e]
+            j = int(delta.argmin())
+            if delta[j] < -TourService.MIN_GAIN:
+                j += i + 1
+                route[i:j + 1] = route[i:j + 1][::-1].copy()
+                improved = True
+        return improved
+
+    @staticmethod
+    def or_opt(dist: np.ndarray, route: np.ndarray, deadline: float, max_segment: int = 3) -> bool:
+        """
+        Apply improving Or-opt moves in place: relocate a stretch of 1 to
+        `max_segment` stops, possibly reversed, between two other stops.
+
+        Returns whether any move was made.
+        """
+        improved = False
+        n = len(route)
+        edges = np.arange(n - 1)
+        for size in range(1, max_segment + 1):
+            for i in range(1, n - size):
+                if time.perf_counter() > deadline:
+                    return improved
+                first, last = route[i], route[i + size - 1]
+                a, b = route[i - 1], route[i + size]
+                gain = dist[a, first] + dist[last, b] - dist[a, b]
+
+                u, v = route[:-1], route[1:]
+                forward = dist[u, first] + dist[last, v] - dist[u, v]
+                backward = dist[u, last] + dist[first, v] - dist[u, v]
+                cost = np.minimum(forward, backward)
+                # Edges touching or inside the stretch are not insertion points
+                cost[(edges >= i - 1) & (edges <= i + size - 1)] = np.inf
+                p = int(cost.argmin())
+                if gain - cost[p] <= TourService.MIN_GAIN:
+                    continue
+
+                segment = route[i:i + size].copy()
+                if backward[p] < forward[p]:
+                    segment = segment[::-1]
+                rest = np.concatenate([route[:i], route[i + size:]])
+                pos = p + 1 if p < i else p - size + 1
+                route[:] = np.concatenate([rest[:pos], segment, rest[pos:]])
+                improved = True
+        return improved
+
+    @staticmethod
+    def solve(dist: np.ndarray, closed: bool = False, time_budget_s: float = 2.0) -> np.ndarray:
+        """
+        Order every stop of a distance matrix (index 0 is the start).
+
+        Args:
+            dist: (m, m) distance matrix between the start and the stops
+            closed: Whether the tour returns to the start
+            time_budget_s: Wall-clock budget for the local search
+
+        Returns:
+            Stop indices (1..m-1) in visiting order
+        """
+        deadline = time.perf_counter() + time_budget_s
+        m = len(dist)
+        padded = TourService.padded_matrix(dist, closed)
+        end = 0 if closed else m
+        route = TourService.nearest_neighbour(padded, np.arange(1, m), end)
+        initial = TourService.route_cost(padded, route)
+
+        rounds = 0
+        while time.perf_counter() < deadline:
+            rounds += 1
+            moved = TourService.two_opt(padded, route, deadline)
+            moved = TourService.or_opt(padded, route, deadline) or moved
+            if not moved:
+                break
+
+        logger.info(f"Tour of {m - 1} stops: {initial:.2f} km (nearest neighbour) → "
+                    f"{TourService.route_cost(padded, route):.2f} km after {rounds} local search rounds")
+        return route[1:-1]
+
+    @staticmethod
+    def insert_greedy(
+        dist: np.ndarray,
+        route: np.ndarray,
+        candidates: np.ndarray,
+        budget: float
+    ) -> np.ndarray:
+        """
+        Cheapest insertion: repeatedly add the candidate whose best insertion
+        point lengthens the route the least, while the route fits the budget.
+        """
+        length = TourService.route_cost(dist, route)
+        visited = set(route.tolist())
+        remaining = np.array([c for c in candidates if c not in visited], dtype=np.int64)
+        while len(remaining):
+            u, v = route[:-1], route[1:]
+            # (edges, candidates) extra length of inserting each candidate on each edge
+            cost = dist[u][:, remaining] + dist[remaining][:, v].T - dist[u, v][:, None]
+            edge = cost.argmin(axis=0)
+            extra = cost[edge, np.arange(len(remaining))]
+            k = int(extra.argmin())
+            if length + extra[k] > budget:
+                break
+            route = np.insert(route, edge[k] + 1, remaining[k])
+            length += extra[k]
+            remaining = np.delete(remaining, k)
+        return route
+
+    @staticmethod
+    def orienteering(dist: np.ndarray, budget: float, time_budget_s: float = 2.0) -> np.ndarray:
+        """
+        Choose and order stops to visit as many as possible on a closed tour
+        from index 0 no longer than `budget`.
+
+        Greedy insertion builds a tour; each round then shortens it with
+        2-opt/Or-opt, inserts whatever now fits, and perturbs the best tour
+        found by dropping a few stops, until the time budget runs out or
+        MAX_STALLED_ROUNDS rounds bring no improvement.
+
+        Returns:
+            Stop indices in visiting order (possibly empty)
+        """
+        deadline = time.perf_counter() + time_budget_s
+        dist = TourService.padded_matrix(dist, closed=True)
+        # Stops that cannot even be visited alone are never candidates
+        candidates = np.flatnonzero(dist[0] + dist[:, 0] <= budget)
+        candidates = candidates[candidates != 0]
+        rng = np.random.default_rng(0)
+
+        def score(route: np.ndarray) -> Tuple[int, float]:
+            return len(route), -TourService.route_cost(dist, route)
+
+        route = TourService.insert_greedy(dist, np.array([0, 0], dtype=np.int64), candidates, budget)
+        best = route.copy()
+        dropped = np.zeros(0, dtype=np.int64)
+        stalled = 0
+        while time.perf_counter() < deadline and stalled < TourService.MAX_STALLED_ROUNDS:
+            # Fill the freed budget with other stops first, so a perturbation
+            # does not simply put back what it dropped
+            route = TourService.insert_greedy(dist, route, np.setdiff1d(candidates, dropped), budget)
+            TourService.two_opt(dist, route, deadline)
+            TourService.or_opt(dist, route, deadline)
+            route = TourService.insert_greedy(dist, route, candidates, budget)
+            if score(route) > score(best):
+                best, stalled = route.copy(), 0
+            else:
+                stalled += 1
+            if len(best) - 2 == len(candidates) and stalled:
+                break  # Everything fits and the tour no longer shortens
+
+            # Restart from the best tour with a few random stops dropped
+            route = best.copy()
+            if len(route) > 2:
+                size = min(int(rng.integers(1, 4)), len(route) - 2)
+                drop = rng.choice(np.arange(1, len(route) - 1), size=size, replace=False)
+                dropped = route[drop]
+                route = np.delete(route, drop)
+
+        logger.info(f"Orienteering tour: {len(best) - 2} of {len(candidates)} candidate stops, "
+                    f"{TourService.route_cost(dist, best):.2f} km of {budget:.2f} km budget")
+        return best[1:-1]
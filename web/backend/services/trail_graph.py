@@ -0,0 +1,772 @@
+"""
+Trail graph - array-backed (CSR) trail network used for routing queries
+Built once from the simplified NetworkX graph; never mutated afterwards
+"""
+import copy
+import itertools
+from pathlib import Path
+
+import networkx as nx
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, dijkstra, reverse_cuthill_mckee
+from typing import Dict, List, Optional, Tuple
+
+from core.utils import get_logger
+from services.edge_index import EdgeIndex, EdgeSnap
+from services.trail_tags import profile_factors
+from geometry import haversine_points, pack_coords, unpack_coords  # skeleton/geometry.py
+
+logger = get_logger("trail_graph")
+
+
+class TrailGraph:
+    """
+    Immutable array representation of a trail network.
+
+    Nodes are integer ids 0..n-1 with their (lat, lon) in `node_coords`. Edge e
+    joins `edge_u[e]` and `edge_v[e]` with weight `edge_weight[e]` (km) and its
+    trail geometry stored, oriented from u to v, in
+    `geom_coords[geom_offsets[e]:geom_offsets[e + 1]]`. Adjacency is kept in CSR
+    form (`indptr`, `indices`, `csr_edge`) with both directions of every edge.
+
+    Routing never modifies these arrays: query points are added as virtual
+    nodes on a per-query copy of the adjacency (see `search`). Every instance
+    gets a distinct `version`, used to key caches of derived data.
+
+    `edge_length` is the walking length of every edge. It equals `edge_weight`
+    except on views made by `with_weights` (closures, penalties, weight
+    profiles), where searches follow the view's weights and reported lengths
+    use `edge_length`. `edge_tags` holds the uint8 tag code of every edge
+    (see services/trail_tags.py), from which `profile` derives its weights.
+    """
+
+    _versions = itertools.count(1)
+    CURVE_BITS = 16  # Grid resolution (per axis) of the space-filling curve orders
+    STORED_ARRAYS = (
+        "node_coords", "edge_u", "edge_v", "edge_weight", "edge_tags", "geom_offsets",
+        "geom_coords", "geom_along", "indptr", "indices", "csr_edge"
+    )  # Arrays read by `open`
+
+    def __init__(
+        self,
+        node_coords: np.ndarray,
+        edge_u: np.ndarray,
+        edge_v: np.ndarray,
+        edge_weight: np.ndarray,
+        geom_offsets: np.ndarray,
+        geom_coords: np.ndarray,
+        edge_tags: Optional[np.ndarray] = None
+    ):
+        self.node_coords = node_coords
+        self.edge_u = edge_u
+        self.edge_v = edge_v
+        self.edge_weight = edge_weight
+        self.edge_length = edge_weight
+        self.edge_tags = edge_tags if edge_tags is not None else np.zeros(len(edge_u), dtype=np.uint8)
+        self.geom_offsets = geom_offsets
+        self.geom_coords = geom_coords
+
+        # Cumulative distance of every geometry vertex from the start of its edge
+        steps = np.zeros(len(geom_coords))
+        if len(geom_coords) > 1:
+            steps[1:] = haversine_points(geom_coords[:-1], geom_coords[1:])
+        steps[geom_offsets[:-1][geom_offsets[:-1] < len(steps)]] = 0.0
+        cum = np.cumsum(steps)
+        starts = np.repeat(geom_offsets[:-1], np.diff(geom_offsets))
+        self.geom_along = cum - cum[starts] if len(cum) else cum
+        self.edge_geom_length = self.geom_along[geom_offsets[1:] - 1] if self.n_edges else np.zeros(0)
+
+        # CSR adjacency with both directions of every edge
+        edge_ids = np.arange(self.n_edges, dtype=np.int32)
+        rows = np.concatenate([edge_u, edge_v])
+        cols = np.concatenate([edge_v, edge_u])
+        order = np.argsort(rows, kind="stable")
+        self.indices = cols[order].astype(np.int32)
+        self.csr_edge = np.concatenate([edge_ids, edge_ids])[order]
+        self.indptr = np.zeros(self.n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=self.n_nodes), out=self.indptr[1:])
+        self._init_caches()
+
+    def _init_caches(self) -> None:
+        self.version = next(TrailGraph._versions)
+        self._edge_index: Optional[EdgeIndex] = None
+        self._component_labels: Optional[np.ndarray] = None
+        # Optional ShortestPathTreeCache (set by GraphCache) used by `search`
+        self.tree_cache = None
+        # Identity of the segments file the graph was built from (set by GraphCache)
+        self.segments_key: Optional[str] = None
+        # (segments_key, n_nodes, unchanged_nodes mask) of the graph this one updates (set by GraphCache)
+        self.update_of: Optional[Tuple[str, int, np.ndarray]] = None
+        self._profiles: Dict[str, "TrailGraph"] = {}
+
+    def __getstate__(self):
+        # Caches hold locks and are process-local: workers get the arrays only
+        state = self.__dict__.copy()
+        state["tree_cache"] = None
+        state["_profiles"] = {}
+        return state
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.node_coords)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.edge_u)
+
+    @property
+    def masked(self) -> bool:
+        """Whether searches use other weights than the edge lengths"""
+        return self.edge_weight is not self.edge_length
+
+    def with_weights(self, edge_weight: np.ndarray) -> "TrailGraph":
+        """
+        View of this graph with other edge weights (inf closes an edge).
+
+        Shares every array but the weights. The view gets its own version, so
+        cached trees never mix. Closing edges changes what can be snapped onto
+        and what is connected, so such a view builds its own edge index and
+        component labels; otherwise it shares this graph's.
+        """
+        view = copy.copy(self)
+        view.edge_weight = edge_weight
+        view.version = next(TrailGraph._versions)
+        view._profiles = {}
+        if np.isfinite(edge_weight).all():
+            view._edge_index = self.edge_index
+            view._component_labels = self.component_labels
+        else:
+            view._edge_index = None
+            view._component_labels = None
+        # Monument trees were grown on the plain lengths
+        view.segments_key = None
+        return view
+
+    def profile(self, name: str) -> "TrailGraph":
+        """
+        View of this graph weighted by a tag profile (computed once per graph).
+
+        The weights are the edge lengths times the profile's factor for each
+        edge's tag code, kept as float32 (one value per edge per profile).
+        "shortest" is the graph itself.
+
+        Raises:
+            KeyError: If the profile does not exist
+        """
+        if name == "shortest":
+            return self
+        view = self._profiles.get(name)
+        if view is None:
+            weights = (self.edge_length * profile_factors(name)[self.edge_tags]).astype(np.float32)
+            view = self.with_weights(weights)
+            self._profiles[name] = view
+        return view
+
+    @property
+    def versions(self) -> List[int]:
+        """Versions of this graph and of its profile views (for dropping cached trees)"""
+        return [self.version] + [view.version for view in self._profiles.values()]
+
+    @staticmethod
+    def _curve_cells(node_coords: np.ndarray, bits: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Integer (lon, lat) cells of the nodes on a 2^bits x 2^bits grid over their bounding box"""
+        lo = node_coords.min(axis=0)
+        span = np.maximum(node_coords.max(axis=0) - lo, 1e-12)
+        cells = ((node_coords - lo) / span * ((1 << bits) - 1)).astype(np.int64)
+        return cells[:, 1], cells[:, 0]
+
+    @classmethod
+    def hilbert_keys(cls, node_coords: np.ndarray, bits: int = CURVE_BITS) -> np.ndarray:
+        """Position of every node along a Hilbert curve over the graph's bounding box"""
+        x, y = cls._curve_cells(node_coords, bits)
+        n = 1 << bits
+        keys = np.zeros(len(x), dtype=np.int64)
+        s = n >> 1
+        while s > 0:
+            rx = (x & s) > 0
+            ry = (y & s) > 0
+            keys += s * s * ((3 * rx) ^ ry)
+            # Rotate the quadrant so the curve stays continuous
+            flip = ~ry & rx
+            x = np.where(flip, n - 1 - x, x)
+            y = np.where(flip, n - 1 - y, y)
+            x, y = np.where(~ry, y, x), np.where(~ry, x, y)
+            s >>= 1
+        return keys
+
+    @classmethod
+    def morton_keys(cls, node_coords: np.ndarray, bits: int = CURVE_BITS) -> np.ndarray:
+        """Position of every node along a Morton (Z-order) curve over the graph's bounding box"""
+        x, y = cls._curve_cells(node_coords, bits)
+        keys = np.zeros(len(x), dtype=np.int64)
+        for bit in range(bits):
+            keys |= ((x >> bit) & 1) << (2 * bit)
+            keys |= ((y >> bit) & 1) << (2 * bit + 1)
+        return keys
+
+    @classmethod
+    def node_order(cls, node_coords: np.ndarray, edge_u: np.ndarray, edge_v: np.ndarray, method: str) -> np.ndarray:
+        """
+        Renumbering of the nodes (new index → old index) for cache-friendly searches.
+
+        "hilbert" and "morton" sort nodes along a space-filling curve, so nodes
+        close on the map (and in a search frontier) are close in memory;
+        "rcm" is reverse Cuthill-McKee, which minimizes the adjacency bandwidth;
+        "none" keeps the insertion order.
+        """
+        n = len(node_coords)
+        if method == "none" or n == 0:
+            return np.arange(n)
+        if method == "hilbert":
+            return np.argsort(cls.hilbert_keys(node_coords), kind="stable")
+        if method == "morton":
+            return np.argsort(cls.morton_keys(node_coords), kind="stable")
+        if method == "rcm":
+            adjacency = csr_matrix(
+                (np.ones(len(edge_u), dtype=np.int8), (edge_u, edge_v)), shape=(n, n)
+            )
+            return reverse_cuthill_mckee(adjacency, symmetric_mode=False).astype(np.int64)
+        raise ValueError(f"Unknown node order: {method}")
+
+    @classmethod
+    def from_networkx(
+        cls,
+        graph: nx.Graph,
+        node_order: str = "none",
+        previous: Optional["TrailGraph"] = None
+    ) -> "TrailGraph":
+        """
+        Build a TrailGraph from a NetworkX graph with coordinate-key nodes
+        (geometry.pack_coords), as made by GraphService.
+
+        Uses the `weight` and optional `geometry` and `tags` edge attributes
+        produced by GraphService.make_graph / simplify_graph. Self-loops are
+        skipped. Nodes are renumbered by `node_order` (see `node_order`) and
+        edges sorted by their lower endpoint, so the CSR rows, the edge arrays
+        and their geometry follow the same locality.
+
+        With `previous` (the graph an updated NetworkX graph was built into
+        before), every node of `previous` keeps its id, those no longer in
+        `graph` as isolated nodes, and only the new nodes are ordered, after
+        them: trees of parts the update did not touch stay valid (see
+        `unchanged_nodes`).
+        """
+        nodes = list(graph.nodes)
+        kept = 0
+        if previous is not None:
+            old_nodes = pack_coords(previous.node_coords).tolist()
+            known = set(old_nodes)
+            nodes = old_nodes + [node for node in nodes if node not in known]
+            kept = len(old_nodes)
+        index = {node: i for i, node in enumerate(nodes)}
+        node_coords = unpack_coords(nodes)
+        # Geometry ends are unpacked from the same keys, so they compare exactly
+        node_points = node_coords.tolist()
+
+        edge_u, edge_v, weights, tags, parts = [], [], [], [], []
+        for a, b, data in graph.edges(data=True):
+            if a == b:
+                continue
+            geometry = data.get("geometry")
+            if geometry is None:
+                geometry = node_coords[[index[a], index[b]]]
+            elif geometry[0].tolist() != node_points[index[a]]:
+                geometry = geometry[::-1]
+            edge_u.append(index[a])
+            edge_v.append(index[b])
+            weights.append(data.get("weight", 0.0))
+            tags.append(data.get("tags", 0))
+            parts.append(geometry)
+        edge_u = np.array(edge_u, dtype=np.int32)
+        edge_v = np.array(edge_v, dtype=np.int32)
+        weights = np.array(weights, dtype=np.float64)
+        tags = np.array(tags, dtype=np.uint8)
+
+        if node_order != "none" and len(nodes):
+            if kept:
+                # Edges are not needed by the curve orders; "rcm" leaves the new nodes as they come
+                new_order = cls.node_order(
+                    node_coords[kept:], edge_u[:0], edge_v[:0], "none" if node_order == "rcm" else node_order
+                )
+                order = np.concatenate([np.arange(kept), kept + new_order])
+            else:
+                order = cls.node_order(node_coords, edge_u, edge_v, node_order)
+            rank = np.empty(len(order), dtype=np.int32)
+            rank[order] = np.arange(len(order), dtype=np.int32)
+            node_coords = node_coords[order]
+            edge_u, edge_v = rank[edge_u], rank[edge_v]
+            edge_order = np.lexsort((np.maximum(edge_u, edge_v), np.minimum(edge_u, edge_v)))
+            edge_u, edge_v, weights, tags = edge_u[edge_order], edge_v[edge_order], weights[edge_order], tags[edge_order]
+            parts = [parts[i] for i in edge_order]
+
+        lengths = np.array([len(p) for p in parts], dtype=np.int64)
+        geom_offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=geom_offsets[1:])
+        geom_coords = np.concatenate(parts) if parts else np.zeros((0, 2))
+
+        trail_graph = cls(node_coords, edge_u, edge_v, weights, geom_offsets, geom_coords, tags)
+        logger.info(f"Built trail graph arrays: {trail_graph.n_nodes} nodes, {trail_graph.n_edges} edges, "
+                    f"{len(geom_coords)} geometry points")
+        return trail_graph
+
+    @classmethod
+    def stitch(cls, blocks: List[Tuple["TrailGraph", np.ndarray]]) -> "TrailGraph":
+        """
+        Join graphs that meet at shared boundary nodes (tiles) into one graph.
+
+        Each block is a graph plus the sorted ids of its boundary nodes. Blocks
+        keep their node and edge order, one after the other; copies of a
+        boundary node (same coordinate key in several blocks) become its first
+        copy. Only the arrays are concatenated and the boundary nodes matched,
+        so nothing is rebuilt from segments or NetworkX graphs.
+        """
+        node_offsets = np.cumsum([0] + [graph.n_nodes for graph, _ in blocks])
+        geom_offsets = np.cumsum([0] + [len(graph.geom_coords) for graph, _ in blocks])
+        node_coords = np.concatenate([graph.node_coords for graph, _ in blocks]).reshape(-1, 2)
+
+        remap = np.arange(node_offsets[-1], dtype=np.int64)
+        shared = np.concatenate(
+            [np.zeros(0, dtype=np.int64)] + [boundary + offset for (_, boundary), offset in zip(blocks, node_offsets)]
+        ).astype(np.int64)
+        if len(shared):
+            _, first, inverse = np.unique(pack_coords(node_coords[shared]), return_index=True, return_inverse=True)
+            remap[shared] = shared[first][inverse]
+        kept = remap == np.arange(len(remap))
+        remap = (np.cumsum(kept) - 1)[remap]
+
+        def joined(name: str, offsets=None) -> np.ndarray:
+            parts = [getattr(graph, name) for graph, _ in blocks]
+            if offsets is not None:
+                parts = [part + offset for part, offset in zip(parts, offsets)]
+            return np.concatenate(parts)
+
+        edge_u = remap[joined("edge_u", node_offsets[:-1])].astype(np.int32)
+        edge_v = remap[joined("edge_v", node_offsets[:-1])].astype(np.int32)
+        starts = np.concatenate(
+            [graph.geom_offsets[:-1] + offset for (graph, _), offset in zip(blocks, geom_offsets)]
+            + [geom_offsets[-1:]]
+        )
+        trail_graph = cls(
+            node_coords[kept],
+            edge_u,
+            edge_v,
+            joined("edge_length"),
+            starts.astype(np.int64),
+            joined("geom_coords").reshape(-1, 2),
+            joined("edge_tags")
+        )
+        logger.info(f"Stitched {len(blocks)} graphs: {trail_graph.n_nodes} nodes "
+                    f"({len(shared) - int((~kept).sum())} boundary nodes), {trail_graph.n_edges} edges")
+        return trail_graph
+
+    @classmethod
+    def open(cls, directory: Path) -> "TrailGraph":
+        """
+        Map a graph stored by ExternalGraphBuilder (read-only memory maps).
+
+        Its edges are straight two-point segments, so their geometry length is
+        the edge weight; the CSR adjacency is read as stored, not rebuilt.
+        """
+        trail_graph = cls.__new__(cls)
+        for name in cls.STORED_ARRAYS:
+            setattr(trail_graph, name, np.load(directory / f"{name}.npy", mmap_mode="r"))
+        trail_graph.edge_length = trail_graph.edge_weight
+        trail_graph.edge_geom_length = trail_graph.edge_weight
+        trail_graph._init_caches()
+        logger.info(f"Opened trail graph arrays in {directory}: {trail_graph.n_nodes} nodes, "
+                    f"{trail_graph.n_edges} edges")
+        return trail_graph
+
+    # ------------------------------------------------------------------
+    # Snapping
+    # ------------------------------------------------------------------
+
+    @property
+    def edge_index(self) -> EdgeIndex:
+        """Spatial index over edge geometry (built on first use)"""
+        if self._edge_index is None:
+            ends = self.geom_offsets[1:] - 1
+            is_piece = np.ones(len(self.geom_coords), dtype=bool)
+            is_piece[ends] = False  # Last vertex of an edge starts no piece
+            starts = np.flatnonzero(is_piece)
+            piece_edge = np.repeat(np.arange(self.n_edges), np.diff(self.geom_offsets) - 1)
+            # Closed edges are never snapped onto
+            is_open = np.isfinite(self.edge_weight[piece_edge])
+            starts, piece_edge = starts[is_open], piece_edge[is_open]
+            length = np.maximum(self.edge_geom_length[piece_edge], 1e-12)
+            self._edge_index = EdgeIndex(
+                self.geom_coords[starts],
+                self.geom_coords[starts + 1],
+                piece_edge,
+                self.geom_along[starts] / length,
+                self.geom_along[starts + 1] / length
+            )
+        return self._edge_index
+
+    def snap(self, lat: float, lon: float) -> Optional[EdgeSnap]:
+        """Snap a point onto the nearest trail edge (None if the graph has no edges)"""
+        return self.edge_index.snap(lat, lon)
+
+    # ------------------------------------------------------------------
+    # Connected components
+    # ------------------------------------------------------------------
+
+    @property
+    def component_labels(self) -> np.ndarray:
+        """Connected component id (int32) of every node over open edges (computed on first use)"""
+        if self._component_labels is None:
+            # Copy the structure: dropping closed edges must not touch the shared CSR arrays
+            adjacency = csr_matrix(
+                (np.isfinite(self.edge_weight[self.csr_edge]).astype(np.int8), self.indices.copy(), self.indptr.copy()),
+                shape=(self.n_nodes, self.n_nodes)
+            )
+            adjacency.eliminate_zeros()
+            n_components, labels = connected_components(adjacency, directed=False)
+            self._component_labels = labels.astype(np.int32)
+            logger.info(f"Labelled {n_components} connected components")
+        return self._component_labels
+
+    @property
+    def component_sizes(self) -> np.ndarray:
+        """Number of nodes in each connected component, indexed by label"""
+        return np.bincount(self.component_labels)
+
+    def snap_component(self, snap: EdgeSnap) -> int:
+        """Component label of a snapped point (both ends of an edge share it)"""
+        return int(self.component_labels[self.edge_u[snap.edge]])
+
+    def unchanged_nodes(self, previous: "TrailGraph") -> np.ndarray:
+        """
+        Nodes of `previous` whose whole connected component is the same in this
+        graph (built from_networkx with `previous`, so node ids agree): no edge
+        of it was removed or added and its edges kept their weights and tags.
+        Trees rooted there, and distances from there, are the same in both.
+
+        Returns:
+            Boolean mask over the nodes of `previous`
+        """
+        n = max(self.n_nodes, previous.n_nodes)
+
+        def pair_keys(graph: "TrailGraph") -> np.ndarray:
+            lo = np.minimum(graph.edge_u, graph.edge_v).astype(np.int64)
+            return lo * n + np.maximum(graph.edge_u, graph.edge_v)
+
+        old_keys, new_keys = pair_keys(previous), pair_keys(self)
+        _, old_at, new_at = np.intersect1d(old_keys, new_keys, assume_unique=True, return_indices=True)
+        same = (
+            (previous.edge_length[old_at] == self.edge_length[new_at])
+            & (previous.edge_tags[old_at] == self.edge_tags[new_at])
+        )
+        old_changed = np.ones(previous.n_edges, dtype=bool)
+        old_changed[old_at[same]] = False
+        new_changed = np.ones(self.n_edges, dtype=bool)
+        new_changed[new_at[same]] = False
+
+        touched = np.concatenate([
+            previous.edge_u[old_changed], previous.edge_v[old_changed],
+            self.edge_u[new_changed], self.edge_v[new_changed]
+        ]).astype(np.int64)
+        touched = touched[touched < previous.n_nodes]
+        labels = previous.component_labels
+        return ~np.isin(labels, np.unique(labels[touched]))
+
+    # ------------------------------------------------------------------
+    # Shortest paths with virtual nodes
+    # ------------------------------------------------------------------
+
+    def search(self, source: EdgeSnap, limit: float = np.inf) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Run Dijkstra from a snapped point.
+
+        The snap is inserted as a temporary virtual node n joined to both ends
+        of its edge with the edge weight split at the snap position. Only the
+        adjacency row of the virtual node is added, on a copy used for this
+        query alone.
+
+        With a tree cache, the search is answered from the trees of the
+        source edge's ends when both are cached or the edge was searched
+        before (see ShortestPathTreeCache); otherwise it runs once, bounded.
+
+        Args:
+            source: Snapped start point
+            limit: Stop the search at this distance (km)
+
+        Returns:
+            (dist, pred) arrays of length n + 1; index n is the virtual source
+        """
+        cache = self.tree_cache
+        if cache is not None:
+            u, v = int(self.edge_u[source.edge]), int(self.edge_v[source.edge])
+            if (cache.has(self, u) and cache.has(self, v)) or cache.repeated(self, source.edge):
+                return self.search_from_trees(source, limit)
+        dist, pred = self.search_many([source], limit, return_predecessors=True)
+        return dist[0], pred[0]
+
+    def node_tree(self, node: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Full (unbounded) shortest-path tree from a graph node: (dist, pred)"""
+        matrix = csr_matrix(
+            (self.edge_weight[self.csr_edge], self.indices, self.indptr),
+            shape=(self.n_nodes, self.n_nodes)
+        )
+        dist, pred = dijkstra(matrix, directed=True, indices=node, return_predecessors=True)
+        return dist, pred.astype(np.int32)
+
+    def search_from_trees(self, source: EdgeSnap, limit: float = np.inf) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Same result as `search`, combined from the cached trees of the source
+        edge's end nodes.
+
+        Every path from the virtual source leaves through u or v, so the
+        distance to a node is the shorter of w * t + dist_u and
+        w * (1 - t) + dist_v, and its predecessor comes from that tree.
+        """
+        n = self.n_nodes
+        e = source.edge
+        w = self.edge_weight[e]
+        u, v = int(self.edge_u[e]), int(self.edge_v[e])
+        dist_u, pred_u = self.tree_cache.get(self, u)
+        dist_v, pred_v = self.tree_cache.get(self, v)
+
+        via_u = dist_u + w * source.t
+        via_v = dist_v + w * (1.0 - source.t)
+        use_u = via_u <= via_v
+        dist = np.append(np.where(use_u, via_u, via_v), 0.0)
+        pred = np.append(np.where(use_u, pred_u, pred_v), -9999).astype(np.int32)
+        # Tree roots hang off the virtual source
+        if use_u[u]:
+            pred[u] = n
+        if not use_u[v]:
+            pred[v] = n
+
+        beyond = dist > limit
+        dist[beyond] = np.inf
+        pred[beyond] = -9999
+        return dist, pred
+
+    def search_many(
+        self,
+        sources: List[EdgeSnap],
+        limit: float = np.inf,
+        return_predecessors: bool = False
+    ):
+        """
+        Run Dijkstra from several snapped points in one call.
+
+        Source i becomes virtual node n + i. Virtual nodes only have outgoing
+        edges, so no search can pass through another source's virtual node.
+
+        Returns:
+            dist array of shape (k, n + k), plus the matching pred array when
+            return_predecessors is set
+        """
+        n, k = self.n_nodes, len(sources)
+        edges = np.array([s.edge for s in sources], dtype=np.int64)
+        ts = np.array([s.t for s in sources], dtype=np.float64)
+        w = self.edge_weight[edges]
+        weights = self.edge_weight[self.csr_edge]
+        matrix = csr_matrix(
+            (
+                np.concatenate([weights, np.column_stack([w * ts, w * (1.0 - ts)]).ravel()]),
+                np.concatenate([self.indices, np.column_stack([self.edge_u[edges], self.edge_v[edges]]).ravel()]),
+                np.concatenate([self.indptr, self.indptr[-1] + 2 * np.arange(1, k + 1)])
+            ),
+            shape=(n + k, n + k)
+        )
+        result = dijkstra(
+            matrix, directed=True, indices=np.arange(n, n + k),
+            return_predecessors=return_predecessors, limit=limit
+        )
+        if return_predecessors:
+            return result[0].reshape(k, -1), result[1].reshape(k, -1)
+        return result.reshape(k, -1)
+
+    def distance_to(self, dist: np.ndarray, source: EdgeSnap, target: EdgeSnap) -> Tuple[float, int]:
+        """
+        Distance from the search source to a snapped target (a virtual target node).
+
+        Returns:
+            (distance_km, via) where via is the edge end node the route enters the
+            target edge from, or -1 when the target is reached along the source edge
+        """
+        e = target.edge
+        w = self.edge_weight[e]
+        u, v = int(self.edge_u[e]), int(self.edge_v[e])
+        best, via = dist[u] + w * target.t, u
+        if dist[v] + w * (1.0 - target.t) < best:
+            best, via = dist[v] + w * (1.0 - target.t), v
+        if e == source.edge and abs(source.t - target.t) * w <= best:
+            best, via = abs(source.t - target.t) * w, -1
+        return float(best), via
+
+    def distances_to_many(
+        self,
+        dist: np.ndarray,
+        sources: List[EdgeSnap],
+        targets: List[EdgeSnap]
+    ) -> np.ndarray:
+        """
+        Distances from every source of a search_many call to every snapped target.
+
+        Returns:
+            (k, m) array of distances in km (inf when unreachable within the limit)
+        """
+        src_edges = np.array([s.edge for s in sources], dtype=np.int64)
+        src_ts = np.array([s.t for s in sources], dtype=np.float64)
+        edges = np.array([t.edge for t in targets], dtype=np.int64)
+        ts = np.array([t.t for t in targets], dtype=np.float64)
+        w = self.edge_weight[edges]
+        result = np.minimum(
+            dist[:, self.edge_u[edges]] + w * ts,
+            dist[:, self.edge_v[edges]] + w * (1.0 - ts)
+        )
+        # Targets on a source's own edge can be reached directly along it
+        same = src_edges[:, None] == edges[None, :]
+        direct = np.abs(src_ts[:, None] - ts[None, :]) * w
+        return np.where(same, np.minimum(result, direct), result)
+
+    def path_lengths(self, dist: np.ndarray, pred: np.ndarray, sources: List[EdgeSnap]) -> np.ndarray:
+        """
+        Walking length (`edge_length`) of every path of a search_many call,
+        which differs from its cost `dist` on weighted views.
+
+        The length of each tree edge is found from the (lightest) edge joining
+        a node to its predecessor and summed up the tree by pointer doubling.
+
+        Returns:
+            (k, n + k) array of km (inf where unreachable)
+        """
+        n, k = self.n_nodes, len(sources)
+        lo = np.minimum(self.edge_u, self.edge_v).astype(np.int64)
+        hi = np.maximum(self.edge_u, self.edge_v).astype(np.int64)
+        order = np.lexsort((self.edge_weight, hi, lo))
+        keys = (lo * n + hi)[order]
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+        pair_keys, pair_edge = keys[first], order[first]
+
+        nodes = np.broadcast_to(np.arange(n + k), pred.shape)
+        parent = pred.astype(np.int64)
+        step = np.zeros(pred.shape)
+        inner = (parent >= 0) & (parent < n)
+        a, b = parent[inner], nodes[inner]
+        step[inner] = self.edge_length[pair_edge[np.searchsorted(pair_keys, np.minimum(a, b) * n + np.maximum(a, b))]]
+        # Tree roots hang off the virtual sources, part of the source edge away
+        rows, cols = np.nonzero(parent >= n)
+        edges = np.array([s.edge for s in sources], dtype=np.int64)[rows]
+        ts = np.array([s.t for s in sources], dtype=np.float64)[rows]
+        step[rows, cols] = self.edge_length[edges] * np.where(cols == self.edge_u[edges], ts, 1.0 - ts)
+
+        parent = np.where(parent >= 0, parent, nodes)
+        row = np.arange(k)[:, None]
+        for _ in range(int(np.ceil(np.log2(n + k))) + 1):
+            step = step + step[row, parent]
+            parent = parent[row, parent]
+        step[~np.isfinite(dist)] = np.inf
+        return step
+
+    def lengths_to_many(
+        self,
+        dist: np.ndarray,
+        lengths: np.ndarray,
+        sources: List[EdgeSnap],
+        targets: List[EdgeSnap]
+    ) -> np.ndarray:
+        """
+        Walking lengths of the cheapest paths (see distances_to_many) from every
+        source of a search_many call to every snapped target.
+
+        Returns:
+            (k, m) array of km (inf when unreachable within the limit)
+        """
+        src_edges = np.array([s.edge for s in sources], dtype=np.int64)
+        src_ts = np.array([s.t for s in sources], dtype=np.float64)
+        edges = np.array([t.edge for t in targets], dtype=np.int64)
+        ts = np.array([t.t for t in targets], dtype=np.float64)
+        u, v = self.edge_u[edges], self.edge_v[edges]
+        w, length = self.edge_weight[edges], self.edge_length[edges]
+        via_u = dist[:, u] + w * ts
+        via_v = dist[:, v] + w * (1.0 - ts)
+        result = np.where(via_u <= via_v, lengths[:, u] + length * ts, lengths[:, v] + length * (1.0 - ts))
+        # Targets on a source's own edge can be reached directly along it
+        same = src_edges[:, None] == edges[None, :]
+        direct = same & (np.abs(src_ts[:, None] - ts[None, :]) * w <= np.minimum(via_u, via_v))
+        result = np.where(direct, np.abs(src_ts[:, None] - ts[None, :]) * length, result)
+        result[~np.isfinite(np.minimum(via_u, via_v)) & ~direct] = np.inf
+        return result
+
+    def node_path(self, pred: np.ndarray, node: int) -> List[int]:
+        """Node ids from the virtual source (excluded) to `node`, following predecessors"""
+        n = self.n_nodes
+        path = []
+        while 0 <= node < n:
+            path.append(node)
+            node = int(pred[node])
+        return path[::-1]
+
+    def edge_between(self, a: int, b: int) -> int:
+        """Lightest edge id joining nodes a and b"""
+        lo, hi = self.indptr[a], self.indptr[a + 1]
+        candidates = self.csr_edge[lo:hi][self.indices[lo:hi] == b]
+        return int(candidates[np.argmin(self.edge_weight[candidates])])
+
+    def edge_polyline(self, e: int, t0: float = 0.0, t1: float = 1.0) -> np.ndarray:
+        """
+        Geometry of edge e between fractions t0 and t1 (reversed when t0 > t1).
+
+        Cut points are interpolated linearly inside the geometry piece they fall on.
+        """
+        lo, hi = self.geom_offsets[e], self.geom_offsets[e + 1]
+        coords = self.geom_coords[lo:hi]
+        along = self.geom_along[lo:hi] / max(self.edge_geom_length[e], 1e-12)
+        reverse = t0 > t1
+        a, b = (t1, t0) if reverse else (t0, t1)
+        inside = coords[(along > a) & (along < b)]
+        start = np.array([np.interp(a, along, coords[:, 0]), np.interp(a, along, coords[:, 1])])
+        end = np.array([np.interp(b, along, coords[:, 0]), np.interp(b, along, coords[:, 1])])
+        polyline = np.vstack([start, inside, end])
+        return polyline[::-1] if reverse else polyline
+
+    def route_pieces(
+        self,
+        pred: np.ndarray,
+        source: EdgeSnap,
+        target: EdgeSnap,
+        via: int
+    ) -> List[Tuple[int, float, float]]:
+        """
+        Describe the route to a target as (edge, t_from, t_to) pieces.
+
+        Full edges have t_from/t_to in {0, 1}; the first and last pieces are the
+        partial edges between the virtual nodes and the graph.
+        """
+        if via == -1:
+            return [(source.edge, source.t, target.t)]
+        return self.path_pieces(source, target, self.node_path(pred, via))
+
+    def path_pieces(
+        self,
+        source: EdgeSnap,
+        target: EdgeSnap,
+        nodes: List[int]
+    ) -> List[Tuple[int, float, float]]:
+        """Pieces of the route from a snapped source through graph `nodes` to a snapped target"""
+        pieces = []
+        first = nodes[0]
+        pieces.append((source.edge, source.t, 0.0 if first == self.edge_u[source.edge] else 1.0))
+        for a, b in zip(nodes[:-1], nodes[1:]):
+            e = self.edge_between(a, b)
+            pieces.append((e, 0.0, 1.0) if self.edge_u[e] == a else (e, 1.0, 0.0))
+        last = nodes[-1]
+        pieces.append((target.edge, 0.0 if last == self.edge_u[target.edge] else 1.0, target.t))
+        return pieces
+
+    def pieces_length(self, pieces: List[Tuple[int, float, float]]) -> float:
+        """Walking length (km) of route pieces"""
+        return float(sum(self.edge_length[e] * abs(t1 - t0) for e, t0, t1 in pieces))
+
+    def pieces_polyline(self, pieces: List[Tuple[int, float, float]]) -> np.ndarray:
+        """Concatenate the geometry of route pieces into one (lat, lon) polyline"""
+        parts = [self.edge_polyline(e, t0, t1) for e, t0, t1 in pieces]
+        # Consecutive pieces share their junction point; keep it once
+        return np.concatenate([parts[0]] + [part[1:] for part in parts[1:]])
@@ -0,0 +1,57 @@
+"""
+Trail tags - compact per-segment codes for the OSM tags routing cares about,
+and the weight profiles derived from them
+"""
+from typing import Any, Dict
+
+import numpy as np
+
+# One uint8 per segment/edge: bits 0-1 highway, bit 2 marked, bits 3-5 tracktype grade
+HIGHWAY_CODES = {"path": 1, "footway": 2, "track": 3}
+HIGHWAY_MASK = 0b11
+MARKED = 0b100
+GRADE_SHIFT = 3
+UNKNOWN = 0  # Segments from the GPX fallback or from files written before tags were kept
+
+# Weight factor per decoded tag; an edge weighs its length times the product.
+# Only grade 1-3 tracks are downloaded (OverpassService), so grades get no factor
+PROFILES: Dict[str, Dict[str, Any]] = {
+    "shortest": {},
+    "prefer_marked": {"unmarked": 1.5},
+    "avoid_tracks": {"track": 2.0},
+}
+
+
+def encode_tags(tags: Dict[str, str], marked: bool = False) -> int:
+    """Code of an OSM way from its tags and whether it belongs to a hiking route"""
+    code = HIGHWAY_CODES.get(tags.get("highway", ""), 0)
+    if marked or "osmc:symbol" in tags:
+        code |= MARKED
+    tracktype = tags.get("tracktype", "")
+    if tracktype.startswith("grade") and tracktype[5:].isdigit() and 1 <= int(tracktype[5:]) <= 5:
+        code |= int(tracktype[5:]) << GRADE_SHIFT
+    return code
+
+
+def merge_tags(a: int, b: int) -> int:
+    """Code of a segment shared by two ways: the first one's, marked if either is"""
+    return a | (b & MARKED)
+
+
+def profile_factors(name: str) -> np.ndarray:
+    """
+    Weight factor of every possible code under a profile (float32 lookup table).
+
+    Raises:
+        KeyError: If the profile does not exist
+    """
+    profile = PROFILES[name]
+    codes = np.arange(256)
+    highway = codes & HIGHWAY_MASK
+    factors = np.ones(256, dtype=np.float32)
+    if "unmarked" in profile:
+        # Only penalize edges whose tags are known
+        factors[(highway > 0) & (codes & MARKED == 0)] *= profile["unmarked"]
+    if "track" in profile:
+        factors[highway == HIGHWAY_CODES["track"]] *= profile["track"]
+    return factors